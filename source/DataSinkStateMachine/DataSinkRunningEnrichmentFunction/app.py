@@ -13,26 +13,21 @@
  # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
  # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
-import os
-import json
-import logging
+from spot_dashboard import logs, stages
 
-from botocore.exceptions import ClientError
-
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = logs.get_logger()
 
 def enrich_instance_metadata(instance):
 
-    # Extend this function to enrich Instance Metadata
-
-    logger.info(instance)
-    return instance
+    # Extend spot_dashboard.stages.enrich_running_instance to enrich Instance Metadata, the
+    # in-process Data Sink mode of the DataSinkTriggerFunction runs the same stage
+    return stages.enrich_running_instance(instance)
 
 def lambda_handler(event, context):
 
-    logger.info(event)
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
 
     instance = event['instance']
     enriched_instance = enrich_instance_metadata(instance)
@@ -13,87 +13,24 @@
  # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
  # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
-import os
-import json
-import logging
+from spot_dashboard import logs, stages
 
-from botocore.exceptions import ClientError
-
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-from aws_embedded_metrics import metric_scope
-from aws_embedded_metrics.config import get_config
-
-Config = get_config()
-Config.service_name = "EC2SpotDashboard"
-Config.service_type = "Instance"
-Config.log_group_name = "EC2SpotDashboard"
-
-cloudwatch = boto3.client('cloudwatch')
-
-@metric_scope
-def put_instance_metric(instance, metrics):
-
-    try:
-        metrics.set_namespace("EC2SpotDashboard")
-        metrics.set_dimensions(
-            { 
-                "InstanceType": instance['InstanceType']
-            })
-        metrics.put_metric("Launches", 1, "Count")
-        metrics.set_property("Region", instance['Region'])
-        metrics.set_property("AvailabilityZone", instance['AvailabilityZone'])
-        metrics.set_property("InstanceType", instance['InstanceType'])
-
-        for tag in instance['Tags']:
-            metrics.set_property(tag['Key'], tag['Value'])
-
-    except ClientError as e:
-        message = 'Error sending CloudWatch Metric: {}'.format(e)
-        logger.info(message)
-        raise Exception(message)
-    
-    return
-
-@metric_scope
-def put_availabilityzone_metric(instance, metrics):
-
-    try:
-        metrics.set_namespace("EC2SpotDashboard")
-        metrics.set_dimensions(
-            { 
-                "AvailabilityZone": instance['AvailabilityZone']
-            })
-        metrics.put_metric("Launches", 1, "Count")
-        metrics.set_property("Region", instance['Region'])
-        metrics.set_property("AvailabilityZone", instance['AvailabilityZone'])
-        metrics.set_property("InstanceType", instance['InstanceType'])
-
-        for tag in instance['Tags']:
-            metrics.set_property(tag['Key'], tag['Value'])
-
-    except ClientError as e:
-        message = 'Error sending CloudWatch Metric: {}'.format(e)
-        logger.info(message)
-        raise Exception(message)
-
-    return
+logger = logs.get_logger()
 
 def lambda_handler(event, context):
 
-    logger.info(event)
-
-    instance = event['instance']
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
 
-    if instance['InstanceLifecycle'] == "spot":
-        logger.info("Instance is a Spot Instance, sending CloudWatch Metrics")
-        put_instance_metric(instance)
-        put_availabilityzone_metric(instance)
+    # The state machine hands over a batch of instances, or a single instance
+    if 'instances' in event:
+        instances = event['instances']
     else:
-        logger.info("Instance is an On-Demand Instance, skipping sending CloudWatch Metrics")
+        instances = [event['instance']]
+
+    stages.sink_running_instances(instances)
 
     # End
     logger.info('Execution Complete')
-    return
\ No newline at end of file
+    return
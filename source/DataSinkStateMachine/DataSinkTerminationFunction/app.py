@@ -13,47 +13,27 @@
  # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
  # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
-import os
-import json
-import logging
+from spot_dashboard import logs, stages
 
-from botocore.exceptions import ClientError
+logger = logs.get_logger()
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-firehose = boto3.client('firehose')
-
-instance_metadata_stream = os.environ['INSTANCE_METADATA_STREAM']
-
-def sink_instance_data_to_firehose(instance):
-
-    try:
-        # Send Event to Firehose
-        response = firehose.put_record(
-            DeliveryStreamName=instance_metadata_stream,
-            Record={
-                'Data': json.dumps(instance)+"\n"
-            }
-        )
-        logger.info(response)
-        return instance
-
-    except ClientError as e:
-        message = 'Error sending instance data to Kinesis Firehose: {}'.format(e)
-        logger.info(message)
-        raise Exception(message)
-
-    return
+def sink_instance_data_to_firehose(instances):
+    return stages.sink_terminated_instances(instances)
 
 def lambda_handler(event, context):
 
-    logger.info(event)
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
 
-    instance = event['instance']
-    sink_instance_data_to_firehose(instance)
+    # The state machine hands over a batch of instances, or a single instance
+    if 'instances' in event:
+        instances = event['instances']
+    else:
+        instances = [event['instance']]
+
+    sink_instance_data_to_firehose(instances)
 
     # End
     logger.info('Execution Complete')
-    return
\ No newline at end of file
+    return
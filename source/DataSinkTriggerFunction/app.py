@@ -13,50 +13,222 @@
  # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
  # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
 import os
 import json
-import logging
 
-from botocore.exceptions import ClientError
-from dynamodb_json import json_util as dynamodb_json
+from spot_dashboard import clients, logs
+from spot_dashboard.idempotency import idempotency_store, event_key
+from spot_dashboard import windows
+from spot_dashboard.stream_images import decode_image
+from spot_dashboard.stream_filters import is_data_sink_record
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = logs.get_logger()
 
 data_sink_state_machine_arn = os.environ['DATA_SINK_STATE_MACHINE_ARN']
+data_sink_batch_mode = os.environ.get('DATA_SINK_BATCH_MODE', 'true').lower() == 'true'
+data_sink_mode = os.environ.get('DATA_SINK_MODE', 'StateMachine')
 
-stepfunctions = boto3.client('stepfunctions')
+# Step Functions limits execution input to 256 KB. Leave headroom for the enrichment
+# results the state machine adds to each instance while it fans out.
+execution_input_max_bytes = int(os.environ.get('DATA_SINK_EXECUTION_INPUT_MAX_BYTES', 192*1024))
+
+def start_execution(execution_input):
+
+    try:
+        logger.debug('Attempting to Execute State Machine', StateMachineArn=data_sink_state_machine_arn)
+        response = clients.client('stepfunctions').start_execution(
+            stateMachineArn=data_sink_state_machine_arn,
+            input=json.dumps(execution_input)
+            )
+        logger.info('Started execution', ExecutionArn=response['executionArn'], Instances=len(execution_input.get('instances', [execution_input.get('instance')])))
+    except Exception as e:
+        message = 'Error executing State Machine: {}'.format(e)
+        logger.error(message)
+        raise Exception(message)
+
+def run_stages(instances):
+
+    # The routing, enrichment and sinks of the state machine, without leaving the function
+    from spot_dashboard import stages
+
+    try:
+        result = stages.run(instances)
+    except Exception as e:
+        message = 'Error running data sink stages: {}'.format(e)
+        logger.error(message)
+        raise Exception(message)
+
+    return result
+
+def claim_records(records, context):
+
+    # Drops instance events already sent by an earlier delivery of the record, or repeated
+    # within the batch, before any execution or sink. The claims are IN_PROGRESS until the
+    # end of the invocation, a retry after a timeout or crash claims them again.
+    keys = [event_key(instance) for sequence_number, instance in records]
+    claimed = set(idempotency_store.claim(keys, context.get_remaining_time_in_millis() / 1000.0))
+
+    unique_records = []
+    for key, (sequence_number, instance) in zip(keys, records):
+        if key in claimed:
+            claimed.discard(key)
+            unique_records.append((sequence_number, instance, key))
+
+    if len(unique_records) < len(records):
+        logger.info('Dropped duplicate records', Duplicates=len(records) - len(unique_records), Records=len(records))
+    logger.debug('Idempotency store', **idempotency_store.stats())
+
+    return unique_records
+
+def release_records(records):
+    # Records Lambda delivers again are claimed again by the retry
+    idempotency_store.release([key for sequence_number, instance, key in records])
+
+def complete_records(records):
+    # Records whose execution started or whose sinks returned are kept for the TTL
+    idempotency_store.complete([key for sequence_number, instance, key in records])
+
+def split_window_records(records):
+
+    # With a tumbling window, launches and interruptions are only counted in the window
+    # state, terminations are still archived through the Data Sink
+    from spot_dashboard.stages import route
+
+    forwarded = []
+    counted = []
+    for sequence_number, instance in records:
+        name = route(instance)
+        if name in ('running', 'interruption'):
+            counter = windows.window_counter(instance, name)
+            if counter is not None:
+                counted.append((sequence_number, counter[0], counter[1], instance))
+        else:
+            forwarded.append((sequence_number, instance))
+
+    return forwarded, counted
+
+def window_state(event, counted, batch_item_failures):
+
+    # Records from the first failure onwards are delivered again and counted then
+    if batch_item_failures:
+        failed = int(batch_item_failures[0]['itemIdentifier'])
+        counted = [record for record in counted if int(record[0]) < failed]
+
+    state = windows.add_instances(event.get('state'), [(counter, event_time, instance) for sequence_number, counter, event_time, instance in counted])
+    logger.info('Window state', WindowStart=event['window']['start'], Counted=len(counted), Counts=len(state['Counts']), Final=windows.is_final_invoke(event))
+
+    if windows.is_final_invoke(event):
+        try:
+            windows.flush_window(state, event['window'], event.get('shardId'))
+        except Exception as e:
+            # The whole invocation is retried with the state of the previous invocation
+            message = 'Error closing window: {}'.format(e)
+            logger.error(message)
+            raise Exception(message)
+        state = {}
+
+    return state
+
+def batch_records(records):
+
+    # Group consecutive records into executions that fit within the input size limit
+    batch = []
+    batch_size = 0
+
+    for record in records:
+        instance_size = len(json.dumps(record[1])) + 1
+
+        if batch and batch_size + instance_size > execution_input_max_bytes:
+            yield batch
+            batch = []
+            batch_size = 0
+
+        batch.append(record)
+        batch_size += instance_size
+
+    if batch:
+        yield batch
 
 def lambda_handler(event, context):
 
-    logger.info(event)
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
+
+    records = []
+    batch_item_failures = []
 
     for record in event['Records']:
-        if record['eventName'] == 'MODIFY':
+        if is_data_sink_record(record):
             item = record['dynamodb']['NewImage']
-            logger.info(item)
-
-            if "InstanceMetadataEnriched" in item:
-                if item['InstanceMetadataEnriched']['BOOL'] == True:
-
-                    if item['LastEventType']['S'] == 'state-change' or item['LastEventType']['S'] == 'spot-interruption':
-                        execution_input = {
-                            'instance': dynamodb_json.loads(item)
-                        }
-                        
-                        try:
-                            logger.info('Attempting to Execute State Machine: {}'.format(data_sink_state_machine_arn))
-                            response = stepfunctions.start_execution(
-                                stateMachineArn=data_sink_state_machine_arn,
-                                input=json.dumps(execution_input)
-                                )
-                            logger.info('Execution Response: {}'.format(response))
-                        except Exception as e:
-                            message = 'Error executing State Machine: {}'.format(e)
-                            logger.info(message)
-                            raise Exception(message)
+            logger.debug('Item', Item=item)
+            records.append((record['dynamodb']['SequenceNumber'], decode_image(item)))
+
+    counted = []
+    if windows.is_window_event(event):
+        records, counted = split_window_records(records)
+
+    if records:
+        try:
+            records = claim_records(records, context)
+        except Exception as e:
+            logger.error('Error claiming records', Error=str(e))
+            batch_item_failures.append({'itemIdentifier': records[0][0]})
+            records = []
+
+    if data_sink_mode == 'InProcess' and records:
+        # Enrichment failures are dropped as in the state machine. When a sink fails, Lambda
+        # retries from the first record it did not sink, the records sunk already are dropped
+        # as duplicates by the retry.
+        try:
+            result = run_stages([instance for sequence_number, instance, key in records])
+            pending = set(id(instance) for instance in result['pending'])
+        except Exception:
+            pending = set(id(instance) for sequence_number, instance, key in records)
+        complete_records([record for record in records if id(record[1]) not in pending])
+        if pending:
+            retried = [record for record in records if id(record[1]) in pending]
+            release_records(retried)
+            batch_item_failures.append({'itemIdentifier': retried[0][0]})
+    elif data_sink_batch_mode:
+        # One execution per batch, the state machine fans out with a Map state
+        started = 0
+        for batch in batch_records(records):
+            try:
+                start_execution({
+                    'instances': [instance for sequence_number, instance, key in batch]
+                })
+                started += len(batch)
+            except Exception:
+                # Lambda retries the stream from the first failed record onwards
+                release_records(records[started:])
+                batch_item_failures.append({'itemIdentifier': batch[0][0]})
+                break
+        complete_records(records[:started])
+    else:
+        started = 0
+        for sequence_number, instance, key in records:
+            try:
+                start_execution({
+                    'instance': instance
+                })
+                started += 1
+            except Exception:
+                release_records(records[started:])
+                batch_item_failures.append({'itemIdentifier': sequence_number})
+                break
+        complete_records(records[:started])
+
+    if windows.is_window_event(event):
+        state = window_state(event, counted, batch_item_failures)
+        logger.info('Execution Complete')
+        return {
+            'state': state,
+            'batchItemFailures': batch_item_failures
+        }
 
     # End
     logger.info('Execution Complete')
-    return
\ No newline at end of file
+    return {
+        'batchItemFailures': batch_item_failures
+    }
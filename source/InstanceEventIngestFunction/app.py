@@ -0,0 +1,101 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import json
+
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from spot_dashboard import clients, logs
+from spot_dashboard.instance_events import instance_update, coalesce_updates
+from spot_dashboard.update_plans import update_coalesced
+
+logger = logs.get_logger()
+
+instance_metadata_table = os.environ['INSTANCE_METADATA_TABLE']
+item_retention_days = os.environ['INSTANCE_METADATA_ITEM_RETENTION_DAYS']
+item_expiration_days = int(item_retention_days)*60*60*24
+instance_metadata_write_concurrency = int(os.environ.get('INSTANCE_METADATA_WRITE_CONCURRENCY', 10))
+
+executor = ThreadPoolExecutor(max_workers=instance_metadata_write_concurrency)
+
+def update_instance(writes):
+
+    # Writes for one instance are applied in order, returns the writes that did not complete
+    dynamodb = clients.client('dynamodb', max_pool_connections=instance_metadata_write_concurrency)
+
+    for index, write in enumerate(writes):
+        logger.debug('Write', Write=write)
+        try:
+            response=update_coalesced(dynamodb, instance_metadata_table, write)
+
+            logger.debug('Response', Response=response)
+        except ClientError as e:
+            logger.error('Error updating instance in DynamoDB', InstanceId=write['InstanceId'], Error=str(e))
+            return writes[index:]
+
+    return []
+
+def lambda_handler(event, context):
+
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
+
+    updates = []
+    batch_item_failures = []
+
+    # Transform EventBridge Events
+    for record in event['Records']:
+        try:
+            update = instance_update(json.loads(record['body']), item_expiration_days)
+        except (ValueError, KeyError) as e:
+            logger.warning('Reporting unreadable message', MessageId=record['messageId'], Error=str(e))
+            batch_item_failures.append({'itemIdentifier': record['messageId']})
+            continue
+
+        if update is None:
+            logger.debug('Skipping message', MessageId=record['messageId'])
+            continue
+
+        update['MessageId'] = record['messageId']
+        updates.append(update)
+
+    # One write per instance, or one per Data Sink event when several arrive together
+    writes = coalesce_updates(updates)
+    logger.info('Coalesced events', Events=len(updates), Writes=sum(len(instance_writes) for instance_writes in writes.values()), Instances=len(writes))
+
+    futures = {
+        executor.submit(update_instance, instance_writes): instance_id
+        for instance_id, instance_writes in writes.items()
+    }
+
+    for future, instance_id in futures.items():
+        try:
+            failed_writes = future.result()
+        except Exception as e:
+            logger.error('Error updating instance', InstanceId=instance_id, Error=str(e))
+            failed_writes = writes[instance_id]
+
+        # SQS redelivers the events of the failed write and of the writes after it
+        for write in failed_writes:
+            for update in write['Updates']:
+                batch_item_failures.append({'itemIdentifier': update['MessageId']})
+
+    # End
+    logger.info('Execution Complete')
+    return {
+        'batchItemFailures': batch_item_failures
+    }
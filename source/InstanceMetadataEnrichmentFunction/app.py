@@ -13,19 +13,35 @@
  # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
  # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
 import os
-import json
-import logging
+import time
+import random
 
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from spot_dashboard import clients, logs
+from spot_dashboard.tags import filter_tags
+from spot_dashboard.stream_images import attribute
+from spot_dashboard.stream_filters import is_enrichment_record
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = logs.get_logger()
 
-instance_metadata_table = boto3.resource('dynamodb').Table(os.environ['INSTANCE_METADATA_TABLE'])
+instance_metadata_table = os.environ['INSTANCE_METADATA_TABLE']
+instance_metadata_write_concurrency = int(os.environ.get('INSTANCE_METADATA_WRITE_CONCURRENCY', 10))
 
-ec2 = boto3.client('ec2')
+executor = ThreadPoolExecutor(max_workers=instance_metadata_write_concurrency)
+
+# Instances are described in chunks on a separate pool, the write workers wait on them
+describe_instances_chunk_size = int(os.environ.get('DESCRIBE_INSTANCES_CHUNK_SIZE', 100))
+describe_instances_concurrency = int(os.environ.get('DESCRIBE_INSTANCES_CONCURRENCY', 4))
+describe_instances_max_attempts = int(os.environ.get('DESCRIBE_INSTANCES_MAX_ATTEMPTS', 4))
+describe_instances_retry_base_seconds = float(os.environ.get('DESCRIBE_INSTANCES_RETRY_BASE_SECONDS', 0.5))
+describe_instances_retry_max_seconds = float(os.environ.get('DESCRIBE_INSTANCES_RETRY_MAX_SECONDS', 8))
+
+# Time kept back from the function timeout for the writes after the last describe attempt
+describe_instances_reserved_seconds = float(os.environ.get('DESCRIBE_INSTANCES_RESERVED_SECONDS', 10))
+
+describe_executor = ThreadPoolExecutor(max_workers=describe_instances_concurrency)
 
 def paginate(method, **kwargs):
     client = method.__self__
@@ -38,15 +54,16 @@ def paginate(method, **kwargs):
 
     except ClientError as e:
         message = 'Error describing instances: {}'.format(e)
-        logger.info(message)
+        logger.error(message)
         raise Exception(message)
 
-def describe_instances(instance_ids):
+def describe_instances_chunk(instance_ids):
     described_instances = []
 
-    response = paginate(ec2.describe_instances, InstanceIds=instance_ids)
-
-    logger.info(response)
+    # An instance-id filter leaves out instances EC2 does not know (yet), where InstanceIds
+    # fails the whole request with InvalidInstanceID.NotFound
+    ec2 = clients.client('ec2', max_pool_connections=describe_instances_concurrency)
+    response = paginate(ec2.describe_instances, Filters=[{'Name': 'instance-id', 'Values': instance_ids}])
 
     for item in response:
         for instance in item['Instances']:
@@ -54,74 +71,185 @@ def describe_instances(instance_ids):
 
     return described_instances
 
+def describe_instances(instance_ids, deadline=None):
+
+    # Returns the described instances, the IDs still missing after the last attempt, and the
+    # IDs whose request failed. Only the missing IDs are described again, with jittered
+    # exponential backoff, as long as the sleep ends before the deadline.
+    described_instances = []
+    failed_ids = []
+    pending = list(dict.fromkeys(instance_ids))
+
+    for attempt in range(describe_instances_max_attempts):
+        if attempt > 0:
+            delay = random.uniform(0, min(describe_instances_retry_max_seconds, describe_instances_retry_base_seconds * 2 ** (attempt - 1)))
+            if deadline is not None and time.time() + delay > deadline:
+                break
+            time.sleep(delay)
+
+        chunks = [pending[index:index + describe_instances_chunk_size] for index in range(0, len(pending), describe_instances_chunk_size)]
+        futures = [(chunk, describe_executor.submit(describe_instances_chunk, chunk)) for chunk in chunks]
+
+        described_ids = set()
+        for chunk, future in futures:
+            try:
+                for instance in future.result():
+                    described_instances.append(instance)
+                    described_ids.add(instance['InstanceId'])
+            except Exception as e:
+                logger.error('Describing instances failed', InstanceIds=len(chunk), Error=str(e))
+                failed_ids.extend(chunk)
+                described_ids.update(chunk)
+
+        pending = [instance_id for instance_id in pending if instance_id not in described_ids]
+        if not pending:
+            break
+
+        logger.info('Instances not found', Attempt=attempt + 1, Missing=len(pending), InstanceIds=pending[:logs.summary_max_instance_ids])
+
+    return described_instances, pending, failed_ids
+
+def mark_missing_instance(instance_id):
+
+    # Instances EC2 never returned are kept out of the Data Sink, unless enriched meanwhile
+    dynamodb = clients.client('dynamodb', max_pool_connections=instance_metadata_write_concurrency)
+
+    try:
+        dynamodb.update_item(
+            TableName=instance_metadata_table,
+            Key={
+                'InstanceId': {'S': instance_id}
+            },
+            UpdateExpression="SET #InstanceMetadataEnriched = :False, #InstanceMetadataMissing = :True",
+            ConditionExpression="attribute_exists(#InstanceId) AND (attribute_not_exists(#InstanceMetadataEnriched) OR #InstanceMetadataEnriched = :False)",
+            ExpressionAttributeNames={
+                '#InstanceId': 'InstanceId',
+                '#InstanceMetadataEnriched': 'InstanceMetadataEnriched',
+                '#InstanceMetadataMissing': 'InstanceMetadataMissing'
+            },
+            ExpressionAttributeValues={
+                ':False': {'BOOL': False},
+                ':True': {'BOOL': True}
+            },
+            ReturnValues="NONE"
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return
+        message = 'Error marking instance {} as missing in DynamoDB: {}'.format(instance_id, e)
+        logger.error(message)
+        raise Exception(message)
+
+def update_instance(instance):
+
+    logger.debug('Instance', Instance=instance)
+
+    # Low-level clients are thread safe, size the connection pool to match the workers
+    dynamodb = clients.client('dynamodb', max_pool_connections=instance_metadata_write_concurrency)
+    serializer = clients.serializer()
+
+    item = {
+        'InstanceId': instance['InstanceId'],
+        'InstanceType': instance['InstanceType'],
+        'InstanceLifecycle': '',
+        'AvailabilityZone': instance['Placement']['AvailabilityZone'],
+        'Tags': filter_tags(instance.get('Tags', [])),
+        'PlatformDetails': instance.get('PlatformDetails', 'Linux/UNIX'),
+        'InstanceMetadataEnriched': True
+    }
+
+    if 'InstanceLifecycle' in instance:
+        item['InstanceLifecycle'] = instance['InstanceLifecycle']
+    else:
+        item['InstanceLifecycle'] = 'on-demand'
+
+    try:
+        response=dynamodb.update_item(
+            TableName=instance_metadata_table,
+            Key={
+                'InstanceId': serializer.serialize(item['InstanceId'])
+            },
+            UpdateExpression="SET #InstanceType = :InstanceType, #InstanceLifecycle = :InstanceLifecycle, #AvailabilityZone = :AvailabilityZone, #Tags = :Tags, #PlatformDetails = :PlatformDetails, #InstanceMetadataEnriched = :InstanceMetadataEnriched",
+            ExpressionAttributeNames={
+                '#InstanceType' : 'InstanceType',
+                '#InstanceLifecycle': 'InstanceLifecycle',
+                '#AvailabilityZone': 'AvailabilityZone',
+                '#Tags': 'Tags',
+                '#PlatformDetails': 'PlatformDetails',
+                '#InstanceMetadataEnriched': 'InstanceMetadataEnriched'
+            },
+            ExpressionAttributeValues={
+                ':InstanceType': serializer.serialize(item['InstanceType']),
+                ':InstanceLifecycle': serializer.serialize(item['InstanceLifecycle']),
+                ':AvailabilityZone': serializer.serialize(item['AvailabilityZone']),
+                ':Tags': serializer.serialize(item['Tags']),
+                ':PlatformDetails': serializer.serialize(item['PlatformDetails']),
+                ':InstanceMetadataEnriched': serializer.serialize(item['InstanceMetadataEnriched'])
+                },
+            ReturnValues="NONE"
+        )
+
+        logger.debug('Response', Response=response)
+    except ClientError as e:
+        message = 'Error updating instance {} in DynamoDB: {}'.format(item['InstanceId'], e)
+        logger.error(message)
+        raise Exception(message)
+
 def lambda_handler(event, context):
 
-    logger.info(event)
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
 
     instance_ids = []
+    sequence_numbers = {}
     described_instances = []
+    batch_item_failures = []
 
     # Get Inserted Instances
     for record in event['Records']:
-        if record['eventName'] == 'INSERT':
+        if is_enrichment_record(record):
             item = record['dynamodb']['NewImage']
-            instance_id = item['InstanceId']['S']
+            instance_id = attribute(item, 'InstanceId')
             instance_ids.append(instance_id)
-            logger.info(item)
+            sequence_numbers.setdefault(instance_id, []).append(record['dynamodb']['SequenceNumber'])
+            logger.debug('Item', Item=item)
+
+    missing_ids = []
+    failed_ids = []
 
     # Describe Instances
     if len(instance_ids) > 0:
-        described_instances = describe_instances(instance_ids)
-        logger.info(described_instances)
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000.0 - describe_instances_reserved_seconds
+        described_instances, missing_ids, failed_ids = describe_instances(instance_ids, deadline)
+        logger.info('Described instances', Requested=len(instance_ids), Described=len(described_instances), Missing=len(missing_ids), Failed=len(failed_ids))
+        logger.debug('Described instances', Instances=described_instances)
 
-    # Update Instance Records With Metadata
+    # Only the records of failed requests are retried, missing instances would hold back the shard
+    for instance_id in failed_ids:
+        for sequence_number in sequence_numbers.get(instance_id, []):
+            batch_item_failures.append({'itemIdentifier': sequence_number})
 
-    for instance in described_instances:
-        logger.info(instance)
+    # Update Instance Records With Metadata
+    futures = {
+        executor.submit(update_instance, instance): instance['InstanceId']
+        for instance in described_instances
+    }
+    futures.update({
+        executor.submit(mark_missing_instance, instance_id): instance_id
+        for instance_id in missing_ids
+    })
+
+    for future, instance_id in futures.items():
         try:
+            future.result()
+        except Exception as e:
+            logger.error('Reporting failed records', InstanceId=instance_id, Error=str(e))
+            for sequence_number in sequence_numbers.get(instance_id, []):
+                batch_item_failures.append({'itemIdentifier': sequence_number})
 
-            item = {
-                'InstanceId': instance['InstanceId'],
-                'InstanceType': instance['InstanceType'],
-                'InstanceLifecycle': '',
-                'AvailabilityZone': instance['Placement']['AvailabilityZone'],
-                'Tags': instance['Tags'],
-                'InstanceMetadataEnriched': True
-            }
-
-            if 'InstanceLifecycle' in instance:
-                item['InstanceLifecycle'] = instance['InstanceLifecycle']
-            else:
-                item['InstanceLifecycle'] = 'on-demand'
-
-            response=instance_metadata_table.update_item(
-                Key={
-                    'InstanceId': item['InstanceId']
-                },
-                UpdateExpression="SET #InstanceType = :InstanceType, #InstanceLifecycle = :InstanceLifecycle, #AvailabilityZone = :AvailabilityZone, #Tags = :Tags, #InstanceMetadataEnriched = :InstanceMetadataEnriched",
-                ExpressionAttributeNames={
-                    '#InstanceType' : 'InstanceType',
-                    '#InstanceLifecycle': 'InstanceLifecycle',
-                    '#AvailabilityZone': 'AvailabilityZone',
-                    '#Tags': 'Tags',
-                    '#InstanceMetadataEnriched': 'InstanceMetadataEnriched'
-                },
-                ExpressionAttributeValues={
-                    ':InstanceType': item['InstanceType'],
-                    ':InstanceLifecycle': item['InstanceLifecycle'],
-                    ':AvailabilityZone': item['AvailabilityZone'],
-                    ':Tags': item['Tags'],
-                    ':InstanceMetadataEnriched': item['InstanceMetadataEnriched']
-                    },
-                ReturnValues="NONE"
-            )
-
-            logger.info(response)
-        except ClientError as e:
-            message = 'Error updating instances in DynamoDB: {}'.format(e)
-            logger.info(message)
-            raise Exception(message)
-            
     # End
     logger.info('Execution Complete')
-    return
\ No newline at end of file
+    return {
+        'batchItemFailures': batch_item_failures
+    }
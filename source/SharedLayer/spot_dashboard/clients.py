@@ -0,0 +1,66 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import threading
+
+# AWS SDK clients are created on first use and cached for the life of the container, so
+# functions only pay for the SDK and the clients they actually call.
+
+clients = {}
+tables = {}
+serializers = []
+deserializers = []
+lock = threading.Lock()
+
+def client(service_name, max_pool_connections=None):
+
+    key = (service_name, max_pool_connections)
+    if key not in clients:
+        with lock:
+            if key not in clients:
+                import boto3
+                config = None
+                if max_pool_connections is not None:
+                    from botocore.config import Config
+                    config = Config(max_pool_connections=max_pool_connections)
+                clients[key] = boto3.client(service_name, config=config)
+
+    return clients[key]
+
+def table(table_name):
+
+    if table_name not in tables:
+        with lock:
+            if table_name not in tables:
+                import boto3
+                tables[table_name] = boto3.resource('dynamodb').Table(table_name)
+
+    return tables[table_name]
+
+def serializer():
+
+    if not serializers:
+        from boto3.dynamodb.types import TypeSerializer
+        serializers.append(TypeSerializer())
+
+    return serializers[0]
+
+def deserializer():
+
+    if not deserializers:
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializers.append(TypeDeserializer())
+
+    return deserializers[0]
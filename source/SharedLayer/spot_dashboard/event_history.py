@@ -0,0 +1,138 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+import calendar
+
+from botocore.exceptions import ClientError
+from spot_dashboard import logs
+
+logger = logs.get_logger()
+
+# EventHistory entries are stored as numbers, epoch seconds * 8 + event code, instead of
+# {Name, Time, State} maps. The list is capped at EVENT_HISTORY_MAX_EVENTS entries, the
+# first event and the most recent ones are kept and EventHistoryDropped counts the rest.
+event_codes = {
+    ('spot-launch', 'none'): 0,
+    ('state-change', 'running'): 1,
+    ('rebalance-recommendation', 'none'): 2,
+    ('spot-interruption', 'none'): 3,
+    ('state-change', 'terminated'): 4
+}
+event_names = {code: event for event, code in event_codes.items()}
+
+event_history_max_events = int(os.environ.get('EVENT_HISTORY_MAX_EVENTS', 20))
+
+time_format = '%Y-%m-%dT%H:%M:%SZ'
+
+def encode_event(name, state, event_time):
+    return calendar.timegm(time.strptime(event_time, time_format)) * 8 + event_codes[(name, state)]
+
+def decode_event(value):
+
+    # Entries written before the compact encoding are already maps
+    if isinstance(value, dict):
+        return value
+
+    value = int(value)
+    name, state = event_names[value % 8]
+
+    return {
+        'Name': name,
+        'Time': time.strftime(time_format, time.gmtime(value // 8)),
+        'State': state
+    }
+
+def decode_history(history):
+    return [decode_event(value) for value in history or []]
+
+def trim_history(history, max_events):
+
+    if len(history) <= max_events:
+        return list(history)
+
+    return history[:1] + history[len(history) - max_events + 1:]
+
+def identity(value):
+    return value
+
+def update_with_history(dynamodb, events, serialize=identity, deserialize=identity, max_events=None, **arguments):
+
+    # Runs update_item with events appended to EventHistory, on a Table resource or, with
+    # serialize and deserialize, a low-level client. Appends are conditional on the list
+    # staying within max_events, a full list is read back and rewritten trimmed.
+    if max_events is None:
+        max_events = event_history_max_events
+
+    names = dict(arguments.pop('ExpressionAttributeNames', {}), **{'#EventHistory': 'EventHistory'})
+    values = dict(arguments.pop('ExpressionAttributeValues', {}))
+    update_expression = arguments.pop('UpdateExpression')
+
+    try:
+        return dynamodb.update_item(
+            UpdateExpression='{}, #EventHistory = list_append(if_not_exists(#EventHistory, :empty_list), :EventHistory)'.format(update_expression),
+            ConditionExpression='attribute_not_exists(#EventHistory) OR size(#EventHistory) <= :EventHistoryLimit',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=dict(values, **{
+                ':EventHistory': serialize(list(events)),
+                ':empty_list': serialize([]),
+                ':EventHistoryLimit': serialize(max_events - len(events))
+            }),
+            **arguments
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+    return rewrite_history(dynamodb, events, serialize, deserialize, max_events, update_expression, names, values, **arguments)
+
+def rewrite_history(dynamodb, events, serialize, deserialize, max_events, update_expression, names, values, **arguments):
+
+    # Rewrite the trimmed list, conditional on nobody appending in between
+    table_name = {'TableName': arguments['TableName']} if 'TableName' in arguments else {}
+    names = dict(names, **{'#EventHistory': 'EventHistory', '#EventHistoryDropped': 'EventHistoryDropped'})
+
+    for attempt in range(5):
+        response = dynamodb.get_item(
+            Key=arguments['Key'],
+            ProjectionExpression='#EventHistory',
+            ExpressionAttributeNames={'#EventHistory': 'EventHistory'},
+            ConsistentRead=True,
+            **table_name
+        )
+        current = deserialize(response['Item']['EventHistory'])
+        history = trim_history(list(current) + list(events), max_events)
+        dropped = len(current) + len(events) - len(history)
+
+        logger.info('Trimming EventHistory', Key=arguments['Key'], Events=len(current) + len(events), Kept=len(history))
+
+        try:
+            return dynamodb.update_item(
+                UpdateExpression='{}, #EventHistory = :EventHistory ADD #EventHistoryDropped :EventHistoryDropped'.format(update_expression),
+                ConditionExpression='#EventHistory = :EventHistoryCurrent',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=dict(values, **{
+                    ':EventHistory': serialize(history),
+                    ':EventHistoryCurrent': serialize(current),
+                    ':EventHistoryDropped': serialize(dropped)
+                }),
+                **arguments
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    raise Exception('Error trimming EventHistory of {}: the item kept changing'.format(arguments['Key']))
@@ -0,0 +1,116 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import time
+
+from botocore.exceptions import ClientError
+from spot_dashboard import logs
+
+logger = logs.get_logger()
+
+# Kinesis Data Firehose PutRecordBatch limits
+firehose_max_record_bytes = 1000*1024
+firehose_max_batch_records = 500
+firehose_max_batch_bytes = 4*1024*1024
+
+class FirehoseBatchSink(object):
+
+    # Buffers newline delimited JSON documents, packs as many documents as fit into each
+    # Firehose record, and sends the records with PutRecordBatch. Only the entries that
+    # Firehose reports as failed are retried.
+
+    def __init__(self, delivery_stream_name, client=None, max_attempts=5, backoff_seconds=0.2):
+        self.delivery_stream_name = delivery_stream_name
+        self.client = client
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.record = bytearray()
+        self.records = []
+        self.records_bytes = 0
+        self.documents = 0
+        self.put_record_batch_calls = 0
+
+    def put(self, document):
+        line = (json.dumps(document)+"\n").encode('utf-8')
+
+        if len(line) > firehose_max_record_bytes:
+            message = 'Error sending instance data to Kinesis Firehose: document of {} bytes exceeds the record size limit'.format(len(line))
+            logger.error(message)
+            raise Exception(message)
+
+        if len(self.record) + len(line) > firehose_max_record_bytes:
+            self.seal_record()
+
+        self.record += line
+        self.documents += 1
+
+    def seal_record(self):
+        if not self.record:
+            return
+
+        if len(self.records) == firehose_max_batch_records or self.records_bytes + len(self.record) > firehose_max_batch_bytes:
+            self.send_batch()
+
+        self.records.append(bytes(self.record))
+        self.records_bytes += len(self.record)
+        self.record = bytearray()
+
+    def flush(self):
+        self.seal_record()
+        self.send_batch()
+
+        logger.info('Sent documents to Kinesis Firehose', Documents=self.documents, PutRecordBatchCalls=self.put_record_batch_calls)
+
+    def send_batch(self):
+        records = self.records
+        self.records = []
+        self.records_bytes = 0
+
+        if self.client is None:
+            from spot_dashboard import clients
+            self.client = clients.client('firehose')
+
+        attempt = 1
+        while records:
+            try:
+                response = self.client.put_record_batch(
+                    DeliveryStreamName=self.delivery_stream_name,
+                    Records=[{'Data': data} for data in records]
+                )
+                self.put_record_batch_calls += 1
+            except ClientError as e:
+                message = 'Error sending instance data to Kinesis Firehose: {}'.format(e)
+                logger.error(message)
+                raise Exception(message)
+
+            if response['FailedPutCount'] == 0:
+                return
+
+            # Request responses are in the same order as the records that were sent
+            failed = [
+                (data, result) for data, result in zip(records, response['RequestResponses'])
+                if 'ErrorCode' in result
+            ]
+            records = [data for data, result in failed]
+
+            if attempt >= self.max_attempts:
+                message = 'Error sending instance data to Kinesis Firehose: {} records failed after {} attempts, last error: {}'.format(len(records), attempt, failed[0][1].get('ErrorMessage'))
+                logger.error(message)
+                raise Exception(message)
+
+            logger.warning('Retrying failed Kinesis Firehose records', Records=len(records))
+            time.sleep(self.backoff_seconds * (2 ** (attempt - 1)))
+            attempt += 1
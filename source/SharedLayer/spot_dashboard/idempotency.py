@@ -0,0 +1,211 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import math
+import time
+import threading
+
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from spot_dashboard import clients, logs
+
+logger = logs.get_logger()
+
+# Claims on idempotency keys, an EventBridge event ID or an instance event (InstanceId,
+# LastEventType, LastEventTime), so work retried by EventBridge, the stream or the state
+# machine is only done once. A claim is a conditional put into the IdempotencyTable. It is
+# IN_PROGRESS until the work is done and expires with the invocation, so the retry of an
+# invocation that timed out or crashed claims it again. Once the work is done it is
+# COMPLETE and expires after IDEMPOTENCY_TTL_SECONDS. Keys seen by the warm container are
+# remembered in an LRU, so repeated keys are dropped without a request. Without a table
+# only the LRU is used.
+idempotency_table = os.environ.get('IDEMPOTENCY_TABLE')
+idempotency_ttl_seconds = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24*60*60))
+idempotency_cache_size = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+idempotency_write_concurrency = int(os.environ.get('IDEMPOTENCY_WRITE_CONCURRENCY', 10))
+
+def event_key(instance):
+    return '{}#{}#{}'.format(instance['InstanceId'], instance.get('LastEventType'), instance.get('LastEventTime'))
+
+class IdempotencyStore(object):
+
+    def __init__(self, table_name, ttl_seconds, cache_size, client=None):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.client = client
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.duplicates = 0
+        self.cache_hits = 0
+        self.claims = 0
+
+    def claim(self, keys, in_progress_seconds):
+
+        # Returns the keys claimed by this call, in order. Keys claimed earlier, here or by
+        # another container, and repeated keys are left out. Claims stay IN_PROGRESS for
+        # in_progress_seconds, complete() keeps them for the TTL.
+        now = int(time.time())
+        in_progress_seconds = max(1, int(math.ceil(in_progress_seconds)))
+        unique_keys = list(dict.fromkeys(keys))
+        pending = []
+
+        with self.lock:
+            for key in unique_keys:
+                expires = self.cache.get(key)
+                if expires is not None and expires > now:
+                    self.cache.move_to_end(key)
+                    self.cache_hits += 1
+                else:
+                    pending.append(key)
+
+        claimed = set(pending)
+        if pending and self.table_name:
+            with ThreadPoolExecutor(max_workers=idempotency_write_concurrency) as executor:
+                futures = [(key, executor.submit(self.put_claim, key, now, now + in_progress_seconds)) for key in pending]
+
+            claimed = set()
+            errors = []
+            for key, future in futures:
+                try:
+                    if future.result():
+                        claimed.add(key)
+                except Exception as e:
+                    errors.append(str(e))
+
+            # All or nothing, claims kept after a failure would drop the retried work
+            if errors:
+                self.release(list(claimed))
+                raise Exception('Error claiming {} idempotency keys: {}'.format(len(errors), errors[0]))
+
+        with self.lock:
+            for key in pending:
+                self.cache[key] = now + in_progress_seconds
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+            self.claims += len(claimed)
+            self.duplicates += len(keys) - len(claimed)
+
+        return [key for key in unique_keys if key in claimed]
+
+    def complete(self, keys):
+
+        # Keeps the claims of work that is done for the TTL. A claim that is not completed
+        # expires with its invocation and the work can be done again by a retry.
+        now = int(time.time())
+
+        with self.lock:
+            for key in keys:
+                self.cache[key] = now + self.ttl_seconds
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        if not keys or not self.table_name:
+            return
+
+        with ThreadPoolExecutor(max_workers=idempotency_write_concurrency) as executor:
+            list(executor.map(lambda key: self.put_complete(key, now + self.ttl_seconds), keys))
+
+    def release(self, keys):
+
+        # Gives claims back when the work failed, so a retry can claim them again
+        with self.lock:
+            for key in keys:
+                self.cache.pop(key, None)
+
+        if not keys or not self.table_name:
+            return
+
+        with ThreadPoolExecutor(max_workers=idempotency_write_concurrency) as executor:
+            list(executor.map(self.delete_claim, keys))
+
+    def dynamodb(self):
+        if self.client is None:
+            self.client = clients.client('dynamodb', max_pool_connections=idempotency_write_concurrency)
+        return self.client
+
+    def put_claim(self, key, now, expires):
+
+        # Returns False when the key is already claimed and the claim, IN_PROGRESS or
+        # COMPLETE, has not expired yet. Expired items can linger until DynamoDB deletes them.
+        try:
+            self.dynamodb().put_item(
+                TableName=self.table_name,
+                Item={
+                    'IdempotencyKey': {'S': key},
+                    'Status': {'S': 'IN_PROGRESS'},
+                    'ExpirationTime': {'N': str(expires)}
+                },
+                ConditionExpression='attribute_not_exists(#IdempotencyKey) OR #ExpirationTime <= :Now',
+                ExpressionAttributeNames={
+                    '#IdempotencyKey': 'IdempotencyKey',
+                    '#ExpirationTime': 'ExpirationTime'
+                },
+                ExpressionAttributeValues={
+                    ':Now': {'N': str(now)}
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            message = 'Error claiming idempotency key {}: {}'.format(key, e)
+            logger.error(message)
+            raise Exception(message)
+
+        return True
+
+    def put_complete(self, key, expires):
+
+        try:
+            self.dynamodb().put_item(
+                TableName=self.table_name,
+                Item={
+                    'IdempotencyKey': {'S': key},
+                    'Status': {'S': 'COMPLETE'},
+                    'ExpirationTime': {'N': str(expires)}
+                }
+            )
+        except ClientError as e:
+            # The work is done, a retry after the IN_PROGRESS claim expired would do it again
+            logger.warning('Error completing idempotency key', Key=key, Error=str(e))
+
+    def delete_claim(self, key):
+
+        try:
+            self.dynamodb().delete_item(
+                TableName=self.table_name,
+                Key={
+                    'IdempotencyKey': {'S': key}
+                }
+            )
+        except ClientError as e:
+            # The claim expires on its own, a retry within the TTL is dropped as a duplicate
+            logger.warning('Error releasing idempotency key', Key=key, Error=str(e))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'Claims': self.claims,
+                'Duplicates': self.duplicates,
+                'CacheHits': self.cache_hits,
+                'CacheSize': len(self.cache)
+            }
+
+idempotency_store = IdempotencyStore(idempotency_table, idempotency_ttl_seconds, idempotency_cache_size)
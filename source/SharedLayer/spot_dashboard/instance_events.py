@@ -0,0 +1,145 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import time
+
+from spot_dashboard.event_history import encode_event
+
+# EC2 EventBridge events are transformed into updates of the instance metadata item, the
+# same attributes and EventHistory entries the trigger functions write. Updates for one
+# instance can then be coalesced into as few UpdateItem calls as the Data Sink allows.
+
+# Order of events sharing the same second, in instance lifecycle order
+event_ranks = {
+    'spot-launch': 0,
+    'running': 1,
+    'rebalance-recommendation': 2,
+    'spot-interruption': 3,
+    'terminated': 4
+}
+
+def spot_launch_update(event, expiration_time):
+    return 'spot-launch', 'none', {
+        'SpotInstanceRequestId': event['detail']['spot-instance-request-id'],
+        'ExpirationTime': expiration_time
+    }
+
+def state_change_update(event, expiration_time):
+
+    state = event['detail']['state']
+
+    if state == 'running':
+        return 'state-change', state, {
+            'State': state,
+            'LaunchedTime': event['time'],
+            'ExpirationTime': expiration_time
+        }
+
+    if state == 'terminated':
+        return 'state-change', state, {
+            'State': state,
+            'TerminatedTime': event['time']
+        }
+
+    return None
+
+def rebalance_update(event, expiration_time):
+    return 'rebalance-recommendation', 'none', {
+        'RebalanceRecommended': True,
+        'RebalanceRecommendationTime': event['time']
+    }
+
+def spot_interruption_update(event, expiration_time):
+    return 'spot-interruption', 'none', {
+        'Interrupted': True,
+        'InterruptedInstanceAction': event['detail']['instance-action'],
+        'InterruptionTime': event['time']
+    }
+
+update_builders = {
+    'EC2 Spot Instance Request Fulfillment': spot_launch_update,
+    'EC2 Instance State-change Notification': state_change_update,
+    'EC2 Instance Rebalance Recommendation': rebalance_update,
+    'EC2 Spot Instance Interruption Warning': spot_interruption_update
+}
+
+def instance_update(event, item_expiration_seconds, now=None):
+
+    builder = update_builders.get(event.get('detail-type'))
+    if builder is None:
+        return None
+
+    expiration_time = int((now or time.time()) + item_expiration_seconds)
+    update = builder(event, expiration_time)
+    if update is None:
+        return None
+
+    event_type, state, attributes = update
+    attributes.update({
+        'Region': event['region'],
+        'LastEventTime': event['time'],
+        'LastEventType': event_type
+    })
+
+    return {
+        'Id': event.get('id'),
+        'InstanceId': event['detail']['instance-id'],
+        'Time': event['time'],
+        'Rank': event_ranks[state if event_type == 'state-change' else event_type],
+        'Attributes': attributes,
+        'History': encode_event(event_type, state, event['time'])
+    }
+
+def is_data_sink_update(update):
+
+    # The Data Sink reacts to the LastEventType of each write, see DataSinkTriggerFunction
+    return update['Attributes']['LastEventType'] in ('state-change', 'spot-interruption')
+
+def coalesce_updates(updates):
+
+    # Groups updates by instance and orders them by event time. Each group is merged into
+    # writes that end with at most one Data Sink event, so a later event never hides a
+    # launch, interruption or termination from the Data Sink. EventBridge duplicates are
+    # dropped by event id.
+    by_instance = {}
+    for update in updates:
+        by_instance.setdefault(update['InstanceId'], []).append(update)
+
+    coalesced = {}
+    for instance_id, instance_updates in by_instance.items():
+        seen = set()
+        writes = []
+        write = None
+
+        for update in sorted(instance_updates, key=lambda update: (update['Time'], update['Rank'])):
+            if update['Id'] is not None:
+                if update['Id'] in seen:
+                    continue
+                seen.add(update['Id'])
+
+            if write is None:
+                write = {'InstanceId': instance_id, 'Attributes': {}, 'History': [], 'Updates': []}
+                writes.append(write)
+
+            write['Attributes'].update(update['Attributes'])
+            write['History'].append(update['History'])
+            write['Updates'].append(update)
+
+            if is_data_sink_update(update):
+                write = None
+
+        coalesced[instance_id] = writes
+
+    return coalesced
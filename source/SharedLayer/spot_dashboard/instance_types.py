@@ -0,0 +1,151 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+import threading
+
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from spot_dashboard import logs
+
+logger = logs.get_logger()
+
+# DescribeInstanceTypes accepts up to 100 instance types per request
+describe_instance_types_max_types = 100
+
+def instance_type_attributes(instance_type_info):
+
+    gpus = instance_type_info.get('GpuInfo', {}).get('Gpus', [])
+
+    return {
+        'VCpus': instance_type_info['VCpuInfo']['DefaultVCpus'],
+        'MemoryMiB': instance_type_info['MemoryInfo']['SizeInMiB'],
+        'Architectures': instance_type_info['ProcessorInfo']['SupportedArchitectures'],
+        'GpuCount': sum(gpu['Count'] for gpu in gpus)
+    }
+
+class InstanceTypeCache(object):
+
+    # Instance type attributes keyed by instance type, kept in least recently used order
+    # and shared by every invocation of a warm container.
+
+    def __init__(self, ttl_seconds, max_size, client=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.client = client
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, instance_type):
+        return self.get_many([instance_type]).get(instance_type, {})
+
+    def get_many(self, instance_types):
+        now = time.time()
+        found = {}
+        missing = []
+
+        with self.lock:
+            for instance_type in set(instance_types):
+                entry = self.entries.get(instance_type)
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end(instance_type)
+                    found[instance_type] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(instance_type)
+                    self.misses += 1
+
+        if not missing:
+            return found
+
+        # Fetch every missing instance type in as few requests as possible
+        fetched = self.describe_instance_types(missing)
+
+        with self.lock:
+            for instance_type in missing:
+                # Instance types EC2 rejected as unknown are cached as empty so they are not
+                # fetched again
+                attributes = fetched.get(instance_type, {})
+                self.entries[instance_type] = (now + self.ttl_seconds, attributes)
+                self.entries.move_to_end(instance_type)
+                found[instance_type] = attributes
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return found
+
+    def describe_instance_types(self, instance_types):
+
+        described_instance_types = {}
+
+        for index in range(0, len(instance_types), describe_instance_types_max_types):
+            chunk = instance_types[index:index + describe_instance_types_max_types]
+            try:
+                described_instance_types.update(self.describe_chunk(chunk))
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'InvalidInstanceType' or len(chunk) == 1:
+                    message = 'Error describing instance types: {}'.format(e)
+                    logger.error(message)
+                    raise Exception(message)
+
+                # One unknown instance type fails the whole request, each one is described
+                # on its own so the others still get their attributes
+                logger.warning('Describing instance types one at a time', InstanceTypes=len(chunk), Error=str(e))
+                for instance_type in chunk:
+                    try:
+                        described_instance_types.update(self.describe_chunk([instance_type]))
+                    except ClientError as e:
+                        if e.response['Error']['Code'] != 'InvalidInstanceType':
+                            message = 'Error describing instance types: {}'.format(e)
+                            logger.error(message)
+                            raise Exception(message)
+                        logger.warning('Unknown instance type', InstanceType=instance_type)
+
+        return described_instance_types
+
+    def describe_chunk(self, instance_types):
+
+        if self.client is None:
+            from spot_dashboard import clients
+            self.client = clients.client('ec2')
+
+        described_instance_types = {}
+
+        paginator = self.client.get_paginator('describe_instance_types')
+        for page in paginator.paginate(InstanceTypes=instance_types):
+            for instance_type_info in page['InstanceTypes']:
+                described_instance_types[instance_type_info['InstanceType']] = instance_type_attributes(instance_type_info)
+
+        return described_instance_types
+
+    def stats(self):
+        with self.lock:
+            return {
+                'Hits': self.hits,
+                'Misses': self.misses,
+                'Evictions': self.evictions,
+                'Size': len(self.entries)
+            }
+
+instance_type_cache = InstanceTypeCache(
+    ttl_seconds=int(os.environ.get('INSTANCE_TYPE_CACHE_TTL_SECONDS', 24*60*60)),
+    max_size=int(os.environ.get('INSTANCE_TYPE_CACHE_MAX_SIZE', 1024))
+)
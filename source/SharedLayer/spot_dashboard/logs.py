@@ -0,0 +1,157 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import json
+import time
+import random
+import logging
+
+# Structured, sampled logging for the functions. Each record is one JSON document with the
+# message, the request ID of the invocation and the fields passed to the logger. Fields are
+# only serialized when the record is emitted, so debug payloads cost nothing at INFO.
+#
+#   logger = logs.get_logger()
+#   logger.start_invocation(context)
+#   logger.info('Received event', **logs.summarize_event(event))
+#   logger.debug('Event', Event=event)
+#
+# LOG_LEVEL sets the level (default INFO). LOG_SAMPLE_RATE is the share of invocations
+# logged at DEBUG regardless of the level, with their full payloads (default 0).
+
+log_level = getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+log_sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', 0))
+
+# Instance IDs listed in a summary
+summary_max_instance_ids = 10
+
+invocation = {}
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+
+        document = {
+            'timestamp': '{}.{:03d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)), int(record.msecs)),
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        document.update(invocation)
+        document.update(getattr(record, 'fields', {}))
+
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(document, default=str, separators=(',', ':'))
+
+class StructuredLogger(object):
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def start_invocation(self, context=None):
+
+        # Decides once per invocation whether it is sampled at DEBUG
+        invocation.clear()
+        if context is not None:
+            invocation['requestId'] = context.aws_request_id
+            invocation['function'] = context.function_name
+
+        sampled = log_sample_rate > 0 and random.random() < log_sample_rate
+        if sampled:
+            invocation['sampled'] = True
+
+        self.logger.setLevel(logging.DEBUG if sampled else log_level)
+
+    def is_enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, message, *args, **fields):
+        if self.logger.isEnabledFor(level):
+            exc_info = fields.pop('exc_info', None)
+            self.logger.log(level, message, *args, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, message, *args, **fields):
+        self.log(logging.DEBUG, message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log(logging.INFO, message, *args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self.log(logging.WARNING, message, *args, **fields)
+
+    def error(self, message, *args, **fields):
+        self.log(logging.ERROR, message, *args, **fields)
+
+loggers = []
+
+def get_logger():
+
+    # Every module logs through the root logger, whose handlers the Lambda runtime installs
+    if not loggers:
+        root = logging.getLogger()
+        root.setLevel(log_level)
+        for handler in root.handlers:
+            handler.setFormatter(JsonFormatter())
+        loggers.append(StructuredLogger(root))
+
+    return loggers[0]
+
+def instance_ids(instances):
+
+    ids = [instance['InstanceId'] for instance in instances[:summary_max_instance_ids]]
+    if len(instances) > summary_max_instance_ids:
+        ids.append('+{}'.format(len(instances) - summary_max_instance_ids))
+    return ids
+
+def record_instance_id(record):
+
+    if 'dynamodb' in record:
+        return record['dynamodb'].get('Keys', {}).get('InstanceId', {}).get('S')
+    return None
+
+def summarize_event(event):
+
+    # Counts and instance IDs of an event, in place of the event itself
+    if 'Records' in event:
+        records = event['Records']
+        summary = {'Records': len(records)}
+        if records:
+            summary['EventSource'] = records[0].get('eventSource') or records[0].get('EventSource')
+        event_names = {}
+        for record in records:
+            if 'eventName' in record:
+                event_names[record['eventName']] = event_names.get(record['eventName'], 0) + 1
+        if event_names:
+            summary['EventNames'] = event_names
+        ids = [record_instance_id(record) for record in records]
+        ids = [{'InstanceId': instance_id} for instance_id in ids if instance_id]
+        if ids:
+            summary['InstanceIds'] = instance_ids(ids)
+        return summary
+
+    if 'instances' in event:
+        return {'Instances': len(event['instances']), 'InstanceIds': instance_ids(event['instances'])}
+
+    if 'instance' in event:
+        return {'InstanceId': event['instance'].get('InstanceId')}
+
+    if 'failures' in event:
+        return {'Failures': len(event['failures']), 'InstanceIds': instance_ids(event['failures'])}
+
+    if 'detail-type' in event:
+        return {'DetailType': event['detail-type'], 'EventId': event.get('id'), 'InstanceId': event.get('detail', {}).get('instance-id')}
+
+    return {'Keys': sorted(event)}
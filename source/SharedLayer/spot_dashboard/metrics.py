@@ -0,0 +1,114 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from botocore.exceptions import ClientError
+from spot_dashboard import logs
+
+logger = logs.get_logger()
+
+# aws_embedded_metrics is imported on the first flush rather than at module import, it is
+# the most expensive import on the cold start path of the sink functions.
+
+scoped = {}
+
+def configured_scope(function):
+
+    if function not in scoped:
+        from aws_embedded_metrics import metric_scope
+        from aws_embedded_metrics.config import get_config
+
+        Config = get_config()
+        Config.service_name = "EC2SpotDashboard"
+        Config.service_type = "Instance"
+        Config.log_group_name = "EC2SpotDashboard"
+
+        scoped[function] = metric_scope(function)
+
+    return scoped[function]
+
+def pool_metric_scope():
+
+    return configured_scope(write_pool_metric)
+
+def put_pool_metric(metric_name, region, availability_zone, instance_type, count):
+
+    return pool_metric_scope()(metric_name, region, availability_zone, instance_type, count)
+
+def write_pool_metric(metric_name, region, availability_zone, instance_type, count, metrics):
+
+    try:
+        metrics.set_namespace("EC2SpotDashboard")
+        metrics.set_dimensions(
+            {
+                "InstanceType": instance_type
+            },
+            {
+                "AvailabilityZone": availability_zone
+            },
+            {
+                "AvailabilityZone": availability_zone,
+                "InstanceType": instance_type
+            })
+        metrics.put_metric(metric_name, count, "Count")
+        metrics.set_property("Region", region)
+
+    except ClientError as e:
+        message = 'Error sending CloudWatch Metric: {}'.format(e)
+        logger.error(message)
+        raise Exception(message)
+
+    return
+
+def put_stage_metric(metric_name, stage, count):
+
+    return configured_scope(write_stage_metric)(metric_name, stage, count)
+
+def write_stage_metric(metric_name, stage, count, metrics):
+
+    try:
+        metrics.set_namespace("EC2SpotDashboard")
+        metrics.set_dimensions(
+            {
+                "Stage": stage
+            })
+        metrics.put_metric(metric_name, count, "Count")
+
+    except ClientError as e:
+        message = 'Error sending CloudWatch Metric: {}'.format(e)
+        logger.error(message)
+        raise Exception(message)
+
+    return
+
+class PoolMetricEmitter(object):
+
+    # Counts instances per capacity pool (Region, AvailabilityZone, InstanceType) across the
+    # records of an invocation, then writes one EMF document per pool carrying the count
+    # under the InstanceType, AvailabilityZone and AvailabilityZone/InstanceType dimensions.
+
+    def __init__(self, metric_name):
+        self.metric_name = metric_name
+        self.counts = {}
+
+    def add(self, instance, count=1):
+        pool = (instance['Region'], instance['AvailabilityZone'], instance['InstanceType'])
+        self.counts[pool] = self.counts.get(pool, 0) + count
+
+    def flush(self):
+        for (region, availability_zone, instance_type), count in self.counts.items():
+            put_pool_metric(self.metric_name, region, availability_zone, instance_type, count)
+
+        logger.info('Sent pool metrics', MetricName=self.metric_name, Count=sum(self.counts.values()), Pools=len(self.counts))
+        self.counts = {}
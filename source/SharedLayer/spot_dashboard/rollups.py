@@ -0,0 +1,295 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+import random
+import calendar
+import datetime
+
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from spot_dashboard import clients, logs
+
+logger = logs.get_logger()
+
+# Launch and interruption counters per capacity pool (Region#AvailabilityZone#InstanceType)
+# and time bucket, an hour (H#2019-01-01T13) or a day (D#2019-01-01). Each instance is
+# counted once per counter: the increments and a marker item for each instance are written
+# in one transaction, the markers conditional on not existing, so retries are dropped.
+# Counts aggregated over a tumbling window (spot_dashboard.windows) are written the same
+# way, with a marker for the window in place of the instance marker.
+pool_rollup_table = os.environ.get('POOL_ROLLUP_TABLE')
+pool_rollup_retention_days = int(os.environ.get('POOL_ROLLUP_RETENTION_DAYS', 365))
+pool_rollup_write_concurrency = int(os.environ.get('POOL_ROLLUP_WRITE_CONCURRENCY', 10))
+pool_rollup_write_max_attempts = int(os.environ.get('POOL_ROLLUP_WRITE_MAX_ATTEMPTS', 8))
+pool_rollup_write_backoff_seconds = float(os.environ.get('POOL_ROLLUP_WRITE_BACKOFF_SECONDS', 0.05))
+pool_rollup_index = 'ByPeriod'
+
+# A transaction holds at most 100 items, room is left for the 24 hour buckets and the day
+# bucket of a day
+transaction_max_markers = 100 - 25
+
+# Markers only need to outlive stream and state machine retries
+marker_retention_seconds = 2*24*60*60
+
+counters = ('Launches', 'Interruptions')
+
+time_format = '%Y-%m-%dT%H:%M:%SZ'
+
+def pool_key(region, availability_zone, instance_type):
+    return '{}#{}#{}'.format(region, availability_zone, instance_type)
+
+def parse_time(value):
+    return datetime.datetime.fromtimestamp(calendar.timegm(time.strptime(value, time_format)), datetime.timezone.utc)
+
+def hour_bucket(value):
+    return value.strftime('H#%Y-%m-%dT%H')
+
+def day_bucket(value):
+    return value.strftime('D#%Y-%m-%d')
+
+def marker_put(table_name, marker, counter, serialize, now):
+    return {
+        'Put': {
+            'TableName': table_name,
+            'Item': {
+                'Pool': serialize(marker),
+                'Bucket': serialize(counter),
+                'ExpirationTime': serialize(now + marker_retention_seconds)
+            },
+            'ConditionExpression': 'attribute_not_exists(#Pool)',
+            'ExpressionAttributeNames': {'#Pool': 'Pool'}
+        }
+    }
+
+def counter_update(table_name, pool, counter, bucket, count, event_time, serialize):
+    return {
+        'Update': {
+            'TableName': table_name,
+            'Key': {
+                'Pool': serialize(pool_key(pool['Region'], pool['AvailabilityZone'], pool['InstanceType'])),
+                'Bucket': serialize(bucket)
+            },
+            'UpdateExpression': 'ADD #Counter :one SET #Period = :Period, #Region = :Region, #AvailabilityZone = :AvailabilityZone, #InstanceType = :InstanceType, #ExpirationTime = :ExpirationTime',
+            'ExpressionAttributeNames': {
+                '#Counter': counter,
+                '#Period': 'Period',
+                '#Region': 'Region',
+                '#AvailabilityZone': 'AvailabilityZone',
+                '#InstanceType': 'InstanceType',
+                '#ExpirationTime': 'ExpirationTime'
+            },
+            'ExpressionAttributeValues': {
+                ':one': serialize(count),
+                ':Period': serialize(bucket),
+                ':Region': serialize(pool['Region']),
+                ':AvailabilityZone': serialize(pool['AvailabilityZone']),
+                ':InstanceType': serialize(pool['InstanceType']),
+                ':ExpirationTime': serialize(int(calendar.timegm(event_time.timetuple())) + pool_rollup_retention_days*24*60*60)
+            }
+        }
+    }
+
+def counter_transaction(table_name, pool, counter, increments, serialize):
+
+    # increments are (marker, event_time, count) of one pool and day: a Put of each marker, in
+    # the order of increments, then one Update of each hour bucket and one of the day bucket
+    # with the summed counts, so the transaction touches every counter item once
+    now = int(time.time())
+    buckets = {}
+    for marker, event_time, count in increments:
+        for bucket in (hour_bucket(event_time), day_bucket(event_time)):
+            total, latest = buckets.get(bucket, (0, event_time))
+            buckets[bucket] = (total + count, max(latest, event_time))
+
+    items = [marker_put(table_name, marker, counter, serialize, now) for marker, event_time, count in increments]
+    for bucket, (count, event_time) in sorted(buckets.items()):
+        items.append(counter_update(table_name, pool, counter, bucket, count, event_time, serialize))
+
+    return items
+
+def increment_counters(pool, counter, increments, table_name=None):
+
+    # Writes the increments of one pool and day, returns the markers counted and the markers
+    # already counted. A marker counted before cancels the transaction, it is dropped and the
+    # rest written again. Transactions of other invocations updating the same counter items
+    # cancel it with TransactionConflict, which the SDK does not retry, so it is retried here
+    # with jittered exponential backoff.
+    dynamodb = clients.client('dynamodb', max_pool_connections=pool_rollup_write_concurrency)
+    serializer = clients.serializer()
+
+    counted = []
+    duplicates = []
+    for start in range(0, len(increments), transaction_max_markers):
+        pending = increments[start:start + transaction_max_markers]
+        attempt = 0
+        while pending:
+            try:
+                dynamodb.transact_write_items(
+                    TransactItems=counter_transaction(table_name or pool_rollup_table, pool, counter, pending, serializer.serialize)
+                )
+                counted.extend(marker for marker, event_time, count in pending)
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+
+                # The markers are the first items of the transaction
+                counted_before = [index for index, code in enumerate(codes[:len(pending)]) if code == 'ConditionalCheckFailed']
+                if counted_before:
+                    duplicates.extend(pending[index][0] for index in counted_before)
+                    pending = [increment for index, increment in enumerate(pending) if index not in counted_before]
+                    continue
+
+                attempt += 1
+                if 'TransactionConflict' not in codes or attempt >= pool_rollup_write_max_attempts:
+                    raise
+                time.sleep(random.uniform(0, pool_rollup_write_backoff_seconds * 2 ** attempt))
+
+    return counted, duplicates
+
+class PoolRollupWriter(object):
+
+    # Collects the counter increments of an invocation, sums them per pool and bucket and
+    # writes one transaction per pool and day. Pools and days are written concurrently, the
+    # transactions of a pool and day one after another.
+
+    def __init__(self, counter, table_name=None):
+        self.counter = counter
+        self.table_name = table_name or pool_rollup_table
+        self.increments = []
+
+    def add(self, instance, event_time, count=1, marker=None):
+        self.increments.append((instance, event_time, count, marker))
+
+    def groups(self):
+
+        # (pool, increments) per pool and day, a marker added twice is counted once
+        groups = {}
+        markers = set()
+        for instance, event_time, count, marker in self.increments:
+            marker = marker or 'Marker#{}'.format(instance['InstanceId'])
+            if marker in markers:
+                logger.debug('Instance already counted', InstanceId=marker, Counter=self.counter)
+                continue
+            markers.add(marker)
+
+            event_time = parse_time(event_time)
+            pool = dict((attribute, instance[attribute]) for attribute in ('Region', 'AvailabilityZone', 'InstanceType'))
+            key = (pool_key(pool['Region'], pool['AvailabilityZone'], pool['InstanceType']), day_bucket(event_time))
+            groups.setdefault(key, (pool, []))[1].append((marker, event_time, count))
+
+        return list(groups.values())
+
+    def flush(self):
+
+        if not self.increments:
+            return 0
+
+        groups = self.groups()
+        with ThreadPoolExecutor(max_workers=min(len(groups), pool_rollup_write_concurrency)) as executor:
+            futures = [
+                (executor.submit(increment_counters, pool, self.counter, increments, self.table_name), pool, increments)
+                for pool, increments in groups
+            ]
+
+        counted = 0
+        failed = []
+        for future, pool, increments in futures:
+            try:
+                markers, duplicates = future.result()
+                counted += len(markers)
+                for marker in duplicates:
+                    logger.debug('Instance already counted', InstanceId=marker, Counter=self.counter)
+            except ClientError as e:
+                logger.error('Error counting instances', Pool=pool_key(pool['Region'], pool['AvailabilityZone'], pool['InstanceType']), Counter=self.counter, Instances=len(increments), Error=str(e))
+                failed.extend(marker for marker, event_time, count in increments)
+
+        logger.info('Counted instances', Counter=self.counter, Counted=counted, Instances=len(self.increments), Pools=len(groups))
+        self.increments = []
+
+        if failed:
+            raise Exception('Error updating {} pool rollups for instances: {}'.format(self.counter, ', '.join(failed)))
+
+        return counted
+
+def window_buckets(start, end):
+
+    # Hour buckets covering [start, end), whole UTC days are read from their day bucket
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    buckets = []
+
+    while hour < end:
+        day_end = hour + datetime.timedelta(days=1)
+        if hour.hour == 0 and day_end <= end:
+            buckets.append(day_bucket(hour))
+            hour = day_end
+        else:
+            buckets.append(hour_bucket(hour))
+            hour += datetime.timedelta(hours=1)
+
+    return buckets
+
+def query_bucket(table_name, bucket, pool_prefix):
+
+    dynamodb = clients.client('dynamodb')
+    key_condition = '#Period = :Period'
+    values = {':Period': {'S': bucket}}
+    names = {'#Period': 'Period'}
+
+    if pool_prefix:
+        key_condition += ' AND begins_with(#Pool, :Pool)'
+        values[':Pool'] = {'S': pool_prefix}
+        names['#Pool'] = 'Pool'
+
+    items = []
+    paginator = dynamodb.get_paginator('query')
+    for page in paginator.paginate(
+            TableName=table_name,
+            IndexName=pool_rollup_index,
+            KeyConditionExpression=key_condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values):
+        items.extend(page['Items'])
+
+    return items
+
+def query_pool_counts(start, end, group_by=('Region', 'AvailabilityZone', 'InstanceType'), pool_prefix=None, table_name=None):
+
+    # Launches, interruptions and interruption rate per group over [start, end), rounded
+    # out to whole hours. pool_prefix narrows to a Region or Region#AvailabilityZone
+    table_name = table_name or pool_rollup_table
+    buckets = window_buckets(start, end)
+
+    with ThreadPoolExecutor(max_workers=min(len(buckets), 16) or 1) as executor:
+        pages = list(executor.map(lambda bucket: query_bucket(table_name, bucket, pool_prefix), buckets))
+
+    groups = {}
+    for items in pages:
+        for item in items:
+            key = tuple(item[attribute]['S'] for attribute in group_by)
+            group = groups.setdefault(key, dict(zip(group_by, key), Launches=0, Interruptions=0))
+            for counter in counters:
+                if counter in item:
+                    group[counter] += int(item[counter]['N'])
+
+    results = []
+    for group in groups.values():
+        group['InterruptionRate'] = group['Interruptions'] / float(group['Launches']) if group['Launches'] else None
+        results.append(group)
+
+    return sorted(results, key=lambda group: (-group['Interruptions'], -group['Launches']))
@@ -0,0 +1,237 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+import bisect
+import calendar
+import datetime
+import threading
+
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from spot_dashboard import logs
+
+logger = logs.get_logger()
+
+# Spot price history cached per (AvailabilityZone, InstanceType, ProductDescription) and
+# time bucket. An entry holds the price changes within its bucket and the price in effect
+# at the start of the bucket, so the price at any time in the bucket is a binary search.
+# Missing entries are fetched with one DescribeSpotPriceHistory request per bucket and
+# product, covering every Availability Zone and instance type asked for. Buckets that have
+# ended never change and live until their TTL, the current bucket is refreshed in the
+# background while the cached prices keep being served.
+
+time_format = '%Y-%m-%dT%H:%M:%SZ'
+
+default_product_description = os.environ.get('SPOT_PRICE_PRODUCT_DESCRIPTION', 'Linux/UNIX')
+
+def epoch_seconds(value):
+
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    return calendar.timegm(time.strptime(value, time_format))
+
+# The ProductDescription of the Spot price history for the PlatformDetails of an instance,
+# by prefix: "Windows with SQL Server Standard" is priced as Windows, "Red Hat Enterprise
+# Linux with HA" as Red Hat Enterprise Linux
+product_descriptions = ['Red Hat Enterprise Linux', 'SUSE Linux', 'Windows', 'Linux/UNIX']
+
+def product_description(instance):
+
+    platform_details = instance.get('PlatformDetails') or ''
+    for description in product_descriptions:
+        if platform_details.startswith(description):
+            return description
+
+    return default_product_description
+
+class SpotPriceCache(object):
+
+    def __init__(self, bucket_seconds, ttl_seconds, refresh_seconds, max_size, client=None):
+        self.bucket_seconds = bucket_seconds
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.max_size = max_size
+        self.client = client
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.refreshing = set()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def bucket(self, timestamp):
+        return timestamp - timestamp % self.bucket_seconds
+
+    def get(self, availability_zone, instance_type, product, timestamp):
+        return self.get_many([(availability_zone, instance_type, product, timestamp)])[0]
+
+    def get_many(self, lookups):
+
+        # lookups are (AvailabilityZone, InstanceType, ProductDescription, time) tuples, the
+        # result is the price in effect at each time, or None when there is no price history
+        now = time.time()
+        requests = [(availability_zone, instance_type, product, epoch_seconds(timestamp)) for availability_zone, instance_type, product, timestamp in lookups]
+        keys = [(availability_zone, instance_type, product, self.bucket(timestamp)) for availability_zone, instance_type, product, timestamp in requests]
+
+        found = {}
+        missing = []
+        stale = []
+        with self.lock:
+            for key in set(keys):
+                entry = self.entries.get(key)
+                if entry is not None and entry['Expires'] > now:
+                    self.entries.move_to_end(key)
+                    found[key] = entry
+                    self.hits += 1
+                    if entry['Refresh'] is not None and entry['Refresh'] <= now:
+                        stale.append(key)
+                else:
+                    missing.append(key)
+                    self.misses += 1
+
+        if missing:
+            found.update(self.fetch(missing, now))
+        if stale:
+            self.refresh(stale)
+
+        return [price_at(found[key], request[3]) for key, request in zip(keys, requests)]
+
+    def fetch(self, keys, now):
+
+        # One request per bucket and product, for every Availability Zone and instance type
+        groups = {}
+        for availability_zone, instance_type, product, bucket in keys:
+            group = groups.setdefault((bucket, product), (set(), set()))
+            group[0].add(availability_zone)
+            group[1].add(instance_type)
+
+        fetched = {}
+        for (bucket, product), (availability_zones, instance_types) in groups.items():
+            histories = self.describe_spot_price_history(sorted(availability_zones), sorted(instance_types), product, bucket, bucket + self.bucket_seconds)
+            for availability_zone in availability_zones:
+                for instance_type in instance_types:
+                    # Pools without a price history are cached as empty so they are not fetched again
+                    histories.setdefault((availability_zone, instance_type), [])
+            for (availability_zone, instance_type), points in histories.items():
+                fetched[(availability_zone, instance_type, product, bucket)] = self.entry(bucket, points, now)
+
+        with self.lock:
+            for key, entry in fetched.items():
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return fetched
+
+    def entry(self, bucket, points, now):
+
+        points.sort()
+        complete = bucket + self.bucket_seconds <= now
+
+        return {
+            'Times': [point[0] for point in points],
+            'Prices': [point[1] for point in points],
+            'Expires': now + self.ttl_seconds,
+            'Refresh': None if complete else now + self.refresh_seconds
+        }
+
+    def refresh(self, keys):
+
+        with self.lock:
+            keys = [key for key in keys if key not in self.refreshing]
+            self.refreshing.update(keys)
+            if not keys:
+                return
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            self.refreshes += len(keys)
+
+        self.executor.submit(self.refresh_keys, keys)
+
+    def refresh_keys(self, keys):
+
+        try:
+            self.fetch(keys, time.time())
+        except Exception as e:
+            # The cached prices are served until the entries expire
+            logger.warning('Spot price refresh failed', Keys=len(keys), Error=str(e))
+        finally:
+            with self.lock:
+                self.refreshing.difference_update(keys)
+
+    def describe_spot_price_history(self, availability_zones, instance_types, product, start, end):
+
+        if self.client is None:
+            from spot_dashboard import clients
+            self.client = clients.client('ec2')
+
+        histories = {}
+
+        try:
+            # The response also holds the price in effect at StartTime for each pool
+            paginator = self.client.get_paginator('describe_spot_price_history')
+            for page in paginator.paginate(
+                    Filters=[{'Name': 'availability-zone', 'Values': availability_zones}],
+                    InstanceTypes=instance_types,
+                    ProductDescriptions=[product],
+                    StartTime=datetime.datetime.fromtimestamp(start, datetime.timezone.utc),
+                    EndTime=datetime.datetime.fromtimestamp(end, datetime.timezone.utc)):
+                for price in page['SpotPriceHistory']:
+                    histories.setdefault((price['AvailabilityZone'], price['InstanceType']), []).append(
+                        (int(price['Timestamp'].timestamp()), float(price['SpotPrice'])))
+
+        except ClientError as e:
+            message = 'Error describing spot price history: {}'.format(e)
+            logger.error(message)
+            raise Exception(message)
+
+        return histories
+
+    def stats(self):
+        with self.lock:
+            return {
+                'Hits': self.hits,
+                'Misses': self.misses,
+                'Refreshes': self.refreshes,
+                'Evictions': self.evictions,
+                'Size': len(self.entries)
+            }
+
+def price_at(entry, timestamp):
+
+    # The last price change at or before the time
+    index = bisect.bisect_right(entry['Times'], timestamp)
+    if index == 0:
+        return None
+
+    return entry['Prices'][index - 1]
+
+spot_price_cache = SpotPriceCache(
+    bucket_seconds=int(os.environ.get('SPOT_PRICE_CACHE_BUCKET_SECONDS', 6*60*60)),
+    ttl_seconds=int(os.environ.get('SPOT_PRICE_CACHE_TTL_SECONDS', 24*60*60)),
+    refresh_seconds=int(os.environ.get('SPOT_PRICE_CACHE_REFRESH_SECONDS', 5*60)),
+    max_size=int(os.environ.get('SPOT_PRICE_CACHE_MAX_SIZE', 4096))
+)
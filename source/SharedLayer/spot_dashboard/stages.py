@@ -0,0 +1,334 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+
+from botocore.exceptions import ClientError
+from spot_dashboard import clients, logs
+from spot_dashboard.instance_types import instance_type_cache
+
+logger = logs.get_logger()
+
+# The enrichment and sink steps of the Data Sink State Machine. The enrichment and sink
+# functions of the state machine call these, and the DataSinkTriggerFunction runs them
+# in-process when DATA_SINK_MODE is InProcess. An enrichment takes an instance and returns
+# it, a sink takes a batch of instances. Extend the functions below, or replace the entries
+# of stages, to change what both modes do.
+
+archive_full_tags = os.environ.get('ARCHIVE_FULL_TAGS', 'false').lower() == 'true'
+instance_metadata_stream = os.environ.get('INSTANCE_METADATA_STREAM')
+instance_metadata_table = os.environ.get('INSTANCE_METADATA_TABLE')
+
+# Instance IDs per DescribeTags call of the termination sink, a filter takes up to 200 values
+describe_tags_chunk_size = 200
+
+# Enrichment -------------------------------------------
+
+def add_instance_type_attributes(instance):
+
+    # Instance Type Attributes (vCPUs, Memory, Architectures, GPUs)
+    try:
+        instance.update(instance_type_cache.get(instance['InstanceType']))
+    except Exception as e:
+        logger.warning('Continuing without instance type attributes', InstanceType=instance['InstanceType'], Error=str(e))
+
+    logger.debug('Instance type cache', **instance_type_cache.stats())
+
+def add_spot_prices(instance):
+
+    from spot_dashboard.spot_prices import spot_price_cache, product_description
+
+    # Spot price of the pool at launch and at interruption, both looked up in one call
+    try:
+        pool = (instance['AvailabilityZone'], instance['InstanceType'], product_description(instance))
+        launch_price, interruption_price = spot_price_cache.get_many([
+            pool + (instance['LaunchedTime'],),
+            pool + (instance.get('InterruptionTime', instance['LastEventTime']),)
+        ])
+        if launch_price is not None:
+            instance['SpotPriceAtLaunch'] = launch_price
+        if interruption_price is not None:
+            instance['SpotPriceAtInterruption'] = interruption_price
+    except Exception as e:
+        logger.warning('Continuing without spot prices', AvailabilityZone=instance['AvailabilityZone'], InstanceType=instance['InstanceType'], Error=str(e))
+
+    logger.debug('Spot price cache', **spot_price_cache.stats())
+
+def describe_instance_tags(instance_ids):
+
+    # The full tag set of each instance, one paginated DescribeTags call per chunk of IDs
+    tags = dict((instance_id, []) for instance_id in instance_ids)
+    paginator = clients.client('ec2').get_paginator('describe_tags')
+
+    try:
+        for start in range(0, len(instance_ids), describe_tags_chunk_size):
+            chunk = instance_ids[start:start + describe_tags_chunk_size]
+            for page in paginator.paginate(Filters=[{'Name': 'resource-type', 'Values': ['instance']}, {'Name': 'resource-id', 'Values': chunk}], PaginationConfig={'PageSize': 1000}):
+                for tag in page['Tags']:
+                    tags[tag['ResourceId']].append({'Key': tag['Key'], 'Value': tag['Value']})
+
+    except ClientError as e:
+        message = 'Error describing tags: {}'.format(e)
+        logger.error(message)
+        raise Exception(message)
+
+    return tags
+
+def enrich_running_instance(instance):
+
+    # Extend this function to enrich Instance Metadata
+    add_instance_type_attributes(instance)
+
+    logger.debug('Instance', Instance=instance)
+    return instance
+
+def enrich_interrupted_instance(instance):
+
+    # Extend this function to enrich Instance Metadata
+    add_instance_type_attributes(instance)
+    add_spot_prices(instance)
+
+    logger.debug('Instance', Instance=instance)
+    return instance
+
+def enrich_terminated_instance(instance):
+
+    # Extend this function to enrich Instance Metadata
+    add_instance_type_attributes(instance)
+
+    # The full tag set is added by the termination sink, it is not carried through the
+    # state machine
+
+    logger.debug('Instance', Instance=instance)
+    return instance
+
+# Sinks ------------------------------------------------
+
+def sink_running_instances(instances):
+
+    from spot_dashboard.metrics import PoolMetricEmitter
+    from spot_dashboard.rollups import PoolRollupWriter
+
+    launches = PoolMetricEmitter("Launches")
+    rollups = PoolRollupWriter("Launches")
+
+    for instance in instances:
+        if instance['InstanceLifecycle'] == "spot":
+            logger.debug('Spot Instance, sending CloudWatch Metrics', InstanceId=instance['InstanceId'])
+            launches.add(instance)
+            rollups.add(instance, instance.get('LaunchedTime', instance['LastEventTime']))
+        else:
+            logger.debug('On-Demand Instance, skipping CloudWatch Metrics', InstanceId=instance['InstanceId'])
+
+    # Rollups first, they are idempotent if the batch is retried
+    rollups.flush()
+    launches.flush()
+
+def sink_interrupted_instances(instances):
+
+    from spot_dashboard.metrics import PoolMetricEmitter
+    from spot_dashboard.rollups import PoolRollupWriter
+
+    interruptions = PoolMetricEmitter("Interruptions")
+    rollups = PoolRollupWriter("Interruptions")
+
+    for instance in instances:
+        interruptions.add(instance)
+        rollups.add(instance, instance.get('InterruptionTime', instance['LastEventTime']))
+
+    # Rollups first, they are idempotent if the batch is retried
+    rollups.flush()
+    interruptions.flush()
+
+    store_spot_prices(instances)
+
+def store_spot_prices(instances):
+
+    # The prices of the interruption enrichment are kept on the InstanceMetadataTable item,
+    # where the termination archive picks them up. The MODIFY record of the write carries
+    # the event key of the interruption and is dropped by the IdempotencyTable.
+    if not instance_metadata_table:
+        return
+
+    dynamodb = clients.client('dynamodb')
+
+    for instance in instances:
+        prices = [(name, instance[name]) for name in ('SpotPriceAtLaunch', 'SpotPriceAtInterruption') if instance.get(name) is not None]
+        if not prices:
+            continue
+
+        try:
+            dynamodb.update_item(
+                TableName=instance_metadata_table,
+                Key={
+                    'InstanceId': {'S': instance['InstanceId']}
+                },
+                UpdateExpression='SET {}'.format(', '.join('#{0} = :{0}'.format(name) for name, price in prices)),
+                ConditionExpression='attribute_exists(#InstanceId)',
+                ExpressionAttributeNames=dict([('#InstanceId', 'InstanceId')] + [('#{}'.format(name), name) for name, price in prices]),
+                ExpressionAttributeValues=dict((':{}'.format(name), {'N': str(price)}) for name, price in prices),
+                ReturnValues='NONE'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                continue
+            logger.warning('Continuing without storing spot prices', InstanceId=instance['InstanceId'], Error=str(e))
+
+def add_full_tags(instances):
+
+    try:
+        tags = describe_instance_tags(list(dict.fromkeys(instance['InstanceId'] for instance in instances)))
+    except Exception as e:
+        logger.warning('Continuing with the allowed tags', Instances=len(instances), Error=str(e))
+        return
+
+    for instance in instances:
+        if tags.get(instance['InstanceId']):
+            instance['Tags'] = tags[instance['InstanceId']]
+
+def sink_terminated_instances(instances):
+
+    from spot_dashboard.event_history import decode_history
+    from spot_dashboard.firehose import FirehoseBatchSink
+
+    # Full Tag Set (DynamoDB only keeps the allowed tags)
+    if archive_full_tags:
+        add_full_tags(instances)
+
+    # Send Events to Firehose
+    sink = FirehoseBatchSink(instance_metadata_stream, client=clients.client('firehose'))
+
+    for instance in instances:
+        # The archive keeps the full {Name, Time, State} form of the compact EventHistory
+        instance['EventHistory'] = decode_history(instance.get('EventHistory'))
+        sink.put(instance)
+
+    sink.flush()
+    return instances
+
+# Pipeline ---------------------------------------------
+
+class Stage(object):
+
+    def __init__(self, name, enrich, sink, retry_sink=True):
+        self.name = name
+        self.enrich = enrich
+        self.sink = sink
+        self.retry_sink = retry_sink
+
+# Keyed by the routes of the state machine, each sink runs on its own. The termination sink
+# is not retried, Firehose keeps the records sent before a failure and a retry would
+# archive them twice.
+stages = {
+    'running': Stage('running', enrich_running_instance, sink_running_instances),
+    'interruption': Stage('interruption', enrich_interrupted_instance, sink_interrupted_instances),
+    'termination': Stage('termination', enrich_terminated_instance, sink_terminated_instances, retry_sink=False)
+}
+
+def route(instance):
+
+    # The LastEventType and InstanceState choices of the state machine
+    if instance.get('LastEventType') == 'state-change':
+        if instance.get('State') == 'terminated':
+            return 'termination'
+        if instance.get('State') == 'running':
+            return 'running'
+    elif instance.get('LastEventType') == 'spot-interruption':
+        return 'interruption'
+
+    return None
+
+def report_failures(failures):
+
+    # Instances whose enrichment failed are dropped by both modes. Each one is logged, and
+    # counted per stage in the InstanceFailures metric, so they can be alarmed on and sent
+    # again from the logs.
+    from spot_dashboard.metrics import put_stage_metric
+
+    counts = {}
+    for failure in failures:
+        instance = failure.get('instance') or {}
+        name = route(instance) or 'unknown'
+        logger.error('Instance failed', InstanceId=failure.get('InstanceId'), Stage=name, Error=failure.get('Error'), Instance=instance)
+        counts[name] = counts.get(name, 0) + 1
+
+    for name, count in counts.items():
+        put_stage_metric('InstanceFailures', name, count)
+
+    logger.info('Reported failed instances', Failures=len(failures), **counts)
+
+def prefetch_instance_types(instances):
+
+    # The instance types of the batch missing from the cache, in one DescribeInstanceTypes
+    # call, before the enrichment looks them up one instance at a time
+    instance_types = set(instance['InstanceType'] for instance in instances if route(instance) is not None and instance.get('InstanceType'))
+    if not instance_types:
+        return
+
+    try:
+        instance_type_cache.get_many(instance_types)
+    except Exception as e:
+        logger.warning('Continuing without prefetched instance types', InstanceTypes=len(instance_types), Error=str(e))
+
+def run(instances):
+
+    # Enriches each instance, then hands every sink its batch. As in the state machine, an
+    # instance whose enrichment fails is reported and skipped, and each sink runs whether or
+    # not the others fail. The instances of the failed sinks that can be retried are
+    # returned as pending.
+    batches = {name: [] for name in stages}
+    failures = []
+    timings = {}
+
+    started = time.perf_counter()
+    prefetch_instance_types(instances)
+    for instance in instances:
+        name = route(instance)
+        if name is None:
+            continue
+        try:
+            batches[name].append(stages[name].enrich(instance))
+        except Exception as e:
+            failures.append({'InstanceId': instance.get('InstanceId'), 'Status': 'Failed', 'Error': {'Error': type(e).__name__, 'Cause': str(e)}, 'instance': instance})
+    timings['Enrichment'] = round((time.perf_counter() - started) * 1000, 3)
+
+    if failures:
+        report_failures(failures)
+
+    pending = []
+    error = None
+    for name, batch in batches.items():
+        if batch:
+            started = time.perf_counter()
+            try:
+                stages[name].sink(batch)
+            except Exception as e:
+                logger.error('Sink failed', Stage=name, Instances=len(batch), Retried=stages[name].retry_sink, Error=str(e))
+                error = error or 'Error running the {} sink: {}'.format(name, e)
+                if stages[name].retry_sink:
+                    pending.extend(batch)
+            timings[name] = round((time.perf_counter() - started) * 1000, 3)
+
+    logger.info('Ran data sink stages', Failures=len(failures), Pending=len(pending), TimingsMs=timings, **{name: len(batch) for name, batch in batches.items()})
+
+    return {
+        'running': batches['running'],
+        'interruptions': batches['interruption'],
+        'terminations': batches['termination'],
+        'failures': failures,
+        'pending': pending,
+        'error': error
+    }
@@ -0,0 +1,79 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+from spot_dashboard.stream_images import attribute
+
+# The stream records each consumer of the InstanceMetadataTable stream acts on, as the
+# FilterCriteria patterns of its event source mapping and as the predicate its handler
+# applies to every record it still receives. A record is delivered when it matches any of
+# the patterns. tools/check_stream_filters.py checks that the patterns in template.yaml are
+# the ones below and that patterns and predicates agree, change them together.
+
+# New instances, described and enriched once
+enrichment_patterns = [
+    {'eventName': ['INSERT']}
+]
+
+# Enriched instances that launched, terminated or got an interruption warning
+data_sink_patterns = [
+    {
+        'eventName': ['MODIFY'],
+        'dynamodb': {
+            'NewImage': {
+                'InstanceMetadataEnriched': {'BOOL': [True]},
+                'LastEventType': {'S': ['state-change']},
+                'State': {'S': ['running', 'terminated']}
+            }
+        }
+    },
+    {
+        'eventName': ['MODIFY'],
+        'dynamodb': {
+            'NewImage': {
+                'InstanceMetadataEnriched': {'BOOL': [True]},
+                'LastEventType': {'S': ['spot-interruption']}
+            }
+        }
+    }
+]
+
+def is_enrichment_record(record):
+    return record['eventName'] == 'INSERT'
+
+def is_data_sink_record(record):
+
+    if record['eventName'] != 'MODIFY':
+        return False
+
+    item = record['dynamodb'].get('NewImage', {})
+
+    if attribute(item, 'InstanceMetadataEnriched') != True:
+        return False
+
+    if attribute(item, 'LastEventType') == 'state-change':
+        return attribute(item, 'State') in ('running', 'terminated')
+
+    return attribute(item, 'LastEventType') == 'spot-interruption'
+
+# Per consumer, the patterns of its event source mapping and the predicate of its handler
+stream_filters = {
+    'InstanceMetadataEnrichmentFunction': (enrichment_patterns, is_enrichment_record),
+    'DataSinkTriggerFunction': (data_sink_patterns, is_data_sink_record)
+}
+
+def filter_criteria(patterns):
+    return {'Filters': [{'Pattern': json.dumps(pattern, separators=(',', ':'))} for pattern in patterns]}
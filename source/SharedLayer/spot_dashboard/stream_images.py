@@ -0,0 +1,68 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Decodes the typed attribute values of DynamoDB stream images (NewImage, OldImage) into
+# plain Python values, walking the dictionaries Lambda already parsed rather than going
+# through a JSON round trip. Numbers become int, or float when they have a fraction or an
+# exponent, never Decimal, so the result can be passed to json.dumps as it is. Strings are
+# kept as strings and number sets become lists. Only the attributes asked for are decoded,
+# a filter on LastEventType does not pay for the Tags or the EventHistory of the item.
+
+def decode_number(value):
+    if '.' in value or 'e' in value or 'E' in value:
+        return float(value)
+    return int(value)
+
+def decode_value(value):
+
+    # value is a single {type: value} map
+    for value_type, data in value.items():
+        if value_type == 'S':
+            return data
+        if value_type == 'N':
+            return decode_number(data)
+        if value_type == 'BOOL':
+            return data
+        if value_type == 'M':
+            return {key: decode_value(item) for key, item in data.items()}
+        if value_type == 'L':
+            return [decode_value(item) for item in data]
+        if value_type == 'NULL':
+            return None
+        if value_type == 'SS':
+            return list(data)
+        if value_type == 'NS':
+            return [decode_number(item) for item in data]
+        if value_type in ('B', 'BS'):
+            # Base64 as delivered in the stream record
+            return data
+
+        raise ValueError('Unsupported attribute type: {}'.format(value_type))
+
+    raise ValueError('Empty attribute value')
+
+def attribute(image, name, default=None):
+    value = image.get(name)
+    if value is None:
+        return default
+    return decode_value(value)
+
+def decode_image(image, attributes=None):
+
+    # The whole image, or only the attributes named that are present in it
+    if attributes is None:
+        return {name: decode_value(value) for name, value in image.items()}
+
+    return {name: decode_value(image[name]) for name in attributes if name in image}
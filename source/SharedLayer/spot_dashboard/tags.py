@@ -0,0 +1,46 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+
+# Comma separated tag keys to keep on instances. A trailing * matches a key prefix, and a
+# single * keeps every tag.
+default_instance_tag_allowlist = 'aws:autoscaling:groupName,aws:ec2spot:fleet-request-id,aws:ec2:fleet-id,Name'
+
+def parse_tag_patterns(value):
+    return [pattern.strip() for pattern in value.split(',') if pattern.strip()]
+
+def tag_key_allowed(key, patterns):
+
+    for pattern in patterns:
+        if pattern.endswith('*'):
+            if key.startswith(pattern[:-1]):
+                return True
+        elif key == pattern:
+            return True
+
+    return False
+
+def filter_tags(tags, patterns=None):
+
+    if patterns is None:
+        patterns = instance_tag_patterns
+
+    if '*' in patterns:
+        return list(tags)
+
+    return [tag for tag in tags if tag_key_allowed(tag['Key'], patterns)]
+
+instance_tag_patterns = parse_tag_patterns(os.environ.get('INSTANCE_TAG_ALLOWLIST', default_instance_tag_allowlist))
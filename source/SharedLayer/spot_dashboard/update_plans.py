@@ -0,0 +1,187 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from botocore.exceptions import ClientError
+from spot_dashboard import clients
+from spot_dashboard.event_history import event_history_max_events, rewrite_history
+
+# The UpdateItem of each trigger function, built once at import time, and of each
+# attribute set the InstanceEventIngestFunction writes, built on first use: the update and
+# condition expressions and the attribute names are shared by every write, and values are
+# encoded straight to the low-level wire format by the type of their attribute instead of
+# going through the Table resource and the TypeSerializer. Writes append to EventHistory
+# as event_history.update_with_history does, and fall back to its trimmed rewrite when the
+# list is full.
+
+def string_value(value):
+    return {'S': value}
+
+def number_value(value):
+    return {'N': str(value)}
+
+def bool_value(value):
+    return {'BOOL': value}
+
+def history_value(events):
+    return {'L': [{'N': str(event)} for event in events]}
+
+encoders = {
+    'S': string_value,
+    'N': number_value,
+    'BOOL': bool_value
+}
+
+class UpdatePlan(object):
+
+    def __init__(self, attributes, max_events=None):
+
+        # attributes are (name, type) pairs, type being S, N or BOOL
+        self.max_events = event_history_max_events if max_events is None else max_events
+        self.fields = [(name, ':{}'.format(name), encoders[attribute_type]) for name, attribute_type in attributes]
+
+        self.set_expression = 'SET {}'.format(', '.join('#{0} = :{0}'.format(name) for name, attribute_type in attributes))
+        self.update_expression = '{}, #EventHistory = list_append(if_not_exists(#EventHistory, :empty_list), :EventHistory)'.format(self.set_expression)
+        self.condition_expression = 'attribute_not_exists(#EventHistory) OR size(#EventHistory) <= :EventHistoryLimit'
+        self.names = dict(('#{}'.format(name), name) for name, attribute_type in attributes)
+        self.names['#EventHistory'] = 'EventHistory'
+        self.empty_list = {'L': []}
+        self.limits = {}
+
+    def values(self, item):
+        return dict((placeholder, encode(item[name])) for name, placeholder, encode in self.fields)
+
+    def limit(self, count):
+        if count not in self.limits:
+            self.limits[count] = number_value(self.max_events - count)
+        return self.limits[count]
+
+    def arguments(self, table_name, item, events):
+
+        values = self.values(item)
+        values[':EventHistory'] = history_value(events)
+        values[':empty_list'] = self.empty_list
+        values[':EventHistoryLimit'] = self.limit(len(events))
+
+        return {
+            'TableName': table_name,
+            'Key': {'InstanceId': {'S': item['InstanceId']}},
+            'UpdateExpression': self.update_expression,
+            'ConditionExpression': self.condition_expression,
+            'ExpressionAttributeNames': self.names,
+            'ExpressionAttributeValues': values,
+            'ReturnValues': 'NONE'
+        }
+
+    def update(self, dynamodb, table_name, item, events):
+
+        # dynamodb is a low-level client, item holds InstanceId and the plan's attributes
+        try:
+            return dynamodb.update_item(**self.arguments(table_name, item, events))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        return rewrite_history(
+            dynamodb,
+            events,
+            clients.serializer().serialize,
+            clients.deserializer().deserialize,
+            self.max_events,
+            self.set_expression,
+            self.names,
+            self.values(item),
+            TableName=table_name,
+            Key={'InstanceId': {'S': item['InstanceId']}},
+            ReturnValues='NONE'
+        )
+
+# Keyed by (LastEventType, State), as event_history.event_codes
+update_plans = {
+    ('spot-launch', 'none'): UpdatePlan([
+        ('Region', 'S'),
+        ('LastEventTime', 'S'),
+        ('LastEventType', 'S'),
+        ('SpotInstanceRequestId', 'S'),
+        ('ExpirationTime', 'N')
+    ]),
+    ('state-change', 'running'): UpdatePlan([
+        ('Region', 'S'),
+        ('LastEventTime', 'S'),
+        ('LastEventType', 'S'),
+        ('State', 'S'),
+        ('LaunchedTime', 'S'),
+        ('ExpirationTime', 'N')
+    ]),
+    ('state-change', 'terminated'): UpdatePlan([
+        ('Region', 'S'),
+        ('LastEventTime', 'S'),
+        ('LastEventType', 'S'),
+        ('State', 'S'),
+        ('TerminatedTime', 'S')
+    ]),
+    ('rebalance-recommendation', 'none'): UpdatePlan([
+        ('Region', 'S'),
+        ('LastEventTime', 'S'),
+        ('LastEventType', 'S'),
+        ('RebalanceRecommended', 'BOOL'),
+        ('RebalanceRecommendationTime', 'S')
+    ]),
+    ('spot-interruption', 'none'): UpdatePlan([
+        ('Region', 'S'),
+        ('LastEventTime', 'S'),
+        ('LastEventType', 'S'),
+        ('Interrupted', 'BOOL'),
+        ('InterruptedInstanceAction', 'S'),
+        ('InterruptionTime', 'S')
+    ])
+}
+
+def update_instance(dynamodb, table_name, item, events):
+    return update_plans[(item['LastEventType'], item['State'])].update(dynamodb, table_name, item, events)
+
+# The coalesced writes of the InstanceEventIngestFunction merge the attributes of several
+# events, their plans are built on first use and kept per attribute set
+attribute_types = {
+    'Region': 'S',
+    'LastEventTime': 'S',
+    'LastEventType': 'S',
+    'State': 'S',
+    'SpotInstanceRequestId': 'S',
+    'ExpirationTime': 'N',
+    'LaunchedTime': 'S',
+    'TerminatedTime': 'S',
+    'RebalanceRecommended': 'BOOL',
+    'RebalanceRecommendationTime': 'S',
+    'Interrupted': 'BOOL',
+    'InterruptedInstanceAction': 'S',
+    'InterruptionTime': 'S'
+}
+
+coalesced_plans = {}
+
+def coalesced_plan(attributes):
+
+    key = tuple(sorted(attributes))
+    plan = coalesced_plans.get(key)
+    if plan is None:
+        plan = coalesced_plans.setdefault(key, UpdatePlan([(name, attribute_types[name]) for name in key]))
+
+    return plan
+
+def update_coalesced(dynamodb, table_name, write):
+
+    # write is a coalesced write of spot_dashboard.instance_events
+    item = dict(write['Attributes'], InstanceId=write['InstanceId'])
+    return coalesced_plan(write['Attributes']).update(dynamodb, table_name, item, write['History'])
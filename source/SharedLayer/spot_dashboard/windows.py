@@ -0,0 +1,106 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import time
+import calendar
+
+from spot_dashboard import logs
+
+logger = logs.get_logger()
+
+# Launch and interruption counts carried across the invocations of a DynamoDB stream
+# tumbling window. Lambda hands the state returned by one invocation to the next one of the
+# same shard and window, and flags the last invocation of the window, which writes one
+# metric document per pool and counter and one rollup update per pool, counter and hour.
+# The state is a JSON map of Counter#Region#AvailabilityZone#InstanceType#Hour to a count,
+# so it stays well below the 1 MB state limit. add_instances and window_counts do no I/O.
+
+time_format = '%Y-%m-%dT%H:%M:%SZ'
+
+def is_window_event(event):
+    return 'window' in event
+
+def is_final_invoke(event):
+    return event.get('isFinalInvokeForWindow', False) or event.get('isWindowTerminatedEarly', False)
+
+def window_counter(instance, name):
+
+    # The counter and event time the running and interruption sinks would count the
+    # instance under, name is the stages.route of the instance
+    if name == 'running':
+        if instance.get('InstanceLifecycle') != 'spot':
+            return None
+        return 'Launches', instance.get('LaunchedTime', instance['LastEventTime'])
+    if name == 'interruption':
+        return 'Interruptions', instance.get('InterruptionTime', instance['LastEventTime'])
+
+    return None
+
+def hour_start(event_time):
+    seconds = calendar.timegm(time.strptime(event_time, time_format))
+    return time.strftime(time_format, time.gmtime(seconds - seconds % 3600))
+
+def count_key(counter, instance, event_time):
+    return '#'.join((counter, instance['Region'], instance['AvailabilityZone'], instance['InstanceType'], hour_start(event_time)))
+
+def add_instances(state, instances):
+
+    # instances are (counter, event_time, instance) tuples, returns the new state
+    counts = dict((state or {}).get('Counts', {}))
+    for counter, event_time, instance in instances:
+        key = count_key(counter, instance, event_time)
+        counts[key] = counts.get(key, 0) + 1
+
+    return {'Counts': counts}
+
+def window_counts(state):
+
+    # (counter, pool, hour, count) of a window state, pool being the Region,
+    # AvailabilityZone and InstanceType of the rollups and metrics
+    results = []
+    for key, count in sorted((state or {}).get('Counts', {}).items()):
+        counter, region, availability_zone, instance_type, hour = key.split('#')
+        results.append((counter, {'Region': region, 'AvailabilityZone': availability_zone, 'InstanceType': instance_type}, hour, count))
+
+    return results
+
+def window_marker(shard_id, window_start, counter, pool, hour):
+    return 'Marker#Window#{}#{}#{}#{}#{}#{}#{}'.format(shard_id, window_start, counter, pool['Region'], pool['AvailabilityZone'], pool['InstanceType'], hour)
+
+def flush_window(state, window, shard_id):
+
+    # Writes the counts of a closed window. The rollup updates carry a marker for the shard,
+    # window, pool and hour, so a retried final invocation does not count them twice.
+    from spot_dashboard.metrics import PoolMetricEmitter
+    from spot_dashboard.rollups import PoolRollupWriter
+
+    counts = window_counts(state)
+    emitters = {}
+    writers = {}
+
+    for counter, pool, hour, count in counts:
+        if counter not in emitters:
+            emitters[counter] = PoolMetricEmitter(counter)
+            writers[counter] = PoolRollupWriter(counter)
+        emitters[counter].add(pool, count)
+        writers[counter].add(pool, hour, count, window_marker(shard_id, window['start'], counter, pool, hour))
+
+    # Rollups first, they are idempotent if the final invocation is retried
+    for counter in writers:
+        writers[counter].flush()
+    for counter in emitters:
+        emitters[counter].flush()
+
+    logger.info('Closed window', ShardId=shard_id, WindowStart=window['start'], WindowEnd=window['end'], Counts=len(counts), Instances=sum(count for counter, pool, hour, count in counts))
@@ -13,21 +13,22 @@
  # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
  # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
 import os
-import json
-import logging
 
 from botocore.exceptions import ClientError
+from spot_dashboard import clients, logs
+from spot_dashboard.event_history import encode_event
+from spot_dashboard.update_plans import update_instance
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = logs.get_logger()
 
-instance_metadata_table = boto3.resource('dynamodb').Table(os.environ['INSTANCE_METADATA_TABLE'])
+instance_metadata_table = os.environ['INSTANCE_METADATA_TABLE']
 
 def lambda_handler(event, context):
 
-    logger.info(event)
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
 
     # Transform CloudWatch Event
     item = {
@@ -41,45 +42,21 @@ def lambda_handler(event, context):
         'InterruptionTime': event['time']
     }
 
-    logger.info(item)
+    logger.debug('Item', Item=item)
 
     # Commit to DynamoDB
     try:
-        response=instance_metadata_table.update_item(
-            Key={
-                'InstanceId': item['InstanceId']
-            },
-            UpdateExpression="SET #Region = :Region, #LastEventTime = :LastEventTime, #LastEventType = :LastEventType, #Interrupted = :Interrupted, #InterruptedInstanceAction = :InterruptedInstanceAction, #InterruptionTime = :InterruptionTime, #EventHistory = list_append(if_not_exists(#EventHistory, :empty_list), :EventHistory)",
-            ExpressionAttributeNames={
-                '#Region' : 'Region',
-                '#LastEventTime' : 'LastEventTime',
-                '#LastEventType' : 'LastEventType',
-                '#Interrupted' : 'Interrupted',
-                '#InterruptedInstanceAction' : 'InterruptedInstanceAction',
-                '#InterruptionTime' : 'InterruptionTime',
-                '#EventHistory' : 'EventHistory'
-            },
-            ExpressionAttributeValues={
-                ':Region': item['Region'],
-                ':LastEventTime': item['LastEventTime'],
-                ':LastEventType': item['LastEventType'],
-                ':Interrupted': item['Interrupted'],
-                ':InterruptedInstanceAction': item['InterruptedInstanceAction'],
-                ':InterruptionTime': item['InterruptionTime'],
-                ':EventHistory': [{ 
-                    "Name":  item['LastEventType'], 
-                    "Time": item['LastEventTime'],
-                    "State": item['State']
-                }],
-                ":empty_list": []
-                },
-            ReturnValues="NONE"
+        response=update_instance(
+            clients.client('dynamodb'),
+            instance_metadata_table,
+            item,
+            [encode_event(item['LastEventType'], item['State'], item['LastEventTime'])]
         )
 
-        logger.info(response)
+        logger.debug('Response', Response=response)
     except ClientError as e:
         message = 'Error updating instance in DynamoDB: {}'.format(e)
-        logger.info(message)
+        logger.error(message)
         raise Exception(message)
 
     # End
@@ -13,23 +13,25 @@
  # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
  # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
 import os
 import time
-import logging
 
 from botocore.exceptions import ClientError
+from spot_dashboard import clients, logs
+from spot_dashboard.event_history import encode_event
+from spot_dashboard.update_plans import update_instance
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = logs.get_logger()
 
-instance_metadata_table = boto3.resource('dynamodb').Table(os.environ['INSTANCE_METADATA_TABLE'])
+instance_metadata_table = os.environ['INSTANCE_METADATA_TABLE']
 item_retention_days = os.environ['INSTANCE_METADATA_ITEM_RETENTION_DAYS']
 item_expiration_days = int(item_retention_days)*60*60*24
 
 def lambda_handler(event, context):
 
-    logger.info(event)
+    logger.start_invocation(context)
+    logger.info('Received event', **logs.summarize_event(event))
+    logger.debug('Event', Event=event)
 
     if event['detail']['state'] == "running":
 
@@ -44,45 +46,21 @@ def lambda_handler(event, context):
             'ExpirationTime': int(time.time() + item_expiration_days)
         }
 
-        logger.info(item)
+        logger.debug('Item', Item=item)
 
         # Commit to DynamoDB
         try:
-            response=instance_metadata_table.update_item(
-                Key={
-                    'InstanceId': item['InstanceId']
-                    },
-                UpdateExpression="SET #Region = :Region, #LastEventTime = :LastEventTime, #LastEventType = :LastEventType, #State = :State, #LaunchedTime = :LaunchedTime, #ExpirationTime = :ExpirationTime, #EventHistory = list_append(if_not_exists(#EventHistory, :empty_list), :EventHistory)",
-                ExpressionAttributeNames={
-                    '#Region' : 'Region',
-                    '#LastEventTime' : 'LastEventTime',
-                    '#LastEventType' : 'LastEventType',
-                    '#State' : 'State',
-                    '#LaunchedTime': 'LaunchedTime',
-                    '#ExpirationTime': 'ExpirationTime',
-                    '#EventHistory' : 'EventHistory'
-                },
-                ExpressionAttributeValues={
-                    ':Region': item['Region'],
-                    ':LastEventTime': item['LastEventTime'],
-                    ':LastEventType': item['LastEventType'],
-                    ':State': item['State'],
-                    ':LaunchedTime': item['LaunchedTime'],
-                    ':ExpirationTime': item['ExpirationTime'],
-                    ':EventHistory': [{ 
-                        "Name":  item['LastEventType'], 
-                        "Time": item['LastEventTime'],
-                        "State": item['State']
-                    }],
-                    ":empty_list": []
-                    },
-                ReturnValues="NONE"
+            response=update_instance(
+                clients.client('dynamodb'),
+                instance_metadata_table,
+                item,
+                [encode_event(item['LastEventType'], item['State'], item['LastEventTime'])]
             )
             
-            logger.info(response)
+            logger.debug('Response', Response=response)
         except ClientError as e:
             message = 'Error updating instance in DynamoDB: {}'.format(e)
-            logger.info(message)
+            logger.error(message)
             raise Exception(message)
 
     if event['detail']['state'] == "terminated":
@@ -99,39 +77,17 @@ def lambda_handler(event, context):
 
         # Commit to DynamoDB
         try:
-            response=instance_metadata_table.update_item(
-                Key={
-                    'InstanceId': item['InstanceId']
-                    },
-                UpdateExpression="SET #Region = :Region, #LastEventTime = :LastEventTime, #LastEventType = :LastEventType, #State = :State, #TerminatedTime = :TerminatedTime, #EventHistory = list_append(if_not_exists(#EventHistory, :empty_list), :EventHistory)",
-                ExpressionAttributeNames={
-                    '#Region' : 'Region',
-                    '#LastEventTime' : 'LastEventTime',
-                    '#LastEventType' : 'LastEventType',
-                    '#State' : 'State',
-                    '#TerminatedTime': 'TerminatedTime',
-                    '#EventHistory' : 'EventHistory'
-                },
-                ExpressionAttributeValues={
-                    ':Region': item['Region'],
-                    ':LastEventTime': item['LastEventTime'],
-                    ':LastEventType': item['LastEventType'],
-                    ':State': item['State'],
-                    ':TerminatedTime': item['TerminatedTime'],
-                    ':EventHistory': [{ 
-                        "Name":  item['LastEventType'], 
-                        "Time": item['LastEventTime'],
-                        "State": item['State']
-                    }],
-                    ":empty_list": []
-                    },
-                ReturnValues="NONE"
+            response=update_instance(
+                clients.client('dynamodb'),
+                instance_metadata_table,
+                item,
+                [encode_event(item['LastEventType'], item['State'], item['LastEventTime'])]
             )
             
-            logger.info(response)
+            logger.debug('Response', Response=response)
         except ClientError as e:
             message = 'Error updating instance in DynamoDB: {}'.format(e)
-            logger.info(message)
+            logger.error(message)
             raise Exception(message)
 
     # End
@@ -0,0 +1,170 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import re
+import gzip
+import json
+import datetime
+
+# Firehose writes objects under YYYY/MM/DD/HH/ by default, or under the dt=YYYY-MM-DD/hour=HH/
+# partitions configured on the delivery stream.
+object_day_patterns = [
+    re.compile(r'(?:^|/)dt=(\d{4}-\d{2}-\d{2})/'),
+    re.compile(r'(?:^|/)(\d{4})/(\d{2})/(\d{2})/\d{2}/')
+]
+
+class LocalStore(object):
+
+    # A directory standing in for an S3 prefix, keys are relative paths
+
+    def __init__(self, root):
+        self.root = root
+
+    def uri(self, key=''):
+        return os.path.join(self.root, key)
+
+    def list(self, prefix=''):
+        for directory, directories, files in os.walk(self.root):
+            directories.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    yield {
+                        'Key': key,
+                        'Size': stat.st_size,
+                        'ETag': '{}-{}'.format(stat.st_size, int(stat.st_mtime_ns)),
+                        'LastModified': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+                    }
+
+    def open(self, key):
+        return open(os.path.join(self.root, key), 'rb')
+
+    def read(self, key):
+        with self.open(key) as stream:
+            return stream.read()
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+    def write(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial object
+        temporary_path = '{}.tmp'.format(path)
+        with open(temporary_path, 'wb') as stream:
+            stream.write(data)
+        os.replace(temporary_path, path)
+
+    def delete(self, key):
+        os.remove(os.path.join(self.root, key))
+
+class S3Store(object):
+
+    # An S3 bucket and prefix, keys are relative to the prefix
+
+    def __init__(self, bucket, prefix='', client=None, endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+
+    def uri(self, key=''):
+        return 's3://{}/{}{}'.format(self.bucket, self.prefix, key)
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                yield {
+                    'Key': item['Key'][len(self.prefix):],
+                    'Size': item['Size'],
+                    'ETag': item['ETag'].strip('"'),
+                    'LastModified': item['LastModified']
+                }
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+
+    def read(self, key):
+        return self.open(key).read()
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+def open_store(uri, endpoint_url=None):
+
+    # s3://bucket/prefix/ for S3 (or an S3 compatible endpoint), anything else is a local directory
+    if uri.startswith('s3://'):
+        bucket, _, prefix = uri[len('s3://'):].partition('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return S3Store(bucket, prefix, endpoint_url=endpoint_url)
+
+    return LocalStore(uri)
+
+def object_day(item):
+
+    for pattern in object_day_patterns:
+        match = pattern.search(item['Key'])
+        if match:
+            return '-'.join(match.groups())
+
+    return item['LastModified'].strftime('%Y-%m-%d')
+
+def iter_lines(store, key):
+
+    # Stream the object line by line instead of reading it into memory
+    stream = store.open(key)
+    if key.endswith('.gz'):
+        lines = stream = gzip.GzipFile(fileobj=stream)
+    elif hasattr(stream, 'iter_lines'):
+        lines = stream.iter_lines()
+    else:
+        lines = stream
+
+    try:
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        stream.close()
+
+def iter_documents(store, key):
+
+    for line in iter_lines(store, key):
+        yield json.loads(line)
+
+def is_instance_object(item):
+
+    # Skip Firehose error output, temporary files and anything that is not archive data
+    name = item['Key'].rsplit('/', 1)[-1]
+    return item['Size'] > 0 and not name.startswith('.') and not name.endswith('.tmp') and not name.endswith('.parquet')
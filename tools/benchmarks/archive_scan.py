@@ -0,0 +1,106 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Compares the bytes scanned and the time taken by the "interruptions by instance type"
+# sample query over the JSON archive and over its compacted Parquet copy.
+#
+#   python -m tools.benchmarks.archive_scan --generate 200000 --workdir /tmp/archive
+#   python -m tools.benchmarks.archive_scan --json s3://BUCKET/instances/ --parquet s3://BUCKET/parquet/instances/
+
+import sys
+import time
+import argparse
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from tools import synthetic
+from tools.archive import LocalStore, open_store, iter_documents, is_instance_object
+from tools.compact_instances import compact
+
+# Columns read by the QueryCountByInstanceTypesPastDay named query
+query_columns = ['region', 'availabilityzone', 'instancetype', 'instancelifecycle', 'interrupted', 'launchedtime', 'interruptiontime', 'terminatedtime']
+
+def scan_json(store):
+
+    started = time.perf_counter()
+    scanned_bytes = 0
+    groups = set()
+
+    for item in store.list():
+        if not is_instance_object(item):
+            continue
+        scanned_bytes += item['Size']
+        for instance in iter_documents(store, item['Key']):
+            if instance.get('Interrupted') == True:
+                groups.add((instance.get('Region'), instance.get('AvailabilityZone'), instance.get('InstanceType'), instance.get('InstanceLifecycle')))
+
+    return scanned_bytes, time.perf_counter() - started
+
+def scan_parquet(store):
+
+    started = time.perf_counter()
+    scanned_bytes = 0
+    for item in store.list():
+        if not item['Key'].endswith('.parquet'):
+            continue
+
+        parquet_file = pq.ParquetFile(store.open(item['Key']))
+
+        # Athena reads only the column chunks of the projected columns
+        metadata = parquet_file.metadata
+        for row_group in range(metadata.num_row_groups):
+            for column in range(metadata.num_columns):
+                chunk = metadata.row_group(row_group).column(column)
+                if chunk.path_in_schema in query_columns:
+                    scanned_bytes += chunk.total_compressed_size
+
+        table = parquet_file.read(columns=query_columns)
+        table = table.filter(pc.equal(table['interrupted'], True))
+        table.group_by(['region', 'availabilityzone', 'instancetype', 'instancelifecycle']).aggregate([('interrupted', 'count')])
+
+    return scanned_bytes, time.perf_counter() - started
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark the sample Athena query scan over JSON and Parquet.')
+    parser.add_argument('--json', help='JSON archive location (s3://bucket/instances/ or a directory)')
+    parser.add_argument('--parquet', help='Parquet archive location (s3://bucket/parquet/instances/ or a directory)')
+    parser.add_argument('--endpoint-url')
+    parser.add_argument('--generate', type=int, help='Generate this many synthetic instances into --workdir and compact them')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--workdir', default='/tmp/ec2-spot-interruption-dashboard-archive')
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        synthetic.write_archive(LocalStore(args.workdir), args.generate, days=args.days)
+        json_store = LocalStore(args.workdir + '/instances')
+        parquet_store = LocalStore(args.workdir + '/parquet/instances')
+        compact(json_store, parquet_store, include_today=True)
+    else:
+        json_store = open_store(args.json, args.endpoint_url)
+        parquet_store = open_store(args.parquet, args.endpoint_url)
+
+    json_bytes, json_seconds = scan_json(json_store)
+    parquet_bytes, parquet_seconds = scan_parquet(parquet_store)
+
+    print('{:<10} {:>16} {:>12}'.format('format', 'scanned bytes', 'seconds'))
+    print('{:<10} {:>16} {:>12.3f}'.format('json', json_bytes, json_seconds))
+    print('{:<10} {:>16} {:>12.3f}'.format('parquet', parquet_bytes, parquet_seconds))
+    if parquet_bytes:
+        print('scan reduction {:.1f}x, speedup {:.1f}x'.format(json_bytes / parquet_bytes, json_seconds / max(parquet_seconds, 1e-9)))
+
+if __name__ == '__main__':
+    sys.exit(main())
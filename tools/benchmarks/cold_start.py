@@ -0,0 +1,165 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Measures the cold start of every handler: each run is a fresh interpreter that imports
+# the function module, then invokes it twice against a local stub of the AWS endpoints.
+# The first invocation carries the lazy SDK and client set up, the second is warm.
+#
+#   python -m tools.benchmarks.cold_start --repeat 5
+#   python -m tools.benchmarks.cold_start --write-baseline cold_start.json
+#   python -m tools.benchmarks.cold_start --baseline cold_start.json --tolerance 0.25
+#
+# With --baseline the exit status is 1 when a handler's import or first invocation got
+# slower than the baseline by more than the tolerance.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from tools import handlers
+from tools.stub_endpoint import StubEndpoint
+
+metrics = ['ImportMs', 'FirstInvokeMs', 'WarmInvokeMs']
+checked_metrics = ['ImportMs', 'FirstInvokeMs']
+
+def run_child(name, size, output):
+
+    handler = handlers.handlers_by_name[name]
+    handlers.configure_environment(handler)
+
+    started = time.perf_counter()
+    module = handlers.load_handler(handler)
+    imported = time.perf_counter()
+
+    # Eagerly imported SDK or metrics modules show up here
+    eager_modules = [module_name for module_name in ('boto3', 'aws_embedded_metrics', 'dynamodb_json') if module_name in sys.modules]
+
+    context = handlers.LambdaContext(name)
+    timings = []
+    for invocation in range(2):
+        event = handler['event'](size)
+        invoke_started = time.perf_counter()
+        module.lambda_handler(event, context)
+        timings.append(time.perf_counter() - invoke_started)
+
+    with open(output, 'w') as f:
+        json.dump({
+            'ImportMs': (imported - started) * 1000,
+            'FirstInvokeMs': timings[0] * 1000,
+            'WarmInvokeMs': timings[1] * 1000,
+            'EagerModules': eager_modules
+        }, f)
+
+def run_handler(name, size, endpoint):
+
+    environment = dict(os.environ)
+    environment.update(handlers.common_environment)
+    environment['AWS_ENDPOINT_URL'] = endpoint.url
+    environment['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        output = f.name
+
+    try:
+        calls = len(endpoint.calls)
+        process = subprocess.run(
+            [sys.executable, '-m', 'tools.benchmarks.cold_start', '--child', name, '--size', str(size), '--output', output],
+            cwd=handlers.root, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise Exception('Error running {}: {}'.format(name, process.stderr.decode('utf-8', 'replace')))
+        with open(output) as f:
+            result = json.load(f)
+        # API calls made across both invocations
+        result['Calls'] = len(endpoint.calls) - calls
+        return result
+    finally:
+        os.remove(output)
+
+def measure(names, size, repeat):
+
+    endpoint = StubEndpoint().start()
+    results = {}
+
+    try:
+        for name in names:
+            runs = [run_handler(name, size, endpoint) for index in range(repeat)]
+            result = {metric: round(statistics.median(run[metric] for run in runs), 2) for metric in metrics}
+            result['Calls'] = runs[0]['Calls']
+            result['EagerModules'] = runs[0]['EagerModules']
+            results[name] = result
+    finally:
+        endpoint.stop()
+
+    return results
+
+def compare(results, baseline, tolerance, slack_ms):
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in checked_metrics:
+            limit = baseline[name][metric] * (1 + tolerance) + slack_ms
+            if result[metric] > limit:
+                regressions.append('{} {} {:.1f} ms > {:.1f} ms (baseline {:.1f} ms)'.format(name, metric, result[metric], limit, baseline[name][metric]))
+
+    return regressions
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure handler import and first invocation times against stubbed AWS endpoints.')
+    parser.add_argument('--handler', action='append', help='Handler to measure, repeat for several (default: all)')
+    parser.add_argument('--size', type=int, default=10, help='Records or instances per batch event')
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per handler, the median is reported')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown against the baseline')
+    parser.add_argument('--slack-ms', type=float, default=5.0, help='Allowed absolute slowdown against the baseline')
+    parser.add_argument('--write-baseline', help='Write the results as a baseline to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.size, args.output)
+        return 0
+
+    names = args.handler or [handler['name'] for handler in handlers.handlers]
+    results = measure(names, args.size, args.repeat)
+
+    print('{:<40} {:>10} {:>14} {:>13} {:>6}  {}'.format('Handler', 'Import ms', 'First call ms', 'Warm call ms', 'Calls', 'Eager imports'))
+    for name, result in results.items():
+        print('{:<40} {:>10.1f} {:>14.1f} {:>13.1f} {:>6}  {}'.format(name, result['ImportMs'], result['FirstInvokeMs'], result['WarmInvokeMs'], result['Calls'], ', '.join(result['EagerModules']) or '-'))
+
+    if args.write_baseline:
+        with open(args.write_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.slack_ms)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
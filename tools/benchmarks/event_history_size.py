@@ -0,0 +1,118 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Compares the size of instance metadata items, the write capacity their updates consume and
+# the size of their stream images, with the original EventHistory of {Name, Time, State}
+# maps and with the compact, capped EventHistory.
+#
+#   python -m tools.benchmarks.event_history_size --events 5 10 20 50 100 --max-events 20
+
+import os
+import sys
+import json
+import math
+import argparse
+import datetime
+
+from tools import events, handlers
+
+sys.path.insert(0, handlers.layer_path)
+
+from spot_dashboard.event_history import encode_event, trim_history
+
+def value_size(value):
+
+    # DynamoDB item size rules: strings are UTF-8 bytes, numbers about one byte per two
+    # significant digits plus one, lists and maps 3 bytes plus one byte per element
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        digits = str(abs(value)).replace('.', '').strip('0') or '0'
+        return math.ceil(len(digits) / 2.0) + 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode('utf-8')) + value_size(item) + 1 for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(value_size(item) + 1 for item in value)
+
+    raise TypeError('Unsupported type: {}'.format(type(value)))
+
+def item_size(item):
+    return sum(len(key.encode('utf-8')) + value_size(value) for key, value in item.items())
+
+def write_units(before, after):
+    # An update consumes capacity for the larger of the item before and after the write
+    return max(1, math.ceil(max(item_size(before), item_size(after)) / 1024.0))
+
+def lifecycle(count):
+
+    # spot-launch, running, repeated rebalance recommendations, interruption, termination
+    started = datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+    names = [('spot-launch', 'none'), ('state-change', 'running')]
+    names += [('rebalance-recommendation', 'none')] * max(0, count - 4)
+    names += [('spot-interruption', 'none'), ('state-change', 'terminated')]
+    names = names[:count]
+
+    return [
+        (name, state, events.isoformat(started + datetime.timedelta(minutes=10 * index)))
+        for index, (name, state) in enumerate(names)
+    ]
+
+def legacy_history(history):
+    return [{'Name': name, 'Time': event_time, 'State': state} for name, state, event_time in history]
+
+def compact_history(history, max_events):
+    return trim_history([encode_event(name, state, event_time) for name, state, event_time in history], max_events)
+
+def measure(count, max_events):
+
+    base = handlers.sample_instance()
+    del base['EventHistory']
+    history = lifecycle(count)
+
+    results = {}
+    for name, build in (('Legacy', lambda history: legacy_history(history)), ('Compact', lambda history: compact_history(history, max_events))):
+        items = [dict(base, EventHistory=build(history[:index])) for index in range(count + 1)]
+        final = items[-1]
+        results[name] = {
+            'ItemBytes': item_size(final),
+            'LastWriteWCU': write_units(items[-2], items[-1]),
+            'TotalWCU': sum(write_units(items[index - 1], items[index]) for index in range(1, count + 1)),
+            'StreamImageBytes': len(json.dumps(events.serialize_item(final), separators=(',', ':')))
+        }
+
+    return results
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compare item size and write capacity of the legacy and compact EventHistory.')
+    parser.add_argument('--events', type=int, nargs='+', default=[5, 10, 20, 50, 100], help='Events in the history of an instance')
+    parser.add_argument('--max-events', type=int, default=int(os.environ.get('EVENT_HISTORY_MAX_EVENTS', 20)), help='EventHistory cap of the compact encoding')
+    args = parser.parse_args()
+
+    print('{:>6}  {:>14} {:>14}  {:>9} {:>9}  {:>10} {:>10}  {:>12} {:>12}'.format(
+        'Events', 'Legacy bytes', 'Compact bytes', 'Last WCU', '(compact)', 'Total WCU', '(compact)', 'Stream bytes', '(compact)'))
+    for count in args.events:
+        results = measure(count, args.max_events)
+        legacy, compact = results['Legacy'], results['Compact']
+        print('{:>6}  {:>14} {:>14}  {:>9} {:>9}  {:>10} {:>10}  {:>12} {:>12}'.format(
+            count, legacy['ItemBytes'], compact['ItemBytes'], legacy['LastWriteWCU'], compact['LastWriteWCU'],
+            legacy['TotalWCU'], compact['TotalWCU'], legacy['StreamImageBytes'], compact['StreamImageBytes']))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Calls each warm handler in a loop on the batch sizes of the EnvironmentSizeMap tiers, with
+# instances carrying 5 and 40 tags, and reports the time per record, the CPU time, and the
+# peak and retained memory of an invocation. AWS calls are answered in-process by
+# tools.stub_endpoint.StubTransport, so the SDK still serializes and parses every request
+# but no time is spent on the network. Handler logs go through a formatter to /dev/null, as
+# the Lambda runtime formats them for CloudWatch Logs.
+#
+#   python -m tools.benchmarks.handler_batches --iterations 20
+#   python -m tools.benchmarks.handler_batches --write-baseline handler_batches.json
+#   python -m tools.benchmarks.handler_batches --baseline handler_batches.json --tolerance 0.25
+#
+# With --baseline the exit status is 1 when a case got slower per record, or used more peak
+# memory, than the baseline by more than the tolerance.
+
+import gc
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import functools
+import statistics
+import contextlib
+import tracemalloc
+
+from tools import handlers, template, stub_endpoint
+
+tag_counts = [5, 40]
+checked_metrics = ['MsPerRecord', 'PeakKiB']
+
+class DiscardOutput(object):
+
+    # The local EMF sink prints metric documents to stdout
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+def batch_sizes(batch_size_key, size_map):
+    if batch_size_key is None:
+        return [1]
+    return sorted(set(int(tier[batch_size_key]) for tier in size_map.values()))
+
+def event_records(event):
+    if 'Records' in event:
+        return len(event['Records'])
+    if 'instances' in event:
+        return len(event['instances'])
+    if 'failures' in event:
+        return len(event['failures'])
+    return 1
+
+def case_name(name, size, tags):
+    return '{} size={} tags={}'.format(name, size, tags if tags is not None else '-')
+
+def configure(transport, tags):
+
+    # DescribeInstances and DescribeTags answer with the tags of the case
+    tag_pairs = [(tag['Key'], tag['Value']) for tag in handlers.sample_tags(tags or 1)]
+    transport.query_responses['DescribeInstances'] = functools.partial(stub_endpoint.describe_instances, tags=tag_pairs)
+    transport.query_responses['DescribeTags'] = functools.partial(stub_endpoint.describe_tags, tags=tag_pairs)
+
+def measure_case(handler, module, size, tags, iterations, warmup, transport):
+
+    configure(transport, tags)
+    sample_tags = handlers.sample_tags(tags) if tags is not None else None
+    context = handlers.LambdaContext(handler['name'])
+
+    # Handlers may change their event, every invocation gets a fresh one built up front
+    invocations = [handler['event'](size, tags=sample_tags) for index in range(warmup + iterations + 1)]
+    records = event_records(invocations[0])
+
+    with contextlib.redirect_stdout(DiscardOutput()):
+        for event in invocations[:warmup]:
+            module.lambda_handler(event, context)
+        gc.collect()
+
+        calls = len(transport.calls)
+        timings = []
+        cpu_timings = []
+        for event in invocations[warmup:-1]:
+            started = time.perf_counter()
+            cpu_started = time.process_time()
+            module.lambda_handler(event, context)
+            cpu_timings.append(time.process_time() - cpu_started)
+            timings.append(time.perf_counter() - started)
+        calls = (len(transport.calls) - calls) / float(iterations)
+
+        # Memory on a separate invocation, tracemalloc slows down the timed ones
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            module.lambda_handler(invocations[-1], context)
+            peak = tracemalloc.get_traced_memory()[1] - current
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+    retained = after.compare_to(before, 'filename')
+    median = statistics.median(timings) * 1000
+
+    return {
+        'Records': records,
+        'MedianMs': round(median, 3),
+        'MsPerRecord': round(median / records, 4),
+        'CpuMsPerRecord': round(statistics.median(cpu_timings) * 1000 / records, 4),
+        'PeakKiB': round(peak / 1024.0, 1),
+        'RetainedKiB': round(sum(stat.size_diff for stat in retained) / 1024.0, 1),
+        'RetainedBlocks': sum(stat.count_diff for stat in retained),
+        'CallsPerInvocation': round(calls, 1)
+    }
+
+def measure(names, iterations, warmup):
+
+    # Every handler's environment is set before any module is imported
+    for handler in handlers.handlers:
+        handlers.configure_environment(handler)
+    os.environ.pop('AWS_ENDPOINT_URL', None)
+
+    null_stream = open(os.devnull, 'w')
+    root = logging.getLogger()
+    log_handler = logging.StreamHandler(null_stream)
+    log_handler.setFormatter(logging.Formatter('[%(levelname)s]\t%(asctime)s\t%(name)s\t%(message)s'))
+    root.handlers = [log_handler]
+
+    import boto3
+    transport = stub_endpoint.StubTransport().install(boto3._get_default_session()._session)
+    size_map = template.environment_size_map()
+
+    results = {}
+    try:
+        for name in names:
+            handler = handlers.handlers_by_name[name]
+            module = handlers.load_handler(handler)
+            for size in batch_sizes(handler['batch_size'], size_map):
+                for tags in (tag_counts if handler['tagged'] else [None]):
+                    results[case_name(name, size, tags)] = dict(
+                        measure_case(handler, module, size, tags, iterations, warmup, transport),
+                        Handler=name, BatchSize=size, Tags=tags)
+    finally:
+        root.handlers = []
+        null_stream.close()
+
+    return results
+
+def compare(results, baseline, tolerance, slack):
+
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        for metric in checked_metrics:
+            limit = baseline[case][metric] * (1 + tolerance) + slack[metric]
+            if result[metric] > limit:
+                regressions.append('{} {} {} > {:.4g} (baseline {})'.format(case, metric, result[metric], limit, baseline[case][metric]))
+
+    return regressions
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure warm handler time and memory per record on the EnvironmentSizeMap batch sizes.')
+    parser.add_argument('--handler', action='append', help='Handler to measure, repeat for several (default: all)')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed invocations per case, the median is reported')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed invocations per case')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression against the baseline')
+    parser.add_argument('--slack-ms', type=float, default=0.01, help='Allowed absolute slowdown per record against the baseline')
+    parser.add_argument('--slack-kib', type=float, default=16.0, help='Allowed absolute peak memory growth against the baseline')
+    parser.add_argument('--write-baseline', help='Write the results as a baseline to this file')
+    args = parser.parse_args()
+
+    names = args.handler or [handler['name'] for handler in handlers.handlers]
+    results = measure(names, args.iterations, args.warmup)
+
+    print('{:<40} {:>6} {:>5} {:>10} {:>10} {:>10} {:>9} {:>11} {:>6}'.format(
+        'Handler', 'Batch', 'Tags', 'Median ms', 'ms/record', 'CPU ms/rec', 'Peak KiB', 'Retained KiB', 'Calls'))
+    for result in results.values():
+        print('{:<40} {:>6} {:>5} {:>10.3f} {:>10.4f} {:>10.4f} {:>9.1f} {:>11.1f} {:>6.1f}'.format(
+            result['Handler'], result['BatchSize'], result['Tags'] if result['Tags'] is not None else '-', result['MedianMs'],
+            result['MsPerRecord'], result['CpuMsPerRecord'], result['PeakKiB'], result['RetainedKiB'], result['CallsPerInvocation']))
+
+    if args.write_baseline:
+        with open(args.write_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, {'MsPerRecord': args.slack_ms, 'PeakKiB': args.slack_kib})
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Compares the CPU time to decode the NewImage of stream batches with dynamodb_json.loads
+# and with spot_dashboard.stream_images, decoding whole images and only the attributes the
+# stream consumers filter on, for instances carrying 5 and 40 tags.
+#
+#   python -m tools.benchmarks.stream_images --batch-size 200 --repeat 50
+
+import sys
+import time
+import argparse
+import statistics
+
+from tools import events, handlers
+
+sys.path.insert(0, handlers.layer_path)
+
+from spot_dashboard.stream_images import attribute, decode_image
+
+filter_attributes = ['InstanceId', 'LastEventType', 'State', 'InstanceMetadataEnriched']
+
+def stream_batch(batch_size, tags, history):
+
+    # MODIFY records of enriched instances, half of them a Data Sink event
+    records = []
+    for index, instance in enumerate(handlers.sample_instances(batch_size, Tags=handlers.sample_tags(tags))):
+        instance['EventHistory'] = [12370406400 + offset * 8 for offset in range(history)]
+        instance['VCpus'] = 2
+        instance['MemoryMiB'] = 8192
+        if index % 2:
+            instance['LastEventType'] = 'rebalance-recommendation'
+        records.append(events.stream_record('MODIFY', instance, {'InstanceId': instance['InstanceId']}, sequence_number=index + 1))
+
+    return [record['dynamodb']['NewImage'] for record in records]
+
+def cases():
+
+    from dynamodb_json import json_util as dynamodb_json
+
+    def data_sink_filter(image):
+        return attribute(image, 'InstanceMetadataEnriched') == True and attribute(image, 'LastEventType') in ('state-change', 'spot-interruption')
+
+    # (case, case it is compared with, decode)
+    return [
+        ('dynamodb_json full', 'dynamodb_json full', lambda images: [dynamodb_json.loads(image) for image in images]),
+        ('decode_image full', 'dynamodb_json full', lambda images: [decode_image(image) for image in images]),
+        ('decode_image filter attributes', 'dynamodb_json full', lambda images: [decode_image(image, filter_attributes) for image in images]),
+        ('data sink filter + dynamodb_json', 'data sink filter + dynamodb_json', lambda images: [dynamodb_json.loads(image) for image in images if data_sink_filter(image)]),
+        ('data sink filter + decode_image', 'data sink filter + dynamodb_json', lambda images: [decode_image(image) for image in images if data_sink_filter(image)])
+    ]
+
+def measure(decode, images, repeat):
+
+    timings = []
+    for iteration in range(repeat):
+        started = time.process_time()
+        decode(images)
+        timings.append(time.process_time() - started)
+
+    return statistics.median(timings)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compare stream image decoding with dynamodb_json and spot_dashboard.stream_images.')
+    parser.add_argument('--batch-size', type=int, default=200, help='Records per batch')
+    parser.add_argument('--tags', type=int, nargs='+', default=[5, 40], help='Tags per instance')
+    parser.add_argument('--history', type=int, default=5, help='EventHistory entries per instance')
+    parser.add_argument('--repeat', type=int, default=50, help='Batches decoded per case, the median is reported')
+    args = parser.parse_args()
+
+    from dynamodb_json import json_util as dynamodb_json
+
+    print('{:<36} {:>6} {:>12} {:>14} {:>9}'.format('Case', 'Tags', 'Batch ms', 'Record us', 'Speedup'))
+    for tags in args.tags:
+        images = stream_batch(args.batch_size, tags, args.history)
+
+        # Both decoders must agree on every image before their timings are compared
+        for image in images:
+            if decode_image(image) != dynamodb_json.loads(image):
+                raise Exception('Decoders disagree on {}'.format(attribute(image, 'InstanceId')))
+
+        timings = {}
+        for name, reference, decode in cases():
+            timings[name] = measure(decode, images, args.repeat)
+            print('{:<36} {:>6} {:>12.3f} {:>14.2f} {:>8.2f}x'.format(name, tags, timings[name] * 1000, timings[name] * 1000000 / args.batch_size, timings[reference] / timings[name]))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
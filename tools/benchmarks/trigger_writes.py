@@ -0,0 +1,182 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Compares the CPU time per write of the trigger functions: the UpdateItem built on every
+# call and sent through the Table resource, as the triggers used to write, against the
+# precompiled plans of spot_dashboard.update_plans sent through the low-level client. The
+# coalesced writes of the InstanceEventIngestFunction (EventIngestMode queue) are compared
+# the same way: the UpdateItem built and serialized with the TypeSerializer on every call,
+# as the function used to write, against the plans kept per attribute set.
+# Requests are answered in-process by tools.stub_endpoint.StubTransport, so the SDK still
+# validates, serializes, signs and parses every request but no time is spent on the network.
+#
+#   python -m tools.benchmarks.trigger_writes --iterations 2000
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+from tools import events, handlers, stub_endpoint
+
+sys.path.insert(0, handlers.layer_path)
+
+table_name = 'InstanceMetadataTable'
+
+def sample_items():
+
+    expiration_time = int(time.time()) + 30*24*60*60
+    common = {'InstanceId': 'i-0123456789abcdef0', 'Region': 'us-east-1', 'LastEventTime': '2019-01-01T00:00:00Z'}
+
+    return [
+        dict(common, LastEventType='spot-launch', State='none', SpotInstanceRequestId='sir-01234567', ExpirationTime=expiration_time),
+        dict(common, LastEventType='state-change', State='running', LaunchedTime='2019-01-01T00:00:00Z', ExpirationTime=expiration_time),
+        dict(common, LastEventType='rebalance-recommendation', State='none', RebalanceRecommended=True, RebalanceRecommendationTime='2019-01-01T00:00:00Z'),
+        dict(common, LastEventType='spot-interruption', State='none', Interrupted=True, InterruptedInstanceAction='terminate', InterruptionTime='2019-01-01T00:00:00Z'),
+        dict(common, LastEventType='state-change', State='terminated', TerminatedTime='2019-01-01T00:00:00Z')
+    ]
+
+def sample_writes():
+
+    # Coalesced writes of one ingest batch: launch and running, rebalance and interruption,
+    # and a termination on its own
+    from spot_dashboard.instance_events import instance_update, coalesce_updates
+
+    instance_id = 'i-0123456789abcdef0'
+    batches = [
+        [events.spot_launch_event(instance_id), events.state_change_event(instance_id, 'running')],
+        [events.rebalance_event(instance_id), events.spot_interruption_event(instance_id)],
+        [events.state_change_event(instance_id, 'terminated')]
+    ]
+
+    writes = []
+    for batch in batches:
+        updates = [instance_update(event, 30*24*60*60) for event in batch]
+        writes.append(coalesce_updates(updates)[instance_id][0])
+
+    return writes
+
+def built_write(dynamodb, write):
+
+    # The UpdateItem arguments built and serialized on every call, as the ingest function did
+    from spot_dashboard import clients
+    from spot_dashboard.event_history import update_with_history
+
+    serializer = clients.serializer()
+    attributes = sorted(write['Attributes'].items())
+
+    return update_with_history(
+        dynamodb,
+        write['History'],
+        serialize=serializer.serialize,
+        deserialize=clients.deserializer().deserialize,
+        TableName=table_name,
+        Key={'InstanceId': serializer.serialize(write['InstanceId'])},
+        UpdateExpression='SET {}'.format(', '.join('#{0} = :{0}'.format(attribute) for attribute, value in attributes)),
+        ExpressionAttributeNames=dict(('#{}'.format(attribute), attribute) for attribute, value in attributes),
+        ExpressionAttributeValues=dict((':{}'.format(attribute), serializer.serialize(value)) for attribute, value in attributes),
+        ReturnValues='NONE'
+    )
+
+def table_write(table, item, events, attributes):
+
+    # The expression, names and values dictionaries built on every call, as the triggers did
+    from spot_dashboard.event_history import update_with_history
+
+    return update_with_history(
+        table,
+        events,
+        Key={
+            'InstanceId': item['InstanceId']
+        },
+        UpdateExpression='SET {}'.format(', '.join('#{0} = :{0}'.format(attribute) for attribute in attributes)),
+        ExpressionAttributeNames=dict(('#{}'.format(attribute), attribute) for attribute in attributes),
+        ExpressionAttributeValues=dict((':{}'.format(attribute), item[attribute]) for attribute in attributes),
+        ReturnValues="NONE"
+    )
+
+def measure(write, iterations, warmup):
+
+    for iteration in range(warmup):
+        write()
+
+    timings = []
+    for iteration in range(iterations):
+        started = time.process_time()
+        write()
+        timings.append(time.process_time() - started)
+
+    return statistics.mean(timings) * 1000000, statistics.median(timings) * 1000000
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compare the CPU time per write of the trigger and ingest functions with and without precompiled update plans.')
+    parser.add_argument('--iterations', type=int, default=2000, help='Writes measured per event type and path')
+    parser.add_argument('--warmup', type=int, default=100, help='Writes before measuring, so clients and caches are set up')
+    args = parser.parse_args()
+
+    for key, value in handlers.common_environment.items():
+        os.environ.setdefault(key, value)
+
+    import boto3
+    transport = stub_endpoint.StubTransport().install(boto3._get_default_session()._session)
+
+    from spot_dashboard import clients
+    from spot_dashboard.event_history import encode_event, event_names
+    from spot_dashboard.update_plans import update_plans
+
+    table = clients.table(table_name)
+    dynamodb = clients.client('dynamodb')
+
+    print('{:<36} {:>14} {:>14} {:>14} {:>14} {:>9}'.format('Event', 'Table mean us', 'Table p50 us', 'Plan mean us', 'Plan p50 us', 'Speedup'))
+    totals = [0.0, 0.0]
+    for item in sample_items():
+        key = (item['LastEventType'], item['State'])
+        plan = update_plans[key]
+        attributes = [name for name, placeholder, encode in plan.fields]
+        events = [encode_event(item['LastEventType'], item['State'], item['LastEventTime'])]
+
+        table_mean, table_median = measure(lambda: table_write(table, item, events, attributes), args.iterations, args.warmup)
+        plan_mean, plan_median = measure(lambda: plan.update(dynamodb, table_name, item, events), args.iterations, args.warmup)
+        totals[0] += table_mean
+        totals[1] += plan_mean
+
+        print('{:<36} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.1f} {:>8.2f}x'.format('{}/{}'.format(*key), table_mean, table_median, plan_mean, plan_median, table_mean / plan_mean))
+
+    print('{:<36} {:>14.1f} {:>14} {:>14.1f} {:>14} {:>8.2f}x'.format('All', totals[0] / len(update_plans), '', totals[1] / len(update_plans), '', totals[0] / totals[1]))
+
+    from spot_dashboard.update_plans import update_coalesced
+
+    print('{:<56} {:>14} {:>14} {:>14} {:>14} {:>9}'.format('Coalesced write', 'Built mean us', 'Built p50 us', 'Plan mean us', 'Plan p50 us', 'Speedup'))
+    totals = [0.0, 0.0]
+    writes = sample_writes()
+    for write in writes:
+        name = '+'.join('{}/{}'.format(*event_names[update['History'] % 8]) for update in write['Updates'])
+
+        built_mean, built_median = measure(lambda: built_write(dynamodb, write), args.iterations, args.warmup)
+        plan_mean, plan_median = measure(lambda: update_coalesced(dynamodb, table_name, write), args.iterations, args.warmup)
+        totals[0] += built_mean
+        totals[1] += plan_mean
+
+        print('{:<56} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.1f} {:>8.2f}x'.format(name, built_mean, built_median, plan_mean, plan_median, built_mean / plan_mean))
+
+    print('{:<56} {:>14.1f} {:>14} {:>14.1f} {:>14} {:>8.2f}x'.format('All', totals[0] / len(writes), '', totals[1] / len(writes), '', totals[0] / totals[1]))
+    print('Requests answered: {}'.format(len(transport.calls)))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Checks the pool rollup counters of spot_dashboard.rollups when many records share a pool:
+# concurrent invocations each flush a PoolRollupWriter over the same pools and hours, against
+# tools.dynamodb_local holding every transaction for a while, so transactions on the same
+# counter items conflict as they do in DynamoDB. Each invocation also adds an instance twice,
+# then the first invocation is delivered again and tumbling window counts are written twice.
+# Every counter must end up with each instance and window count exactly once.
+#
+#   python -m tools.check_rollups
+#   python -m tools.check_rollups --invocations 8 --instances 200
+#
+# The exit status is 1 when a flush fails or a counter is off.
+
+import os
+import sys
+import argparse
+import threading
+
+from tools import handlers, template
+from tools.stub_endpoint import StubTransport, StubError
+from tools.dynamodb_local import LocalDynamoDB, LocalDynamoDBError
+
+sys.path.insert(0, handlers.layer_path)
+
+table_name = 'PoolRollupTable'
+
+pools = [
+    {'Region': 'us-east-1', 'AvailabilityZone': 'us-east-1a', 'InstanceType': 'm5.large'},
+    {'Region': 'us-east-1', 'AvailabilityZone': 'us-east-1b', 'InstanceType': 'c5.xlarge'}
+]
+
+hours = ['2019-01-01T13:{:02d}:00Z', '2019-01-01T14:{:02d}:00Z']
+
+def invocation_increments(invocation, instances):
+
+    # Launches of one invocation, (instance, event time), most of them in the first pool and
+    # spread over two hours of the same day
+    increments = []
+    for index in range(instances):
+        pool = pools[0] if index % 4 else pools[1]
+        instance = dict(pool, InstanceId='i-{:08x}{:09x}'.format(invocation, index))
+        increments.append((instance, hours[index % 2].format(index % 60)))
+
+    return increments
+
+def install(dynamodb):
+
+    def respond(operation):
+        def handle(request):
+            try:
+                return dynamodb.handle(operation, request)
+            except LocalDynamoDBError as e:
+                raise StubError('com.amazonaws.dynamodb.v20120810#{}'.format(e.code), e.message, **e.fields)
+        return handle
+
+    import boto3
+    overrides = {operation: respond(operation) for operation in ('GetItem', 'PutItem', 'UpdateItem', 'TransactWriteItems', 'Query')}
+    return StubTransport(json_overrides=overrides).install(boto3._get_default_session()._session)
+
+def flush_concurrently(writers):
+
+    # Flushes each writer on its own thread, as concurrent invocations do
+    results = [None] * len(writers)
+
+    def flush(index):
+        try:
+            results[index] = writers[index].flush()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=flush, args=(index,)) for index in range(len(writers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+def counter_values(dynamodb):
+
+    # Launches per (Pool, Bucket) of the counter items, markers left out
+    values = {}
+    for item in dynamodb.tables[table_name].items.values():
+        if not item['Pool'].startswith('Marker#'):
+            values[(item['Pool'], item['Bucket'])] = int(item.get('Launches', 0))
+
+    return values
+
+def expected_values(increments):
+
+    from spot_dashboard.rollups import pool_key, parse_time, hour_bucket, day_bucket
+
+    values = {}
+    for instance, event_time, count in increments:
+        pool = pool_key(instance['Region'], instance['AvailabilityZone'], instance['InstanceType'])
+        for bucket in (hour_bucket(parse_time(event_time)), day_bucket(parse_time(event_time))):
+            values[(pool, bucket)] = values.get((pool, bucket), 0) + count
+
+    return values
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Check the pool rollup counters under concurrent invocations sharing pools.')
+    parser.add_argument('--invocations', type=int, default=4, help='Invocations flushing at the same time')
+    parser.add_argument('--instances', type=int, default=120, help='Instances per invocation')
+    parser.add_argument('--transaction-ms', type=float, default=5, help='How long the local table holds the items of a transaction')
+    args = parser.parse_args(argv)
+
+    for key, value in handlers.common_environment.items():
+        os.environ.setdefault(key, value)
+    os.environ['POOL_ROLLUP_TABLE'] = table_name
+    os.environ.setdefault('POOL_ROLLUP_WRITE_BACKOFF_SECONDS', str(args.transaction_ms / 1000.0))
+
+    dynamodb = LocalDynamoDB.from_template(template.load_template(), transaction_seconds=args.transaction_ms / 1000.0)
+    transport = install(dynamodb)
+
+    from spot_dashboard.rollups import PoolRollupWriter
+    from spot_dashboard.windows import window_marker
+
+    problems = []
+    counted = []
+    print('{:<28} {:>9} {:>9} {:>9} {:>13}'.format('Step', 'Writers', 'Added', 'Counted', 'Transactions'))
+
+    def step(name, writers, added, expected_counted):
+        calls = len(transport.calls)
+        results = flush_concurrently(writers)
+        for result in results:
+            if isinstance(result, Exception):
+                problems.append('{}: {}'.format(name, result))
+        total = sum(result for result in results if not isinstance(result, Exception))
+        if total != expected_counted:
+            problems.append('{}: counted {}, expected {}'.format(name, total, expected_counted))
+        print('{:<28} {:>9} {:>9} {:>9} {:>13}'.format(name, len(writers), added, total, len(transport.calls) - calls))
+
+    # Concurrent invocations over the same pools, each adding one of its instances twice
+    batches = [invocation_increments(invocation, args.instances) for invocation in range(args.invocations)]
+    writers = []
+    for increments in batches:
+        writer = PoolRollupWriter('Launches')
+        for instance, event_time in increments + increments[:1]:
+            writer.add(instance, event_time)
+        writers.append(writer)
+        counted.extend((instance, event_time, 1) for instance, event_time in increments)
+    step('Concurrent invocations', writers, sum(len(increments) + 1 for increments in batches), len(counted))
+
+    # The first invocation delivered again
+    writer = PoolRollupWriter('Launches')
+    for instance, event_time in batches[0]:
+        writer.add(instance, event_time)
+    step('Redelivered invocation', [writer], len(batches[0]), 0)
+
+    # Counts of a closed tumbling window, written twice by a retried final invocation
+    window = []
+    for index, pool in enumerate(pools):
+        for hour in hours:
+            event_time = hour.format(0)
+            window.append((pool, event_time, 10 + index, window_marker('shard-0', '2019-01-01T13:00:00Z', 'Launches', pool, event_time)))
+    counted.extend((pool, event_time, count) for pool, event_time, count, marker in window)
+    for name, expected_counted in (('Window', len(window)), ('Retried window', 0)):
+        writer = PoolRollupWriter('Launches')
+        for pool, event_time, count, marker in window:
+            writer.add(pool, event_time, count, marker)
+        step(name, [writer], len(window), expected_counted)
+
+    values = counter_values(dynamodb)
+    for key, value in sorted(expected_values(counted).items()):
+        print('{:<40} {:<20} {:>9} {:>9}'.format(key[0], key[1], value, values.get(key, 0)))
+        if values.get(key, 0) != value:
+            problems.append('{} {}: {} launches, expected {}'.format(key[0], key[1], values.get(key, 0), value))
+
+    for problem in problems:
+        print(problem)
+
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
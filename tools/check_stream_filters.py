@@ -0,0 +1,155 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Checks the stream filters of spot_dashboard.stream_filters: the FilterCriteria of each
+# stream consumer in template.yaml must be the patterns of the module, and the patterns and
+# the handler predicate must accept the same records of a corpus. The corpus holds every
+# combination of event name, LastEventType, State and InstanceMetadataEnriched, and with
+# --generate the stream records of a local pipeline run.
+#
+#   python -m tools.check_stream_filters
+#   python -m tools.check_stream_filters --generate 200
+#
+# The exit status is 1 when the template, the patterns or the predicates disagree.
+
+import sys
+import json
+import argparse
+import itertools
+
+from tools import events, handlers, template
+
+sys.path.insert(0, handlers.layer_path)
+
+from spot_dashboard.stream_filters import stream_filters
+from spot_dashboard.stream_images import decode_image
+
+def pattern_matches(pattern, value):
+
+    # The part of the Lambda event filtering syntax the patterns use: an object matches when
+    # every key of the pattern matches, a list of values when the value is one of them
+    if isinstance(pattern, dict):
+        if not isinstance(value, dict):
+            return False
+        return all(key in value and pattern_matches(item, value[key]) for key, item in pattern.items())
+
+    if isinstance(pattern, list):
+        # true and 1 are different values to the filter
+        return any(type(value) == type(item) and value == item for item in pattern)
+
+    raise ValueError('Unsupported pattern: {}'.format(pattern))
+
+def record_matches(patterns, record):
+    return any(pattern_matches(pattern, record) for pattern in patterns)
+
+def template_patterns(stack_template=None):
+
+    # The FilterCriteria patterns of the DynamoDB event of each function, None without one
+    stack_template = stack_template or template.load_template()
+    patterns = {}
+    for name, resource in template.resources(stack_template, 'AWS::Serverless::Function').items():
+        for event in (resource['Properties'].get('Events') or {}).values():
+            if event['Type'] == 'DynamoDB':
+                criteria = event['Properties'].get('FilterCriteria')
+                patterns[name] = [json.loads(item['Pattern']) for item in criteria['Filters']] if criteria else None
+
+    return patterns
+
+def synthetic_records():
+
+    # Every combination, an attribute set to None is left out of the image
+    records = []
+    event_types = [None, 'spot-launch', 'state-change', 'rebalance-recommendation', 'spot-interruption']
+    states = [None, 'none', 'pending', 'running', 'stopped', 'terminated']
+    enriched = [None, False, True]
+
+    for event_name, event_type, state, instance_enriched in itertools.product(['INSERT', 'MODIFY', 'REMOVE'], event_types, states, enriched):
+        instance = {'InstanceId': 'i-{:017x}'.format(len(records)), 'Region': 'us-east-1'}
+        for name, value in (('LastEventType', event_type), ('State', state), ('InstanceMetadataEnriched', instance_enriched)):
+            if value is not None:
+                instance[name] = value
+        record = events.stream_record(event_name, instance, sequence_number=len(records) + 1)
+        if event_name == 'REMOVE':
+            # The table streams NEW_IMAGE, a removed item has none
+            del record['dynamodb']['NewImage']
+        records.append(record)
+
+    return records
+
+def pipeline_records(count):
+
+    # The stream of a pipeline run, with the filters of the stream consumers turned off
+    from tools.pipeline_harness import Pipeline, generate_events
+
+    pipeline = Pipeline('queue', 'small', filter_records=False)
+    try:
+        pipeline.run(generate_events(count, 0.25))
+    finally:
+        pipeline.stop()
+
+    return pipeline.dynamodb.tables['InstanceMetadataTable'].stream
+
+def check(records, stack_template=None):
+
+    problems = []
+    results = {}
+    deployed = template_patterns(stack_template)
+
+    for name, (patterns, predicate) in stream_filters.items():
+        if deployed.get(name) != patterns:
+            problems.append('{}: the FilterCriteria in template.yaml are not the patterns of spot_dashboard.stream_filters'.format(name))
+
+        accepted = 0
+        for record in records:
+            matched = record_matches(patterns, record)
+            if matched != predicate(record):
+                image = decode_image(record['dynamodb'].get('NewImage', {}))
+                problems.append('{}: record {} {} {}, pattern {}, predicate {}'.format(
+                    name, record['eventID'], record['eventName'], json.dumps({attribute: image.get(attribute) for attribute in ('LastEventType', 'State', 'InstanceMetadataEnriched')}),
+                    matched, not matched))
+            accepted += matched
+
+        results[name] = {'Records': len(records), 'Accepted': accepted}
+
+    return results, problems
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Check that the stream FilterCriteria in template.yaml, the filter patterns and the handler predicates agree.')
+    parser.add_argument('--generate', type=int, default=0, help='Also check the stream records of a pipeline run over this many instances')
+    args = parser.parse_args(argv)
+
+    corpora = [('Synthetic', synthetic_records())]
+    if args.generate:
+        corpora.append(('Pipeline', pipeline_records(args.generate)))
+
+    problems = []
+    print('{:<12} {:<40} {:>8} {:>9} {:>9}'.format('Corpus', 'Consumer', 'Records', 'Accepted', 'Filtered'))
+    for corpus, records in corpora:
+        results, corpus_problems = check(records)
+        for problem in corpus_problems:
+            if problem not in problems:
+                problems.append(problem)
+        for name, result in results.items():
+            print('{:<12} {:<40} {:>8} {:>9} {:>8.1f}%'.format(corpus, name, result['Records'], result['Accepted'],
+                100.0 * (result['Records'] - result['Accepted']) / result['Records'] if result['Records'] else 0.0))
+
+    for problem in problems:
+        print(problem)
+
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
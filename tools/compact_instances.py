@@ -0,0 +1,214 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Compacts the newline delimited JSON objects that Firehose writes to the instances/ prefix
+# into one or more compressed Parquet files per day, keeping the columns of the instances
+# Glue table. The instances_parquet Glue table finds the days through partition projection
+# over dt, so nothing is registered in the catalog.
+#
+#   python -m tools.compact_instances s3://BUCKET/instances/ s3://BUCKET/parquet/instances/
+#
+#   python -m tools.compact_instances ./archive/instances ./archive/parquet/instances
+
+import io
+import sys
+import logging
+import argparse
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from tools.archive import open_store, object_day, iter_documents, is_instance_object
+
+logger = logging.getLogger(__name__)
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+
+def parse_int(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_float(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_bool(value):
+    return value if isinstance(value, bool) else None
+
+def parse_string(value):
+    return None if value is None else str(value)
+
+def parse_strings(value):
+    if not isinstance(value, list):
+        return None
+    return [parse_string(item) for item in value]
+
+def parse_tags(value):
+    if not isinstance(value, list):
+        return None
+    return [{'Key': parse_string(tag.get('Key')), 'Value': parse_string(tag.get('Value'))} for tag in value if isinstance(tag, dict)]
+
+def parse_event_history(value):
+    if not isinstance(value, list):
+        return None
+    return [{'Name': parse_string(event.get('Name')), 'State': parse_string(event.get('State')), 'Time': parse_timestamp(event.get('Time'))} for event in value if isinstance(event, dict)]
+
+timestamp = pa.timestamp('ms', tz='UTC')
+
+# Instance attribute, Glue column, Parquet type and converter, in the order of the Glue table
+instance_columns = [
+    ('LaunchedTime', 'launchedtime', timestamp, parse_timestamp),
+    ('InstanceId', 'instanceid', pa.string(), parse_string),
+    ('InstanceMetadataEnriched', 'instancemetadataenriched', pa.bool_(), parse_bool),
+    ('AvailabilityZone', 'availabilityzone', pa.string(), parse_string),
+    ('InterruptionTime', 'interruptiontime', timestamp, parse_timestamp),
+    ('ExpirationTime', 'expirationtime', pa.int32(), parse_int),
+    ('Interrupted', 'interrupted', pa.bool_(), parse_bool),
+    ('RebalanceRecommended', 'rebalancerecommended', pa.bool_(), parse_bool),
+    ('RebalanceRecommendationTime', 'rebalancerecommendationtime', timestamp, parse_timestamp),
+    ('TerminatedTime', 'terminatedtime', timestamp, parse_timestamp),
+    ('SpotInstanceRequestId', 'spotinstancerequestid', pa.string(), parse_string),
+    ('LastEventType', 'lasteventtype', pa.string(), parse_string),
+    ('InstanceLifecycle', 'instancelifecycle', pa.string(), parse_string),
+    ('InterruptedInstanceAction', 'interruptedinstanceaction', pa.string(), parse_string),
+    ('State', 'state', pa.string(), parse_string),
+    ('Region', 'region', pa.string(), parse_string),
+    ('LastEventTime', 'lasteventtime', timestamp, parse_timestamp),
+    ('InstanceType', 'instancetype', pa.string(), parse_string),
+    ('VCpus', 'vcpus', pa.int32(), parse_int),
+    ('MemoryMiB', 'memorymib', pa.int32(), parse_int),
+    ('Architectures', 'architectures', pa.list_(pa.string()), parse_strings),
+    ('GpuCount', 'gpucount', pa.int32(), parse_int),
+    ('PlatformDetails', 'platformdetails', pa.string(), parse_string),
+    ('SpotPriceAtLaunch', 'spotpriceatlaunch', pa.float64(), parse_float),
+    ('SpotPriceAtInterruption', 'spotpriceatinterruption', pa.float64(), parse_float),
+    ('Tags', 'tags', pa.list_(pa.struct([('Key', pa.string()), ('Value', pa.string())])), parse_tags),
+    ('EventHistory', 'eventhistory', pa.list_(pa.struct([('Name', pa.string()), ('State', pa.string()), ('Time', timestamp)])), parse_event_history)
+]
+
+instance_schema = pa.schema([(column, column_type) for attribute, column, column_type, parse in instance_columns])
+
+def instances_to_table(instances):
+
+    columns = {column: [] for attribute, column, column_type, parse in instance_columns}
+
+    for instance in instances:
+        for attribute, column, column_type, parse in instance_columns:
+            columns[column].append(parse(instance.get(attribute)))
+
+    return pa.Table.from_pydict(columns, schema=instance_schema)
+
+def list_objects_by_day(source):
+
+    days = {}
+    for item in source.list():
+        if is_instance_object(item):
+            days.setdefault(object_day(item), []).append(item)
+
+    return days
+
+def write_day(source, destination, day, items, compression, max_rows_per_file, row_group_size):
+
+    instances = []
+    for item in items:
+        instances.extend(iter_documents(source, item['Key']))
+
+    written_keys = []
+    for part, start in enumerate(range(0, len(instances), max_rows_per_file)):
+        table = instances_to_table(instances[start:start + max_rows_per_file])
+
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression=compression, row_group_size=row_group_size)
+
+        key = 'dt={}/part-{:05d}.parquet'.format(day, part)
+        destination.write(key, buffer.getvalue())
+        written_keys.append(key)
+
+    # Each run rewrites the whole day, so drop parts left over from a larger earlier run
+    for item in list(destination.list('dt={}/'.format(day))):
+        if item['Key'] not in written_keys:
+            destination.delete(item['Key'])
+
+    return {
+        'Day': day,
+        'Objects': len(items),
+        'InputBytes': sum(item['Size'] for item in items),
+        'Rows': len(instances),
+        'Files': len(written_keys),
+        'OutputBytes': sum(item['Size'] for item in destination.list('dt={}/'.format(day)))
+    }
+
+def compact(source, destination, days=None, include_today=False, compression='snappy', max_rows_per_file=5000000, row_group_size=1000000):
+
+    objects_by_day = list_objects_by_day(source)
+    today = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+
+    if days is None:
+        # Firehose is still writing to the current day unless asked otherwise
+        days = [day for day in sorted(objects_by_day) if include_today or day < today]
+
+    results = []
+    for day in days:
+        if day not in objects_by_day:
+            logger.info('No objects for {}'.format(day))
+            continue
+        result = write_day(source, destination, day, objects_by_day[day], compression, max_rows_per_file, row_group_size)
+        logger.info(result)
+        results.append(result)
+
+    return results
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Compact the instances/ JSON archive into partitioned Parquet files.')
+    parser.add_argument('source', help='s3://bucket/instances/ or a local directory')
+    parser.add_argument('destination', help='s3://bucket/parquet/instances/ or a local directory')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, for example a local S3 stand-in')
+    parser.add_argument('--day', action='append', dest='days', help='Day to compact (YYYY-MM-DD), can be repeated')
+    parser.add_argument('--include-today', action='store_true', help='Also compact the current (incomplete) day')
+    parser.add_argument('--compression', default='snappy', choices=['snappy', 'zstd', 'gzip'])
+    parser.add_argument('--max-rows-per-file', type=int, default=5000000)
+    parser.add_argument('--row-group-size', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    source = open_store(args.source, args.endpoint_url)
+    destination = open_store(args.destination, args.endpoint_url)
+
+    results = compact(source, destination, args.days, args.include_today, args.compression, args.max_rows_per_file, args.row_group_size)
+
+    input_bytes = sum(result['InputBytes'] for result in results)
+    output_bytes = sum(result['OutputBytes'] for result in results)
+    print('Compacted {} days, {} objects, {} rows: {} bytes of JSON into {} bytes of Parquet'.format(
+        len(results), sum(result['Objects'] for result in results), sum(result['Rows'] for result in results), input_bytes, output_bytes))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,578 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# An in-memory stand-in for the DynamoDB tables of the stack, for local runs. It covers the
+# requests the functions and tools make: GetItem, PutItem, DeleteItem, UpdateItem,
+# TransactWriteItems, Query, and Scan with a filter, a projection of top level attributes
+# and segments,
+# with update and condition expressions over top level attributes, and writes stream
+# records for tables with a StreamSpecification. Requests and responses use the wire
+# format, so it can sit behind tools.stub_endpoint.
+# With transaction_seconds, each TransactWriteItems holds its items for that long before it
+# is applied, and a transaction touching an item another one holds is cancelled with
+# TransactionConflict, as DynamoDB cancels concurrent transactions on the same item.
+
+import re
+import copy
+import time
+import threading
+
+from decimal import Decimal
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+class LocalDynamoDBError(Exception):
+
+    def __init__(self, code, message, **fields):
+        super(LocalDynamoDBError, self).__init__(message)
+        self.code = code
+        self.message = message
+        self.fields = fields
+
+def conditional_check_failed():
+    return LocalDynamoDBError('ConditionalCheckFailedException', 'The conditional request failed')
+
+# Expressions ------------------------------------------
+
+token_pattern = re.compile(r'\s*(<>|<=|>=|[=<>(),\[\].+-]|#[\w-]+|:[\w-]+|[A-Za-z_][\w-]*|\d+)')
+
+keywords = {'SET', 'REMOVE', 'ADD', 'DELETE', 'AND', 'OR', 'NOT', 'BETWEEN', 'IN'}
+
+def tokenize(expression):
+
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+
+    while position < len(expression):
+        match = token_pattern.match(expression, position)
+        if not match:
+            raise LocalDynamoDBError('ValidationException', 'Invalid expression: {}'.format(expression))
+        tokens.append(match.group(1))
+        position = match.end()
+
+    return tokens
+
+class Expression(object):
+
+    # Recursive descent over the tokens of an update, condition or key condition expression
+
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = {key: deserializer.deserialize(value) for key, value in (values or {}).items()}
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def keyword(self):
+        token = self.peek()
+        return token.upper() if token and token.upper() in keywords else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected is not None and token.upper() != expected):
+            raise LocalDynamoDBError('ValidationException', 'Expected {} at {} in {}'.format(expected, token, ' '.join(self.tokens)))
+        self.position += 1
+        return token
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # Operands
+
+    def path(self):
+
+        token = self.take()
+        name = self.names[token] if token.startswith('#') else token
+        if self.peek() in ('.', '['):
+            raise LocalDynamoDBError('ValidationException', 'Nested paths are not supported locally: {}'.format(name))
+        return name
+
+    def operand(self, item):
+
+        token = self.peek()
+
+        if token.startswith(':'):
+            self.take()
+            return self.values[token]
+
+        if self.tokens[self.position + 1:self.position + 2] == ['(']:
+            return self.function(item)
+
+        name = self.path()
+        return item.get(name)
+
+    def function(self, item):
+
+        name = self.take()
+        self.take('(')
+
+        if name == 'size':
+            value = self.operand(item)
+            self.take(')')
+            if value is None:
+                return None
+            return Decimal(len(value.encode('utf-8') if isinstance(value, str) else value))
+
+        if name == 'if_not_exists':
+            value = self.operand(item)
+            self.take(',')
+            default = self.operand(item)
+            self.take(')')
+            return default if value is None else value
+
+        if name == 'list_append':
+            first = self.operand(item)
+            self.take(',')
+            second = self.operand(item)
+            self.take(')')
+            return list(first) + list(second)
+
+        if name in ('attribute_exists', 'attribute_not_exists'):
+            attribute = self.path()
+            self.take(')')
+            return (attribute in item) == (name == 'attribute_exists')
+
+        if name in ('begins_with', 'contains'):
+            value = self.operand(item)
+            self.take(',')
+            argument = self.operand(item)
+            self.take(')')
+            if value is None:
+                return False
+            return value.startswith(argument) if name == 'begins_with' else argument in value
+
+        raise LocalDynamoDBError('ValidationException', 'Unsupported function: {}'.format(name))
+
+    # Conditions
+
+    def condition(self, item):
+
+        result = self.conjunction(item)
+        while self.keyword() == 'OR':
+            self.take()
+            right = self.conjunction(item)
+            result = result or right
+        return result
+
+    def conjunction(self, item):
+
+        result = self.negation(item)
+        while self.keyword() == 'AND':
+            self.take()
+            right = self.negation(item)
+            result = result and right
+        return result
+
+    def negation(self, item):
+
+        if self.keyword() == 'NOT':
+            self.take()
+            return not self.negation(item)
+
+        if self.peek() == '(':
+            self.take('(')
+            result = self.condition(item)
+            self.take(')')
+            return result
+
+        if self.peek() in ('attribute_exists', 'attribute_not_exists', 'begins_with', 'contains'):
+            return self.function(item)
+
+        left = self.operand(item)
+        comparator = self.take()
+
+        if comparator.upper() == 'BETWEEN':
+            low = self.operand(item)
+            self.take('AND')
+            high = self.operand(item)
+            return left is not None and low <= left <= high
+
+        if comparator.upper() == 'IN':
+            self.take('(')
+            candidates = [self.operand(item)]
+            while self.peek() == ',':
+                self.take(',')
+                candidates.append(self.operand(item))
+            self.take(')')
+            return left in candidates
+
+        right = self.operand(item)
+        return compare(left, comparator, right)
+
+    # Updates
+
+    def update(self, item):
+
+        item = copy.deepcopy(item)
+
+        while not self.done():
+            clause = self.take().upper()
+            while True:
+                if clause == 'SET':
+                    name = self.path()
+                    self.take('=')
+                    value = self.operand(item)
+                    if self.peek() in ('+', '-'):
+                        sign = self.take()
+                        other = self.operand(item)
+                        value = value + other if sign == '+' else value - other
+                    item[name] = value
+                elif clause == 'REMOVE':
+                    item.pop(self.path(), None)
+                elif clause == 'ADD':
+                    name = self.path()
+                    value = self.operand(item)
+                    if isinstance(value, set):
+                        item[name] = set(item.get(name, set())) | value
+                    else:
+                        item[name] = item.get(name, Decimal(0)) + value
+                elif clause == 'DELETE':
+                    name = self.path()
+                    remaining = set(item.get(name, set())) - self.operand(item)
+                    if remaining:
+                        item[name] = remaining
+                    else:
+                        item.pop(name, None)
+                else:
+                    raise LocalDynamoDBError('ValidationException', 'Unsupported update clause: {}'.format(clause))
+
+                if self.peek() != ',':
+                    break
+                self.take(',')
+
+        return item
+
+def compare(left, comparator, right):
+
+    if comparator == '=':
+        return left == right
+    if comparator == '<>':
+        return left != right
+    if left is None or right is None:
+        return False
+    if comparator == '<':
+        return left < right
+    if comparator == '<=':
+        return left <= right
+    if comparator == '>':
+        return left > right
+    if comparator == '>=':
+        return left >= right
+
+    raise LocalDynamoDBError('ValidationException', 'Unsupported comparator: {}'.format(comparator))
+
+def check_condition(request, item):
+
+    if 'ConditionExpression' not in request:
+        return True
+
+    expression = Expression(request['ConditionExpression'], request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues'))
+    return expression.condition(item or {})
+
+# Tables -----------------------------------------------
+
+def serialize_item(item):
+    return {key: serializer.serialize(value) for key, value in item.items()}
+
+def deserialize_item(item):
+    return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+class LocalTable(object):
+
+    def __init__(self, name, key_schema, indexes=None, stream_view_type=None):
+        self.name = name
+        self.key_schema = key_schema
+        self.indexes = indexes or {}
+        self.stream_view_type = stream_view_type
+        self.items = {}
+        self.stream = []
+        self.sequence_number = 0
+
+    @classmethod
+    def from_resource(cls, name, resource):
+
+        properties = resource['Properties']
+        key_schema = [key['AttributeName'] for key in properties['KeySchema']]
+        indexes = {
+            index['IndexName']: [key['AttributeName'] for key in index['KeySchema']]
+            for index in properties.get('GlobalSecondaryIndexes', [])
+        }
+        stream_view_type = properties.get('StreamSpecification', {}).get('StreamViewType')
+
+        return cls(name, key_schema, indexes, stream_view_type)
+
+    def key(self, key):
+        return tuple(serializer.serialize(key[attribute])['S' if isinstance(key[attribute], str) else 'N'] for attribute in self.key_schema)
+
+    def get(self, key):
+        return self.items.get(self.key(key))
+
+    def write(self, item, old_item):
+
+        # Stores the new version of an item and writes its stream record
+        key = self.key(item if item is not None else old_item)
+        if item is None:
+            self.items.pop(key, None)
+        else:
+            self.items[key] = item
+
+        if self.stream_view_type is None or item == old_item:
+            return
+
+        self.sequence_number += 1
+        record = {
+            'Keys': serialize_item({attribute: (item or old_item)[attribute] for attribute in self.key_schema}),
+            'SequenceNumber': '{:021d}'.format(self.sequence_number),
+            'SizeBytes': 0,
+            'StreamViewType': self.stream_view_type
+        }
+        if item is not None and self.stream_view_type in ('NEW_IMAGE', 'NEW_AND_OLD_IMAGES'):
+            record['NewImage'] = serialize_item(item)
+        if old_item is not None and self.stream_view_type in ('OLD_IMAGE', 'NEW_AND_OLD_IMAGES'):
+            record['OldImage'] = serialize_item(old_item)
+
+        self.stream.append({
+            'eventID': str(self.sequence_number),
+            'eventName': 'INSERT' if old_item is None else 'REMOVE' if item is None else 'MODIFY',
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'us-east-1',
+            'dynamodb': record,
+            'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/{}/stream/local'.format(self.name)
+        })
+
+class LocalDynamoDB(object):
+
+    def __init__(self, tables, transaction_seconds=0):
+        self.tables = {table.name: table for table in tables}
+        self.lock = threading.RLock()
+        self.transaction_seconds = transaction_seconds
+        self.held_items = set()
+
+    @classmethod
+    def from_template(cls, template, transaction_seconds=0):
+        return cls([
+            LocalTable.from_resource(name, resource)
+            for name, resource in template['Resources'].items()
+            if resource['Type'] == 'AWS::DynamoDB::Table'
+        ], transaction_seconds)
+
+    def table(self, name):
+        if name not in self.tables:
+            raise LocalDynamoDBError('ResourceNotFoundException', 'Requested resource not found: {}'.format(name))
+        return self.tables[name]
+
+    # Requests, each takes and returns the wire format
+
+    def get_item(self, request):
+
+        with self.lock:
+            item = self.table(request['TableName']).get(deserialize_item(request['Key']))
+
+        return {'Item': serialize_item(item)} if item is not None else {}
+
+    def put_item(self, request):
+
+        with self.lock:
+            table = self.table(request['TableName'])
+            item = deserialize_item(request['Item'])
+            old_item = table.get(item)
+            if not check_condition(request, old_item):
+                raise conditional_check_failed()
+            table.write(item, old_item)
+
+        return {}
+
+    def delete_item(self, request):
+
+        with self.lock:
+            table = self.table(request['TableName'])
+            old_item = table.get(deserialize_item(request['Key']))
+            if not check_condition(request, old_item):
+                raise conditional_check_failed()
+            if old_item is not None:
+                table.write(None, old_item)
+
+        return {}
+
+    def updated_item(self, table, request):
+
+        key = deserialize_item(request['Key'])
+        old_item = table.get(key)
+        if not check_condition(request, old_item):
+            raise conditional_check_failed()
+
+        expression = Expression(request['UpdateExpression'], request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues'))
+        item = expression.update(old_item if old_item is not None else key)
+        return item, old_item
+
+    def update_item(self, request):
+
+        with self.lock:
+            table = self.table(request['TableName'])
+            item, old_item = self.updated_item(table, request)
+            table.write(item, old_item)
+
+        return_values = request.get('ReturnValues', 'NONE')
+        if return_values == 'ALL_NEW':
+            return {'Attributes': serialize_item(item)}
+        if return_values == 'ALL_OLD' and old_item is not None:
+            return {'Attributes': serialize_item(old_item)}
+        return {}
+
+    def transaction_keys(self, request):
+
+        keys = []
+        for transact_item in request['TransactItems']:
+            (operation, item_request), = transact_item.items()
+            table = self.table(item_request['TableName'])
+            key = deserialize_item(item_request['Item'] if operation == 'Put' else item_request['Key'])
+            keys.append((table.name, table.key(key)))
+
+        if len(set(keys)) != len(keys):
+            raise LocalDynamoDBError('ValidationException', 'Transaction request cannot include multiple operations on one item')
+
+        return keys
+
+    def transact_write_items(self, request):
+
+        keys = self.transaction_keys(request)
+        if not self.transaction_seconds:
+            return self.apply_transaction(request)
+
+        with self.lock:
+            conflicts = [key in self.held_items for key in keys]
+            if any(conflicts):
+                reasons = [{'Code': 'TransactionConflict', 'Message': 'Transaction is ongoing for the item'} if conflict else {'Code': 'None'} for conflict in conflicts]
+                raise LocalDynamoDBError('TransactionCanceledException', 'Transaction cancelled, please refer cancellation reasons for specific reasons', CancellationReasons=reasons)
+            self.held_items.update(keys)
+
+        try:
+            time.sleep(self.transaction_seconds)
+            return self.apply_transaction(request)
+        finally:
+            with self.lock:
+                self.held_items.difference_update(keys)
+
+    def apply_transaction(self, request):
+
+        with self.lock:
+            writes = []
+            reasons = []
+
+            for transact_item in request['TransactItems']:
+                (operation, item_request), = transact_item.items()
+                table = self.table(item_request['TableName'])
+                try:
+                    if operation == 'Put':
+                        item = deserialize_item(item_request['Item'])
+                        old_item = table.get(item)
+                        if not check_condition(item_request, old_item):
+                            raise conditional_check_failed()
+                        writes.append((table, item, old_item))
+                    elif operation == 'Update':
+                        item, old_item = self.updated_item(table, item_request)
+                        writes.append((table, item, old_item))
+                    elif operation == 'Delete':
+                        old_item = table.get(deserialize_item(item_request['Key']))
+                        if not check_condition(item_request, old_item):
+                            raise conditional_check_failed()
+                        writes.append((table, None, old_item))
+                    elif operation == 'ConditionCheck':
+                        if not check_condition(item_request, table.get(deserialize_item(item_request['Key']))):
+                            raise conditional_check_failed()
+                    reasons.append({'Code': 'None'})
+                except LocalDynamoDBError as e:
+                    if e.code != 'ConditionalCheckFailedException':
+                        raise
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': e.message})
+
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise LocalDynamoDBError('TransactionCanceledException', 'Transaction cancelled, please refer cancellation reasons for specific reasons', CancellationReasons=reasons)
+
+            for table, item, old_item in writes:
+                if item is not None or old_item is not None:
+                    table.write(item, old_item)
+
+        return {}
+
+    def query(self, request):
+
+        with self.lock:
+            table = self.table(request['TableName'])
+            key_schema = table.indexes[request['IndexName']] if 'IndexName' in request else table.key_schema
+            expression_request = {
+                'ConditionExpression': request['KeyConditionExpression'],
+                'ExpressionAttributeNames': request.get('ExpressionAttributeNames'),
+                'ExpressionAttributeValues': request.get('ExpressionAttributeValues')
+            }
+            items = [
+                item for item in table.items.values()
+                if all(attribute in item for attribute in key_schema) and check_condition(expression_request, item)
+            ]
+
+        if len(key_schema) > 1:
+            items.sort(key=lambda item: item[key_schema[1]], reverse=not request.get('ScanIndexForward', True))
+
+        return {
+            'Items': [serialize_item(item) for item in items],
+            'Count': len(items),
+            'ScannedCount': len(items)
+        }
+
+    def scan(self, request):
+
+        with self.lock:
+            table = self.table(request['TableName'])
+            keys = sorted(table.items)
+            segments = request.get('TotalSegments', 1)
+            items = [table.items[key] for index, key in enumerate(keys) if index % segments == request.get('Segment', 0)]
+            if 'FilterExpression' in request:
+                filter_request = {
+                    'ConditionExpression': request['FilterExpression'],
+                    'ExpressionAttributeNames': request.get('ExpressionAttributeNames'),
+                    'ExpressionAttributeValues': request.get('ExpressionAttributeValues')
+                }
+                items = [item for item in items if check_condition(filter_request, item)]
+
+        if 'ProjectionExpression' in request:
+            names = request.get('ExpressionAttributeNames') or {}
+            projection = [names.get(name.strip(), name.strip()) for name in request['ProjectionExpression'].split(',')]
+            items = [{name: item[name] for name in projection if name in item} for item in items]
+
+        return {
+            'Items': [serialize_item(item) for item in items],
+            'Count': len(items),
+            'ScannedCount': len(items)
+        }
+
+    def handle(self, operation, request):
+        method = {
+            'GetItem': self.get_item,
+            'PutItem': self.put_item,
+            'DeleteItem': self.delete_item,
+            'UpdateItem': self.update_item,
+            'TransactWriteItems': self.transact_write_items,
+            'Query': self.query,
+            'Scan': self.scan
+        }.get(operation)
+        if method is None:
+            raise LocalDynamoDBError('ValidationException', 'Unsupported operation: {}'.format(operation))
+        return method(request)
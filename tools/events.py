@@ -0,0 +1,137 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Builders for the events the functions receive: EventBridge EC2 events, DynamoDB stream
+# records of the instance metadata table, and state machine task inputs.
+
+import uuid
+import datetime
+
+def isoformat(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def eventbridge_event(detail_type, detail, region='us-east-1', time=None):
+
+    return {
+        'version': '0',
+        'id': str(uuid.uuid4()),
+        'detail-type': detail_type,
+        'source': 'aws.ec2',
+        'account': '123456789012',
+        'time': isoformat(time or datetime.datetime.now(datetime.timezone.utc)),
+        'region': region,
+        'resources': [],
+        'detail': detail
+    }
+
+def spot_launch_event(instance_id, **kwargs):
+    return eventbridge_event('EC2 Spot Instance Request Fulfillment', {
+        'spot-instance-request-id': 'sir-{}'.format(instance_id[2:10]),
+        'instance-id': instance_id
+    }, **kwargs)
+
+def state_change_event(instance_id, state, **kwargs):
+    return eventbridge_event('EC2 Instance State-change Notification', {
+        'instance-id': instance_id,
+        'state': state
+    }, **kwargs)
+
+def spot_interruption_event(instance_id, **kwargs):
+    return eventbridge_event('EC2 Spot Instance Interruption Warning', {
+        'instance-id': instance_id,
+        'instance-action': 'terminate'
+    }, **kwargs)
+
+def rebalance_event(instance_id, **kwargs):
+    return eventbridge_event('EC2 Instance Rebalance Recommendation', {
+        'instance-id': instance_id
+    }, **kwargs)
+
+# DynamoDB JSON, written out here rather than with boto3's TypeSerializer so building an
+# event does not import the SDK ahead of the handler being measured
+def serialize(value):
+
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float)):
+        return {'N': str(value)}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, dict):
+        return {'M': {key: serialize(item) for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(item) for item in value]}
+
+    raise TypeError('Unsupported type for DynamoDB JSON: {}'.format(type(value)))
+
+def serialize_item(item):
+    return {key: serialize(value) for key, value in item.items()}
+
+def stream_record(event_name, new_image, old_image=None, sequence_number=1):
+
+    dynamodb = {
+        'Keys': {'InstanceId': {'S': new_image['InstanceId']}},
+        'NewImage': serialize_item(new_image),
+        'SequenceNumber': '{:021d}'.format(sequence_number),
+        'SizeBytes': 0,
+        'StreamViewType': 'NEW_AND_OLD_IMAGES'
+    }
+    if old_image is not None:
+        dynamodb['OldImage'] = serialize_item(old_image)
+
+    return {
+        'eventID': str(sequence_number),
+        'eventName': event_name,
+        'eventVersion': '1.1',
+        'eventSource': 'aws:dynamodb',
+        'awsRegion': new_image.get('Region', 'us-east-1'),
+        'dynamodb': dynamodb,
+        'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/InstanceMetadataTable/stream/2019-01-01T00:00:00.000'
+    }
+
+def stream_event(records):
+    return {'Records': records}
+
+def window_event(records, start, end, state=None, final=False, shard_id='shardId-00000000000000000000-00000000'):
+
+    # A stream event of a tumbling window, state is what the previous invocation returned
+    event = stream_event(records)
+    event.update({
+        'window': {'start': start, 'end': end},
+        'state': state or {},
+        'shardId': shard_id,
+        'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/InstanceMetadataTable/stream/2019-01-01T00:00:00.000',
+        'isFinalInvokeForWindow': final,
+        'isWindowTerminatedEarly': False
+    })
+    return event
+
+def sqs_record(body, message_id):
+    return {
+        'messageId': message_id,
+        'receiptHandle': message_id,
+        'body': body,
+        'attributes': {'ApproximateReceiveCount': '1'},
+        'messageAttributes': {},
+        'md5OfBody': '',
+        'eventSource': 'aws:sqs',
+        'eventSourceARN': 'arn:aws:sqs:us-east-1:123456789012:InstanceEventQueue',
+        'awsRegion': 'us-east-1'
+    }
+
+def sqs_event(bodies):
+    return {'Records': [sqs_record(body, '{:08d}'.format(index)) for index, body in enumerate(bodies)]}
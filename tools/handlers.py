@@ -0,0 +1,270 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# The Lambda handlers of the stack, with the environment they are deployed with and a
+# representative event, so they can be imported and invoked locally by the benchmarks.
+# batch_size names the EnvironmentSizeMap key sizing the batches a handler receives, tagged
+# handlers get instances carrying tags.
+# Each function is its own app.py, modules are loaded by path under a unique name with the
+# shared layer on sys.path, the way the Lambda runtime sees them.
+
+import os
+import sys
+import json
+import time
+import itertools
+import importlib.util
+
+from tools import events
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+layer_path = os.path.join(root, 'source', 'SharedLayer')
+
+common_environment = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_EMF_ENVIRONMENT': 'Local'
+}
+
+def sample_instance(instance_id='i-0123456789abcdef0', **kwargs):
+
+    instance = {
+        'InstanceId': instance_id,
+        'Region': 'us-east-1',
+        'AvailabilityZone': 'us-east-1a',
+        'InstanceType': 'm5.large',
+        'InstanceLifecycle': 'spot',
+        'InstanceMetadataEnriched': True,
+        'SpotInstanceRequestId': 'sir-01234567',
+        'LaunchedTime': '2019-01-01T00:00:00Z',
+        'LastEventTime': '2019-01-01T01:00:00Z',
+        'LastEventType': 'state-change',
+        'State': 'running',
+        'ExpirationTime': 1546300800,
+        'Tags': [{'Key': 'Name', 'Value': 'worker'}],
+        # spot-launch and state-change running at 2019-01-01T00:00:00Z, see spot_dashboard.event_history
+        'EventHistory': [12370406400, 12370406401]
+    }
+    instance.update(kwargs)
+    return instance
+
+def sample_tags(count):
+    # A Name tag followed by count - 1 other tags, as fleets tag for cost allocation
+    return [{'Key': 'Name', 'Value': 'worker'}] + [
+        {'Key': 'team:tag-{:02d}'.format(index), 'Value': 'value-{:02d}'.format(index)}
+        for index in range(1, count)
+    ]
+
+def tagged(tags):
+    return {'Tags': tags} if tags is not None else {}
+
+def sample_instances(count, **kwargs):
+    return [sample_instance('i-{:017x}'.format(index), **kwargs) for index in range(count)]
+
+def insert_records(count, tags=None):
+    return events.stream_event([
+        events.stream_record('INSERT', {'InstanceId': instance['InstanceId'], 'Region': instance['Region']}, sequence_number=index + 1)
+        for index, instance in enumerate(sample_instances(count))
+    ])
+
+# Each batch of MODIFY records gets its own LastEventTime, one second after the previous
+# batch, so the IdempotencyTable of the DataSinkTriggerFunction does not drop the batches
+# of a repeated invocation as duplicates
+modify_batches = itertools.count()
+
+def modify_records(count, tags=None):
+    last_event_time = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1546304400 + next(modify_batches)))
+    return events.stream_event([
+        events.stream_record('MODIFY', instance, {'InstanceId': instance['InstanceId']}, sequence_number=index + 1)
+        for index, instance in enumerate(sample_instances(count, LastEventTime=last_event_time, **tagged(tags)))
+    ])
+
+def failure_records(count, tags=None):
+
+    # The failures the Map state of the Data Sink State Machine collects, one per instance
+    return {'failures': [
+        {'InstanceId': instance['InstanceId'], 'Status': 'Failed', 'Error': {'Error': 'Exception', 'Cause': 'Error describing instance types'}, 'instance': instance}
+        for instance in sample_instances(count)
+    ]}
+
+def instance_id(index=0):
+    return 'i-{:017x}'.format(index)
+
+def lifecycle_events(count, tags=None):
+
+    # count messages: launch, running, rebalance, interruption and termination events of
+    # one instance after another
+    builders = [
+        lambda instance_id: events.spot_launch_event(instance_id),
+        lambda instance_id: events.state_change_event(instance_id, 'running'),
+        lambda instance_id: events.rebalance_event(instance_id),
+        lambda instance_id: events.spot_interruption_event(instance_id),
+        lambda instance_id: events.state_change_event(instance_id, 'terminated')
+    ]
+    return events.sqs_event([
+        json.dumps(builders[index % len(builders)](instance_id(index // len(builders))))
+        for index in range(count)
+    ])
+
+handlers = [
+    {
+        'name': 'SpotLaunchTriggerFunction',
+        'path': 'source/SpotLaunchTriggerFunction/app.py',
+        'environment': {'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable', 'INSTANCE_METADATA_ITEM_RETENTION_DAYS': '30'},
+        'event': lambda size, tags=None: events.spot_launch_event(instance_id()),
+        'batch_size': None,
+        'tagged': False
+    },
+    {
+        'name': 'StateChangeTriggerFunction',
+        'path': 'source/StateChangeTriggerFunction/app.py',
+        'environment': {'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable', 'INSTANCE_METADATA_ITEM_RETENTION_DAYS': '30'},
+        'event': lambda size, tags=None: events.state_change_event(instance_id(), 'running'),
+        'batch_size': None,
+        'tagged': False
+    },
+    {
+        'name': 'SpotRebalanceTriggerFunction',
+        'path': 'source/SpotRebalanceTriggerFunction/app.py',
+        'environment': {'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable'},
+        'event': lambda size, tags=None: events.rebalance_event(instance_id()),
+        'batch_size': None,
+        'tagged': False
+    },
+    {
+        'name': 'SpotInterruptionTriggerFunction',
+        'path': 'source/SpotInterruptionTriggerFunction/app.py',
+        'environment': {'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable'},
+        'event': lambda size, tags=None: events.spot_interruption_event(instance_id()),
+        'batch_size': None,
+        'tagged': False
+    },
+    {
+        'name': 'InstanceEventIngestFunction',
+        'path': 'source/InstanceEventIngestFunction/app.py',
+        'environment': {'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable', 'INSTANCE_METADATA_ITEM_RETENTION_DAYS': '30', 'INSTANCE_METADATA_WRITE_CONCURRENCY': '10'},
+        'event': lifecycle_events,
+        'batch_size': 'EventQueueBatchSize',
+        'tagged': False
+    },
+    {
+        'name': 'InstanceMetadataEnrichmentFunction',
+        'path': 'source/InstanceMetadataEnrichmentFunction/app.py',
+        'environment': {'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable', 'INSTANCE_METADATA_WRITE_CONCURRENCY': '10', 'INSTANCE_TAG_ALLOWLIST': ''},
+        'event': insert_records,
+        'batch_size': 'StreamBatchSize',
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkTriggerFunction',
+        'path': 'source/DataSinkTriggerFunction/app.py',
+        'environment': {'DATA_SINK_STATE_MACHINE_ARN': 'arn:aws:states:us-east-1:123456789012:stateMachine:DataSinkStateMachine', 'DATA_SINK_BATCH_MODE': 'true',
+                        'DATA_SINK_MODE': 'StateMachine', 'POOL_ROLLUP_TABLE': 'PoolRollupTable', 'INSTANCE_METADATA_STREAM': 'InstanceMetadataDeliveryStream',
+                        'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable', 'IDEMPOTENCY_TABLE': 'IdempotencyTable'},
+        'event': modify_records,
+        'batch_size': 'StreamBatchSize',
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkRunningEnrichmentFunction',
+        'path': 'source/DataSinkStateMachine/DataSinkRunningEnrichmentFunction/app.py',
+        'environment': {},
+        'event': lambda size, tags=None: {'instance': sample_instance(**tagged(tags))},
+        'batch_size': None,
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkInterruptionEnrichmentFunction',
+        'path': 'source/DataSinkStateMachine/DataSinkInterruptionEnrichmentFunction/app.py',
+        'environment': {},
+        'event': lambda size, tags=None: {'instance': sample_instance(LastEventType='spot-interruption', Interrupted=True, InterruptionTime='2019-01-01T00:58:00Z', **tagged(tags))},
+        'batch_size': None,
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkTerminationEnrichmentFunction',
+        'path': 'source/DataSinkStateMachine/DataSinkTerminationEnrichmentFunction/app.py',
+        'environment': {},
+        'event': lambda size, tags=None: {'instance': sample_instance(State='terminated', TerminatedTime='2019-01-01T01:00:00Z', **tagged(tags))},
+        'batch_size': None,
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkRunningFunction',
+        'path': 'source/DataSinkStateMachine/DataSinkRunningFunction/app.py',
+        'environment': {'POOL_ROLLUP_TABLE': 'PoolRollupTable'},
+        'event': lambda size, tags=None: {'instances': sample_instances(size, **tagged(tags))},
+        'batch_size': 'StreamBatchSize',
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkInterruptionFunction',
+        'path': 'source/DataSinkStateMachine/DataSinkInterruptionFunction/app.py',
+        'environment': {'POOL_ROLLUP_TABLE': 'PoolRollupTable', 'INSTANCE_METADATA_TABLE': 'InstanceMetadataTable'},
+        'event': lambda size, tags=None: {'instances': sample_instances(size, Interrupted=True, **tagged(tags))},
+        'batch_size': 'StreamBatchSize',
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkTerminationFunction',
+        'path': 'source/DataSinkStateMachine/DataSinkTerminationFunction/app.py',
+        'environment': {'INSTANCE_METADATA_STREAM': 'InstanceMetadataDeliveryStream', 'ARCHIVE_FULL_TAGS': 'true'},
+        'event': lambda size, tags=None: {'instances': sample_instances(size, State='terminated', **tagged(tags))},
+        'batch_size': 'StreamBatchSize',
+        'tagged': True
+    },
+    {
+        'name': 'DataSinkFailureFunction',
+        'path': 'source/DataSinkStateMachine/DataSinkFailureFunction/app.py',
+        'environment': {},
+        'event': failure_records,
+        'batch_size': 'StreamBatchSize',
+        'tagged': False
+    }
+]
+
+handlers_by_name = {handler['name']: handler for handler in handlers}
+
+def configure_environment(handler):
+    for key, value in common_environment.items():
+        os.environ.setdefault(key, value)
+    os.environ.update(handler['environment'])
+
+def load_handler(handler):
+
+    # Functions only see the layer, not the rest of the repository
+    if layer_path not in sys.path:
+        sys.path.insert(0, layer_path)
+
+    module_name = 'handler_{}'.format(handler['name'])
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(root, handler['path']))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+class LambdaContext(object):
+
+    def __init__(self, name):
+        self.function_name = name
+        self.memory_limit_in_mb = 128
+        self.aws_request_id = '00000000-0000-0000-0000-000000000000'
+        self.invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:{}'.format(name)
+
+    def get_remaining_time_in_millis(self):
+        return 60000
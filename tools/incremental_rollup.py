@@ -0,0 +1,242 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Folds the objects Firehose writes to the instances/ prefix into rollups per capacity pool
+# (Region#AvailabilityZone#InstanceType) and hour: launches, interruptions and a histogram
+# of the time from launch to interruption. Only objects not processed by an earlier run are
+# read, line by line, so each run costs the new data rather than the whole archive.
+#
+#   python -m tools.incremental_rollup s3://BUCKET/instances/ s3://BUCKET/rollups/instances/
+#   python -m tools.incremental_rollup ./archive/instances ./archive/rollups --hours 24
+#
+# The state is one document per archive day (dt=YYYY-MM-DD.json) holding the rollups of the
+# objects of that day together with the manifest of those objects, so the counts and the
+# manifest are always written in the same put and an object is never counted twice. Days are
+# checkpointed every --checkpoint-objects objects, an interrupted run resumes from the last
+# checkpoint. Run one processor at a time per destination.
+
+import sys
+import json
+import logging
+import argparse
+import datetime
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.archive import open_store, object_day, iter_documents, is_instance_object
+from tools.compact_instances import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Upper edges of the time to interruption histogram, in minutes, the last bucket is open
+interruption_minutes_edges = [5, 15, 30, 60, 120, 240, 480, 720, 1440, 2880, 4320, 10080]
+
+state_version = 1
+
+def pool_key(instance):
+    return '{}#{}#{}'.format(instance.get('Region'), instance.get('AvailabilityZone'), instance.get('InstanceType'))
+
+def hour_bucket(value):
+    return value.strftime('%Y-%m-%dT%H')
+
+def histogram_bucket(minutes):
+    for index, edge in enumerate(interruption_minutes_edges):
+        if minutes < edge:
+            return index
+    return len(interruption_minutes_edges)
+
+def empty_counts():
+    return {'Launches': 0, 'Interruptions': 0, 'TimeToInterruption': [0] * (len(interruption_minutes_edges) + 1)}
+
+def add_counts(rollups, pool, hour):
+    return rollups.setdefault(pool, {}).setdefault(hour, empty_counts())
+
+def merge_rollups(target, source):
+
+    for pool, hours in source.items():
+        for hour, counts in hours.items():
+            merged = add_counts(target, pool, hour)
+            merged['Launches'] += counts['Launches']
+            merged['Interruptions'] += counts['Interruptions']
+            merged['TimeToInterruption'] = [a + b for a, b in zip(merged['TimeToInterruption'], counts['TimeToInterruption'])]
+
+    return target
+
+def rollup_object(source, key, all_lifecycles=False):
+
+    # Launches count at the launch hour, interruptions and their time since launch at the
+    # interruption hour
+    rollups = {}
+    records = 0
+    for instance in iter_documents(source, key):
+        records += 1
+        if not all_lifecycles and instance.get('InstanceLifecycle') != 'spot':
+            continue
+
+        pool = pool_key(instance)
+        launched_time = parse_timestamp(instance.get('LaunchedTime'))
+        interruption_time = parse_timestamp(instance.get('InterruptionTime'))
+
+        if launched_time is not None:
+            add_counts(rollups, pool, hour_bucket(launched_time))['Launches'] += 1
+
+        if interruption_time is not None:
+            counts = add_counts(rollups, pool, hour_bucket(interruption_time))
+            counts['Interruptions'] += 1
+            if launched_time is not None and interruption_time >= launched_time:
+                minutes = (interruption_time - launched_time).total_seconds() / 60.0
+                counts['TimeToInterruption'][histogram_bucket(minutes)] += 1
+
+    return rollups, records
+
+def state_key(day):
+    return 'dt={}.json'.format(day)
+
+def load_state(destination, day):
+
+    key = state_key(day)
+    if not destination.exists(key):
+        return {'Version': state_version, 'Day': day, 'Objects': {}, 'Records': 0, 'Rollups': {}}
+
+    state = json.loads(destination.read(key))
+    if state.get('Version') != state_version:
+        raise Exception('Unsupported rollup state version {} in {}'.format(state.get('Version'), destination.uri(key)))
+
+    return state
+
+def save_state(destination, state):
+    destination.write(state_key(state['Day']), json.dumps(state, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+
+def new_objects(state, items):
+
+    pending = []
+    for item in items:
+        etag = state['Objects'].get(item['Key'])
+        if etag is None:
+            pending.append(item)
+        elif etag != item['ETag']:
+            # Firehose never rewrites an object, the old counts cannot be taken back out
+            logger.warning('Skipping {}, changed since it was processed'.format(item['Key']))
+
+    return pending
+
+def process_day(source, destination, day, items, workers=8, checkpoint_objects=200, all_lifecycles=False):
+
+    state = load_state(destination, day)
+    pending = new_objects(state, items)
+    records = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(pending), checkpoint_objects):
+            chunk = pending[start:start + checkpoint_objects]
+            results = executor.map(lambda item: rollup_object(source, item['Key'], all_lifecycles), chunk)
+            for item, (rollups, object_records) in zip(chunk, results):
+                merge_rollups(state['Rollups'], rollups)
+                state['Objects'][item['Key']] = item['ETag']
+                state['Records'] += object_records
+                records += object_records
+            save_state(destination, state)
+
+    return {'Day': day, 'Objects': len(pending), 'Records': records, 'TotalObjects': len(state['Objects'])}
+
+def process(source, destination, days=None, workers=8, checkpoint_objects=200, all_lifecycles=False):
+
+    objects_by_day = {}
+    for item in source.list():
+        if is_instance_object(item):
+            objects_by_day.setdefault(object_day(item), []).append(item)
+
+    results = []
+    for day in sorted(objects_by_day):
+        if days is not None and day not in days:
+            continue
+        result = process_day(source, destination, day, objects_by_day[day], workers, checkpoint_objects, all_lifecycles)
+        if result['Objects']:
+            logger.info('{Day}: {Objects} new objects, {Records} records'.format(**result))
+        results.append(result)
+
+    return results
+
+def load_rollups(destination, start=None, end=None):
+
+    # Rollups of all days merged, optionally limited to the hours in [start, end). An hour
+    # can appear in several days, when objects are written after the hour they describe.
+    rollups = {}
+    for item in destination.list():
+        if not item['Key'].startswith('dt=') or not item['Key'].endswith('.json'):
+            continue
+        state = json.loads(destination.read(item['Key']))
+        merge_rollups(rollups, {
+            pool: {
+                hour: counts for hour, counts in hours.items()
+                if (start is None or hour >= hour_bucket(start)) and (end is None or hour < hour_bucket(end))
+            }
+            for pool, hours in state['Rollups'].items()
+        })
+
+    return rollups
+
+def histogram_labels():
+    lower = [0] + interruption_minutes_edges
+    return ['{}-{}m'.format(a, b) for a, b in zip(lower, interruption_minutes_edges)] + ['{}m+'.format(interruption_minutes_edges[-1])]
+
+def summarize(rollups):
+
+    pools = []
+    for pool, hours in rollups.items():
+        totals = empty_counts()
+        for counts in hours.values():
+            totals['Launches'] += counts['Launches']
+            totals['Interruptions'] += counts['Interruptions']
+            totals['TimeToInterruption'] = [a + b for a, b in zip(totals['TimeToInterruption'], counts['TimeToInterruption'])]
+        if totals['Launches'] or totals['Interruptions']:
+            pools.append(dict(totals, Pool=pool))
+
+    return sorted(pools, key=lambda pool: (-pool['Interruptions'], pool['Pool']))
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Fold new instances/ archive objects into per pool and hour rollups.')
+    parser.add_argument('source', help='s3://bucket/instances/ or a local directory')
+    parser.add_argument('destination', help='s3://bucket/rollups/instances/ or a local directory for the rollup state')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, for example a local S3 stand-in')
+    parser.add_argument('--day', action='append', dest='days', help='Only process this day (YYYY-MM-DD), can be repeated')
+    parser.add_argument('--workers', type=int, default=8, help='Objects read concurrently')
+    parser.add_argument('--checkpoint-objects', type=int, default=200, help='Objects processed between two writes of a day state')
+    parser.add_argument('--all-lifecycles', action='store_true', help='Also count On-Demand Instances')
+    parser.add_argument('--hours', type=int, help='After processing, print the pools of the last HOURS hours (default: all)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    source = open_store(args.source, args.endpoint_url)
+    destination = open_store(args.destination, args.endpoint_url)
+
+    results = process(source, destination, args.days, args.workers, args.checkpoint_objects, args.all_lifecycles)
+    print('Processed {} new objects, {} records, over {} days'.format(
+        sum(result['Objects'] for result in results), sum(result['Records'] for result in results), len(results)))
+
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=args.hours) if args.hours else None
+    pools = summarize(load_rollups(destination, start))
+
+    labels = histogram_labels()
+    print('{:<40} {:>10} {:>14}  {}'.format('Pool', 'Launches', 'Interruptions', ' '.join('{:>10}'.format(label) for label in labels)))
+    for pool in pools:
+        print('{:<40} {:>10} {:>14}  {}'.format(pool['Pool'], pool['Launches'], pool['Interruptions'], ' '.join('{:>10}'.format(count) for count in pool['TimeToInterruption'])))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,440 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Runs the whole pipeline locally in one process: EC2 events go through the real handlers,
+# either the Instance Event Queue consumer or the per event trigger functions, into an
+# in-memory Instance Metadata Table (tools.dynamodb_local). Its stream feeds the enrichment
+# and Data Sink Trigger functions, and the executions they start run through the Data Sink
+# State Machine definition of template.yaml (tools.state_machine). EC2 and Firehose are
+# answered by tools.stub_endpoint, every AWS call still goes through the SDK.
+#
+#   python -m tools.pipeline_harness events.jsonl --mode queue --environment-size medium
+#   python -m tools.pipeline_harness --generate 1000 --interrupted 0.25 --output results.json
+#
+# The input is a file of EventBridge events, a JSON array or one event per line. The report
+# covers events per second, invocations and latency per stage, and calls per AWS API.
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import contextlib
+
+from tools import events, handlers, template
+from tools.stub_endpoint import StubEndpoint, StubError
+from tools.dynamodb_local import LocalDynamoDB, LocalDynamoDBError
+from tools.state_machine import StateMachine
+from tools.check_stream_filters import record_matches, template_patterns
+
+dynamodb_operations = ['GetItem', 'PutItem', 'DeleteItem', 'UpdateItem', 'TransactWriteItems', 'Query']
+
+# EventBridge rules of the direct ingest mode
+trigger_functions = {
+    'EC2 Spot Instance Request Fulfillment': 'SpotLaunchTriggerFunction',
+    'EC2 Instance State-change Notification': 'StateChangeTriggerFunction',
+    'EC2 Instance Rebalance Recommendation': 'SpotRebalanceTriggerFunction',
+    'EC2 Spot Instance Interruption Warning': 'SpotInterruptionTriggerFunction'
+}
+state_change_rule_states = ['running', 'terminated']
+
+state_machine_functions = [
+    'DataSinkRunningEnrichmentFunction',
+    'DataSinkInterruptionEnrichmentFunction',
+    'DataSinkTerminationEnrichmentFunction',
+    'DataSinkRunningFunction',
+    'DataSinkInterruptionFunction',
+    'DataSinkTerminationFunction',
+    'DataSinkFailureFunction'
+]
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] if values else 0.0
+
+def load_events(path):
+
+    with open(path) as f:
+        content = f.read().strip()
+
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+def generate_events(count, interrupted, started=None):
+
+    # Launch and running events for count instances launched a second apart, then either an
+    # interruption two minutes before termination or a termination an hour after launch
+    started = started or datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+    generated = []
+    interrupted_every = int(round(1 / interrupted)) if interrupted else 0
+
+    for index in range(count):
+        instance_id = handlers.instance_id(index)
+        launched = started + datetime.timedelta(seconds=index)
+        generated.append(events.spot_launch_event(instance_id, time=launched))
+        generated.append(events.state_change_event(instance_id, 'running', time=launched + datetime.timedelta(seconds=30)))
+        if interrupted_every and index % interrupted_every == 0:
+            generated.append(events.rebalance_event(instance_id, time=launched + datetime.timedelta(minutes=20)))
+            generated.append(events.spot_interruption_event(instance_id, time=launched + datetime.timedelta(minutes=28)))
+            generated.append(events.state_change_event(instance_id, 'terminated', time=launched + datetime.timedelta(minutes=30)))
+        else:
+            generated.append(events.state_change_event(instance_id, 'terminated', time=launched + datetime.timedelta(hours=1)))
+
+    return sorted(generated, key=lambda event: event['time'])
+
+class MetricsOutput(io.TextIOBase):
+
+    # Stands in for stdout while handlers run, the local EMF sink prints one document per line
+    def __init__(self):
+        self.documents = 0
+
+    def write(self, text):
+        self.documents += text.count('"_aws"')
+        return len(text)
+
+class Stage(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.timings = []
+        self.records = 0
+        self.errors = 0
+
+    def report(self):
+        total = sum(self.timings) * 1000
+        return {
+            'Invocations': len(self.timings),
+            'Records': self.records,
+            'Errors': self.errors,
+            'TotalMs': round(total, 2),
+            'P50Ms': round(percentile(self.timings, 0.5) * 1000, 2),
+            'P95Ms': round(percentile(self.timings, 0.95) * 1000, 2),
+            'MsPerRecord': round(total / self.records, 3) if self.records else 0.0
+        }
+
+class StreamConsumer(object):
+
+    # A DynamoDB event source mapping: batches from its own position in the stream, retries
+    # from the first reported failure and skips a batch after the maximum retry attempts
+    def __init__(self, pipeline, name, batch_size, maximum_retry_attempts, patterns=None):
+        self.pipeline = pipeline
+        self.name = name
+        self.batch_size = batch_size
+        self.maximum_retry_attempts = maximum_retry_attempts
+        self.patterns = patterns
+        self.position = 0
+        self.attempts = 0
+
+    def accepts(self, record):
+        return self.patterns is None or record_matches(self.patterns, record)
+
+    def poll(self, stream):
+
+        if self.position >= len(stream):
+            return False
+
+        # Records left out by the FilterCriteria are dropped before batching, as Lambda does
+        batch = []
+        indexes = []
+        end = self.position
+        while end < len(stream) and len(batch) < self.batch_size:
+            if self.accepts(stream[end]):
+                batch.append(stream[end])
+                indexes.append(end)
+            end += 1
+
+        if not batch:
+            self.pipeline.filtered_records += end - self.position
+            self.position = end
+            return True
+
+        try:
+            response = self.pipeline.invoke(self.name, events.stream_event(batch), len(batch)) or {}
+            failures = [failure['itemIdentifier'] for failure in response.get('batchItemFailures', [])]
+        except Exception:
+            failures = [batch[0]['dynamodb']['SequenceNumber']]
+
+        if not failures:
+            self.pipeline.filtered_records += end - self.position - len(batch)
+            self.position = end
+            self.attempts = 0
+            return True
+
+        self.attempts += 1
+        if self.attempts > self.maximum_retry_attempts:
+            self.pipeline.skipped_records += len(batch)
+            self.pipeline.filtered_records += end - self.position - len(batch)
+            self.position = end
+            self.attempts = 0
+            return True
+
+        sequence_numbers = [record['dynamodb']['SequenceNumber'] for record in batch]
+        failed = indexes[sequence_numbers.index(min(failures))]
+        self.pipeline.filtered_records += sum(1 for index in range(self.position, failed) if index not in indexes)
+        self.position = failed
+        return True
+
+class Pipeline(object):
+
+    def __init__(self, mode, environment_size, log_path=None, data_sink_mode='StateMachine', filter_records=True):
+
+        self.mode = mode
+        self.data_sink_mode = data_sink_mode
+        self.template = template.load_template()
+        self.size_map = template.environment_size_map(self.template)[environment_size]
+        self.dynamodb = LocalDynamoDB.from_template(self.template)
+        self.executions = []
+        self.firehose_records = 0
+        self.firehose_bytes = 0
+        self.skipped_records = 0
+        self.filtered_records = 0
+        self.redelivered_messages = 0
+        self.stages = {}
+        self.metrics_output = MetricsOutput()
+
+        overrides = {operation: self.dynamodb_response(operation) for operation in dynamodb_operations}
+        overrides['StartExecution'] = self.start_execution
+        overrides['PutRecordBatch'] = self.put_record_batch
+        self.endpoint = StubEndpoint(json_overrides=overrides).start()
+
+        self.configure_logging(log_path)
+        self.configure_environment()
+        self.modules = {}
+        for handler in handlers.handlers:
+            self.modules[handler['name']] = handlers.load_handler(handler)
+
+        # Resolved with the tier's values and ARNs named after the function resources
+        definition = template.state_machine_definition(self.template, environment_size=environment_size)
+        self.tasks = {
+            template.function_arn(name): self.task(name)
+            for name in state_machine_functions
+        }
+        self.state_machine = StateMachine(definition, self.tasks)
+
+        # The FilterCriteria of the stream mappings in the template
+        patterns = template_patterns(self.template) if filter_records else {}
+        self.stream_consumers = [
+            StreamConsumer(self, name, int(self.size_map['StreamBatchSize']), int(self.size_map['StreamMaximumRetryAttempts']), patterns.get(name))
+            for name in ('InstanceMetadataEnrichmentFunction', 'DataSinkTriggerFunction')
+        ]
+
+    def configure_logging(self, log_path):
+
+        # The handlers log at INFO to the root logger, as Lambda sends to CloudWatch Logs
+        root = logging.getLogger()
+        root.handlers = [logging.FileHandler(log_path) if log_path else logging.NullHandler()]
+
+    def configure_environment(self):
+
+        os.environ['AWS_ENDPOINT_URL'] = self.endpoint.url
+        for handler in handlers.handlers:
+            handlers.configure_environment(handler)
+        os.environ['EVENT_HISTORY_MAX_EVENTS'] = os.environ.get('EVENT_HISTORY_MAX_EVENTS', '20')
+        os.environ['DATA_SINK_MODE'] = self.data_sink_mode
+
+    def stop(self):
+        self.endpoint.stop()
+
+    # Stubbed AWS APIs
+
+    def dynamodb_response(self, operation):
+
+        def respond(request):
+            try:
+                return self.dynamodb.handle(operation, request)
+            except LocalDynamoDBError as e:
+                raise StubError('com.amazonaws.dynamodb.v20120810#{}'.format(e.code), e.message, **e.fields)
+
+        return respond
+
+    def start_execution(self, request):
+        self.executions.append(json.loads(request['input']))
+        return {'executionArn': '{}:{}'.format(request['stateMachineArn'].replace(':stateMachine:', ':execution:'), len(self.executions)), 'startDate': 0}
+
+    def put_record_batch(self, request):
+        records = request.get('Records', [])
+        self.firehose_records += len(records)
+        self.firehose_bytes += sum(len(record['Data']) for record in records)
+        return {'FailedPutCount': 0, 'Encrypted': False, 'RequestResponses': [{'RecordId': str(index)} for index in range(len(records))]}
+
+    # Invocations
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage(name)
+        return self.stages[name]
+
+    def invoke(self, name, event, records):
+
+        stage = self.stage(name)
+        stage.records += records
+        started = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(self.metrics_output):
+                return self.modules[name].lambda_handler(event, handlers.LambdaContext(name))
+        except Exception:
+            stage.errors += 1
+            raise
+        finally:
+            stage.timings.append(time.perf_counter() - started)
+
+    def task(self, name):
+        def invoke(task_input):
+            return self.invoke(name, task_input, len(task_input.get('instances', [task_input.get('instance')])))
+        return invoke
+
+    def ingest(self, batch):
+
+        # Returns the events to deliver again
+        if self.mode == 'direct':
+            retries = []
+            for event in batch:
+                try:
+                    self.invoke(trigger_functions[event['detail-type']], event, 1)
+                except Exception:
+                    retries.append(event)
+            return retries
+
+        records = [events.sqs_record(json.dumps(event), event['id']) for event in batch]
+        try:
+            response = self.invoke('InstanceEventIngestFunction', {'Records': records}, len(records)) or {}
+            failed = set(failure['itemIdentifier'] for failure in response.get('batchItemFailures', []))
+        except Exception:
+            failed = set(event['id'] for event in batch)
+
+        return [event for event in batch if event['id'] in failed]
+
+    def drain(self):
+
+        # Pump the stream to both consumers, then run the executions they started
+        stream = self.dynamodb.table('InstanceMetadataTable').stream
+        while True:
+            polled = [consumer.poll(stream) for consumer in self.stream_consumers]
+            if any(polled):
+                continue
+            if not self.executions:
+                return
+            execution_input = self.executions.pop(0)
+            stage = self.stage('DataSinkStateMachine')
+            stage.records += len(execution_input.get('instances', [execution_input.get('instance')]))
+            started = time.perf_counter()
+            try:
+                self.state_machine.run(execution_input)
+            except Exception:
+                stage.errors += 1
+            finally:
+                stage.timings.append(time.perf_counter() - started)
+
+    def run(self, source_events, max_redeliveries=3):
+
+        # The event rules only pass on the running and terminated state changes
+        source_events = [
+            event for event in source_events
+            if event['detail-type'] in trigger_functions
+            and (event['detail-type'] != 'EC2 Instance State-change Notification' or event['detail']['state'] in state_change_rule_states)
+        ]
+        batch_size = int(self.size_map['EventQueueBatchSize']) if self.mode == 'queue' else 1
+
+        started = time.perf_counter()
+        pending = list(source_events)
+        deliveries = {}
+        while pending:
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            for event in self.ingest(batch):
+                deliveries[event['id']] = deliveries.get(event['id'], 0) + 1
+                if deliveries[event['id']] <= max_redeliveries:
+                    self.redelivered_messages += 1
+                    pending.append(event)
+            self.drain()
+        elapsed = time.perf_counter() - started
+
+        calls = {}
+        for operation in self.endpoint.calls:
+            calls[operation] = calls.get(operation, 0) + 1
+
+        return {
+            'Mode': self.mode,
+            'DataSinkMode': self.data_sink_mode,
+            'Events': len(source_events),
+            'ElapsedSeconds': round(elapsed, 3),
+            'EventsPerSecond': round(len(source_events) / elapsed, 1) if elapsed else 0.0,
+            'Stages': {name: stage.report() for name, stage in self.stages.items()},
+            'ApiCalls': dict(sorted(calls.items())),
+            'StateTransitions': self.state_machine.transitions,
+            'MetricDocuments': self.metrics_output.documents,
+            'FirehoseRecords': self.firehose_records,
+            'FirehoseBytes': self.firehose_bytes,
+            'RedeliveredMessages': self.redelivered_messages,
+            'SkippedStreamRecords': self.skipped_records,
+            'FilteredStreamRecords': self.filtered_records,
+            'TableItems': {name: len(table.items) for name, table in self.dynamodb.tables.items()}
+        }
+
+def print_report(results):
+
+    print('{} events in {:.2f} s, {:.1f} events/s ({} ingest, {} data sink)'.format(results['Events'], results['ElapsedSeconds'], results['EventsPerSecond'], results['Mode'], results['DataSinkMode']))
+    print('')
+    print('{:<40} {:>8} {:>8} {:>7} {:>10} {:>8} {:>8} {:>10}'.format('Stage', 'Calls', 'Records', 'Errors', 'Total ms', 'p50 ms', 'p95 ms', 'ms/record'))
+    for name, stage in results['Stages'].items():
+        print('{:<40} {:>8} {:>8} {:>7} {:>10.1f} {:>8.2f} {:>8.2f} {:>10.3f}'.format(
+            name, stage['Invocations'], stage['Records'], stage['Errors'], stage['TotalMs'], stage['P50Ms'], stage['P95Ms'], stage['MsPerRecord']))
+    print('')
+    print('{:<40} {:>8}'.format('AWS API', 'Calls'))
+    for operation, count in results['ApiCalls'].items():
+        print('{:<40} {:>8}'.format(operation, count))
+    print('')
+    print('State transitions: {}, metric documents: {}, Firehose records: {} ({} bytes)'.format(
+        results['StateTransitions'], results['MetricDocuments'], results['FirehoseRecords'], results['FirehoseBytes']))
+    print('Redelivered messages: {}, skipped stream records: {}, filtered stream records: {}, table items: {}'.format(
+        results['RedeliveredMessages'], results['SkippedStreamRecords'], results['FilteredStreamRecords'], ', '.join('{} {}'.format(name, count) for name, count in results['TableItems'].items())))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Run EC2 events through the handlers, a local DynamoDB and the Data Sink State Machine.')
+    parser.add_argument('input', nargs='?', help='EventBridge events, a JSON array or one event per line')
+    parser.add_argument('--generate', type=int, help='Generate the lifecycle events of this many instances instead')
+    parser.add_argument('--interrupted', type=float, default=0.25, help='Share of generated instances that get interrupted')
+    parser.add_argument('--mode', choices=['queue', 'direct'], default='queue', help='EventIngestMode of the stack')
+    parser.add_argument('--data-sink-mode', choices=['StateMachine', 'InProcess'], default='StateMachine', help='DataSinkMode of the stack')
+    parser.add_argument('--environment-size', choices=sorted(template.environment_size_map()), default='medium', help='EnvironmentSize of the stack, sets the batch sizes')
+    parser.add_argument('--log', help='Write the handler logs to this file')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    if bool(args.input) == bool(args.generate):
+        parser.error('Pass an input file or --generate')
+
+    source_events = load_events(args.input) if args.input else generate_events(args.generate, args.interrupted)
+
+    pipeline = Pipeline(args.mode, args.environment_size, args.log, args.data_sink_mode)
+    try:
+        results = pipeline.run(source_events)
+    finally:
+        pipeline.stop()
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
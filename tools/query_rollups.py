@@ -0,0 +1,59 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Launches, interruptions and interruption rate per capacity pool from the pool rollup table.
+#
+#   python -m tools.query_rollups POOL_ROLLUP_TABLE --hours 24 --group-by AvailabilityZone InstanceType
+#   python -m tools.query_rollups POOL_ROLLUP_TABLE --start 2019-01-01T00:00:00Z --end 2019-01-08T00:00:00Z --pool us-east-1#us-east-1a
+
+import sys
+import time
+import argparse
+import datetime
+
+from tools import handlers
+
+sys.path.insert(0, handlers.layer_path)
+
+from spot_dashboard.rollups import query_pool_counts, parse_time
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Query launch and interruption counts per capacity pool.')
+    parser.add_argument('table', help='Pool rollup table name')
+    parser.add_argument('--hours', type=int, default=24, help='Window ending now, in hours (default 24)')
+    parser.add_argument('--start', help='Window start, e.g. 2019-01-01T00:00:00Z')
+    parser.add_argument('--end', help='Window end, e.g. 2019-01-02T00:00:00Z')
+    parser.add_argument('--group-by', nargs='+', default=['Region', 'AvailabilityZone', 'InstanceType'], choices=['Region', 'AvailabilityZone', 'InstanceType'])
+    parser.add_argument('--pool', help='Pool prefix, Region or Region#AvailabilityZone')
+    args = parser.parse_args()
+
+    end = parse_time(args.end) if args.end else datetime.datetime.now(datetime.timezone.utc)
+    start = parse_time(args.start) if args.start else end - datetime.timedelta(hours=args.hours)
+
+    started = time.perf_counter()
+    results = query_pool_counts(start, end, group_by=tuple(args.group_by), pool_prefix=args.pool, table_name=args.table)
+    elapsed = time.perf_counter() - started
+
+    print('{:<40} {:>10} {:>14} {:>18}'.format(' / '.join(args.group_by), 'Launches', 'Interruptions', 'Interruption rate'))
+    for group in results:
+        rate = '{:.1%}'.format(group['InterruptionRate']) if group['InterruptionRate'] is not None else '-'
+        print('{:<40} {:>10} {:>14} {:>18}'.format(' / '.join(group[attribute] for attribute in args.group_by), group['Launches'], group['Interruptions'], rate))
+    print('{} groups in {:.0f} ms'.format(len(results), elapsed * 1000))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Runs an Amazon States Language definition in-process, for local runs of the Data Sink
+# State Machine. It covers the states and paths the definition uses: Pass, Choice, Task,
+# inline Map, Parallel, Succeed and Fail, Parameters, ItemSelector, ResultSelector,
+# InputPath, ResultPath, OutputPath, Retry and Catch, and the JSONPath filters of
+# CollectSinkBatches. Task resources are looked up in a dict of callables taking and
+# returning the state input. Retries do not wait their interval, and the branches of a
+# Parallel state run one after another.
+#
+#   execution = StateMachine(definition, {function_arn: invoke}).run(execution_input)
+
+import re
+import copy
+
+class PathMissing(Exception):
+    pass
+
+class StateMachineFailed(Exception):
+
+    def __init__(self, error, cause=None):
+        super(StateMachineFailed, self).__init__('{}: {}'.format(error, cause))
+        self.error = error
+        self.cause = cause
+
+# Paths ------------------------------------------------
+
+segment_pattern = re.compile(r"\.([\w-]+)|\[(\d+)\]|\[\?\(@\.([\w-]+)\s*(==|!=)\s*'([^']*)'\)\]")
+
+def parse_path(path):
+
+    segments = []
+    position = 0
+    while position < len(path):
+        match = segment_pattern.match(path, position)
+        if not match:
+            raise ValueError('Unsupported path: ${}'.format(path))
+        segments.append(match.groups())
+        position = match.end()
+
+    return segments
+
+def select(value, segments):
+
+    # Returns the value at the path, filters turn the result into a list the remaining
+    # segments are applied to, skipping the items they do not match
+    for index, (name, item_index, field, comparator, literal) in enumerate(segments):
+        if field is not None:
+            if not isinstance(value, list):
+                raise PathMissing(field)
+            matches = [
+                item for item in value
+                if isinstance(item, dict) and field in item and (item[field] == literal) == (comparator == '==')
+            ]
+            results = []
+            for item in matches:
+                try:
+                    results.append(select(item, segments[index + 1:]))
+                except PathMissing:
+                    pass
+            return results
+        if name is not None:
+            if not isinstance(value, dict) or name not in value:
+                raise PathMissing(name)
+            value = value[name]
+        else:
+            if not isinstance(value, list) or int(item_index) >= len(value):
+                raise PathMissing(item_index)
+            value = value[int(item_index)]
+
+    return value
+
+def read_path(path, data, context=None):
+
+    if path.startswith('$$'):
+        return select(context or {}, parse_path(path[2:]))
+    if path.startswith('$'):
+        return select(data, parse_path(path[1:]))
+
+    raise ValueError('Unsupported path: {}'.format(path))
+
+def write_path(path, data, value):
+
+    # ResultPath, a null path discards the result and $ replaces the input
+    if path is None:
+        return data
+    if path == '$':
+        return value
+
+    data = copy.copy(data) if isinstance(data, dict) else {}
+    target = data
+    segments = parse_path(path[1:])
+    for name, item_index, field, comparator, literal in segments[:-1]:
+        if name is None:
+            raise ValueError('Unsupported result path: {}'.format(path))
+        target[name] = copy.copy(target.get(name)) if isinstance(target.get(name), dict) else {}
+        target = target[name]
+    target[segments[-1][0]] = value
+
+    return data
+
+# Payload templates ------------------------------------
+
+intrinsic_pattern = re.compile(r'^States\.(\w+)\((.*)\)$')
+
+def intrinsic(expression, data, context):
+
+    match = intrinsic_pattern.match(expression)
+    name, arguments = match.groups()
+    values = [read_path(argument.strip(), data, context) for argument in arguments.split(',') if argument.strip()]
+
+    if name == 'Array':
+        return values
+
+    raise ValueError('Unsupported intrinsic function: States.{}'.format(name))
+
+def payload(template, data, context=None):
+
+    if isinstance(template, dict):
+        result = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                result[key[:-2]] = intrinsic(value, data, context) if value.startswith('States.') else read_path(value, data, context)
+            else:
+                result[key] = payload(value, data, context)
+        return result
+
+    if isinstance(template, list):
+        return [payload(value, data, context) for value in template]
+
+    return template
+
+# Choice rules -----------------------------------------
+
+comparators = {
+    'StringEquals': lambda value, other: value == other,
+    'BooleanEquals': lambda value, other: value == other,
+    'NumericEquals': lambda value, other: value == other,
+    'NumericLessThan': lambda value, other: value < other,
+    'NumericLessThanEquals': lambda value, other: value <= other,
+    'NumericGreaterThan': lambda value, other: value > other,
+    'NumericGreaterThanEquals': lambda value, other: value >= other,
+    'StringLessThan': lambda value, other: value < other,
+    'StringGreaterThan': lambda value, other: value > other
+}
+
+def matches(rule, data):
+
+    if 'And' in rule:
+        return all(matches(inner, data) for inner in rule['And'])
+    if 'Or' in rule:
+        return any(matches(inner, data) for inner in rule['Or'])
+    if 'Not' in rule:
+        return not matches(rule['Not'], data)
+
+    try:
+        value = read_path(rule['Variable'], data)
+        present = True
+    except PathMissing:
+        value = None
+        present = False
+
+    if 'IsPresent' in rule:
+        return present == rule['IsPresent']
+    if not present:
+        return False
+
+    for comparator, compare in comparators.items():
+        if comparator in rule:
+            return compare(value, rule[comparator])
+        if comparator + 'Path' in rule:
+            return compare(value, read_path(rule[comparator + 'Path'], data))
+
+    raise ValueError('Unsupported choice rule: {}'.format(rule))
+
+def error_matches(error_equals, error):
+    # States.TaskFailed matches every error of a task but a timeout
+    if 'States.TaskFailed' in error_equals and error != 'States.Timeout':
+        return True
+    return 'States.ALL' in error_equals or error in error_equals
+
+# Interpreter ------------------------------------------
+
+class StateMachine(object):
+
+    def __init__(self, definition, tasks):
+        self.definition = definition
+        self.tasks = tasks
+        self.transitions = 0
+
+    def run(self, execution_input):
+        return self.run_states(self.definition, execution_input, {'Execution': {'Input': execution_input}})
+
+    def run_states(self, machine, data, context):
+
+        name = machine['StartAt']
+        while True:
+            self.transitions += 1
+            state = machine['States'][name]
+            data, name = self.run_state(state, data, context)
+            if name is None:
+                return data
+
+    def run_state(self, state, data, context):
+
+        state_type = state['Type']
+
+        if state_type == 'Choice':
+            for rule in state['Choices']:
+                if matches(rule, data):
+                    return data, rule['Next']
+            if 'Default' not in state:
+                raise StateMachineFailed('States.NoChoiceMatched')
+            return data, state['Default']
+
+        if state_type == 'Succeed':
+            return data, None
+
+        if state_type == 'Fail':
+            raise StateMachineFailed(state.get('Error'), state.get('Cause'))
+
+        state_input = read_path(state.get('InputPath', '$'), data, context) if state.get('InputPath', '$') is not None else {}
+
+        if state_type == 'Pass':
+            result = payload(state['Parameters'], state_input, context) if 'Parameters' in state else state.get('Result', state_input)
+        elif state_type == 'Task':
+            try:
+                result = self.run_task(state, state_input, context)
+            except Exception as e:
+                error = getattr(e, 'error', type(e).__name__)
+                for catcher in state.get('Catch', []):
+                    if error_matches(catcher['ErrorEquals'], error):
+                        failure = {'Error': error, 'Cause': str(e)}
+                        return write_path(catcher.get('ResultPath', '$'), data, failure), catcher['Next']
+                raise
+        elif state_type == 'Map':
+            result = self.run_map(state, state_input, context)
+        elif state_type == 'Parallel':
+            result = [self.run_states(branch, copy.deepcopy(state_input), context) for branch in state['Branches']]
+        else:
+            raise ValueError('Unsupported state type: {}'.format(state_type))
+
+        if 'ResultSelector' in state:
+            result = payload(state['ResultSelector'], result, context)
+
+        output = write_path(state.get('ResultPath', '$'), data, result)
+        if state.get('OutputPath', '$') is None:
+            output = {}
+        elif state.get('OutputPath', '$') != '$':
+            output = read_path(state['OutputPath'], output, context)
+
+        return output, None if state.get('End') else state['Next']
+
+    def run_task(self, state, state_input, context):
+
+        task_input = payload(state['Parameters'], state_input, context) if 'Parameters' in state else state_input
+        attempts = {}
+
+        while True:
+            try:
+                return self.tasks[state['Resource']](copy.deepcopy(task_input))
+            except Exception as e:
+                error = getattr(e, 'error', type(e).__name__)
+                retrier = next((retrier for retrier in state.get('Retry', []) if error_matches(retrier['ErrorEquals'], error)), None)
+                if retrier is None:
+                    raise
+                key = id(retrier)
+                attempts[key] = attempts.get(key, 0) + 1
+                if attempts[key] > retrier.get('MaxAttempts', 3):
+                    raise
+
+    def run_map(self, state, state_input, context):
+
+        items = read_path(state.get('ItemsPath', '$'), state_input, context)
+        processor = state.get('ItemProcessor', state.get('Iterator'))
+        selector = state.get('ItemSelector', state.get('Parameters'))
+
+        results = []
+        for index, item in enumerate(items):
+            item_context = dict(context, Map={'Item': {'Index': index, 'Value': item}})
+            item_input = payload(selector, state_input, item_context) if selector is not None else item
+            results.append(self.run_states(processor, item_input, item_context))
+
+        return results
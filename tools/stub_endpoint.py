@@ -0,0 +1,251 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# A local HTTP endpoint answering the AWS API calls made by the functions with canned,
+# successful responses. Point the SDK at it with AWS_ENDPOINT_URL to run handlers without
+# an AWS account, the SDK still builds, signs, sends and parses every request.
+#
+#   endpoint = StubEndpoint().start()
+#   os.environ['AWS_ENDPOINT_URL'] = endpoint.url
+#
+# Callers can replace or add responses per operation, a response function raising
+# StubError answers with that AWS error instead. StubTransport answers in-process.
+
+import json
+import threading
+
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+ec2_namespace = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+
+class StubError(Exception):
+
+    def __init__(self, code, message, status=400, **fields):
+        super(StubError, self).__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+        self.fields = fields
+
+def indexed_values(params, prefix):
+    values = []
+    index = 1
+    while '{}.{}'.format(prefix, index) in params:
+        values.append(params['{}.{}'.format(prefix, index)])
+        index += 1
+    return values
+
+def filter_values(params, name):
+    index = 1
+    while 'Filter.{}.Name'.format(index) in params:
+        if params['Filter.{}.Name'.format(index)] == name:
+            return indexed_values(params, 'Filter.{}.Value'.format(index))
+        index += 1
+    return []
+
+def xml_response(action, body):
+    return '<{0}Response xmlns="{1}"><requestId>00000000-0000-0000-0000-000000000000</requestId>{2}</{0}Response>'.format(action, ec2_namespace, body)
+
+def describe_instances(params, tags=(('Name', 'stub'),)):
+
+    instance_ids = indexed_values(params, 'InstanceId') or filter_values(params, 'instance-id')
+    tag_set = ''.join('<item><key>{}</key><value>{}</value></item>'.format(escape(key), escape(value)) for key, value in tags)
+    items = ''.join(
+        '<item><instanceId>{}</instanceId><instanceType>m5.large</instanceType>'
+        '<placement><availabilityZone>us-east-1a</availabilityZone></placement>'
+        '<instanceLifecycle>spot</instanceLifecycle><platformDetails>Linux/UNIX</platformDetails>'
+        '<tagSet>{}</tagSet></item>'.format(escape(instance_id), tag_set)
+        for instance_id in instance_ids)
+
+    return xml_response('DescribeInstances', '<reservationSet><item><reservationId>r-0</reservationId><instancesSet>{}</instancesSet></item></reservationSet>'.format(items))
+
+def describe_instance_types(params):
+
+    items = ''.join(
+        '<item><instanceType>{}</instanceType><vCpuInfo><defaultVCpus>2</defaultVCpus></vCpuInfo>'
+        '<memoryInfo><sizeInMiB>8192</sizeInMiB></memoryInfo>'
+        '<processorInfo><supportedArchitectures><item>x86_64</item></supportedArchitectures></processorInfo></item>'.format(escape(instance_type))
+        for instance_type in indexed_values(params, 'InstanceType'))
+
+    return xml_response('DescribeInstanceTypes', '<instanceTypeSet>{}</instanceTypeSet>'.format(items))
+
+def describe_tags(params, tags=()):
+
+    resource_ids = filter_values(params, 'resource-id')
+    items = ''.join(
+        '<item><resourceId>{}</resourceId><resourceType>instance</resourceType><key>{}</key><value>{}</value></item>'.format(escape(resource_id), escape(key), escape(value))
+        for resource_id in resource_ids for key, value in tags)
+
+    return xml_response('DescribeTags', '<tagSet>{}</tagSet>'.format(items))
+
+def describe_spot_price_history(params):
+
+    # One price per pool, in effect from the start of the requested window
+    product_descriptions = indexed_values(params, 'ProductDescription') or ['Linux/UNIX']
+    items = ''.join(
+        '<item><instanceType>{}</instanceType><productDescription>{}</productDescription><spotPrice>0.034500</spotPrice>'
+        '<timestamp>{}</timestamp><availabilityZone>{}</availabilityZone></item>'.format(
+            escape(instance_type), escape(product_description), escape(params.get('StartTime', '2019-01-01T00:00:00Z')), escape(availability_zone))
+        for availability_zone in filter_values(params, 'availability-zone')
+        for instance_type in indexed_values(params, 'InstanceType')
+        for product_description in product_descriptions)
+
+    return xml_response('DescribeSpotPriceHistory', '<spotPriceHistorySet>{}</spotPriceHistorySet>'.format(items))
+
+def put_record_batch(body):
+    records = body.get('Records', [])
+    return {
+        'FailedPutCount': 0,
+        'Encrypted': False,
+        'RequestResponses': [{'RecordId': str(index)} for index in range(len(records))]
+    }
+
+def start_execution(body):
+    return {
+        'executionArn': '{}:stub'.format(body.get('stateMachineArn', '').replace(':stateMachine:', ':execution:')),
+        'startDate': 0
+    }
+
+# Responses by EC2 Action, for the query protocol
+query_responses = {
+    'DescribeInstances': describe_instances,
+    'DescribeInstanceTypes': describe_instance_types,
+    'DescribeTags': describe_tags,
+    'DescribeSpotPriceHistory': describe_spot_price_history
+}
+
+# Responses by operation in X-Amz-Target, for the JSON protocol. Anything else gets {}
+json_responses = {
+    'PutRecordBatch': put_record_batch,
+    'StartExecution': start_execution
+}
+
+def dispatch(target, body, json_responses, query_responses, calls):
+
+    # Returns the status, content type and body answering a request
+    if target:
+        operation = target.split('.')[-1]
+        calls.append(operation)
+        try:
+            response = json_responses.get(operation, lambda body: {})(json.loads(body or b'{}'))
+        except StubError as e:
+            error = {'__type': e.code, 'message': e.message}
+            error.update(e.fields)
+            return e.status, 'application/x-amz-json-1.0', json.dumps(error)
+        return 200, 'application/x-amz-json-1.0', json.dumps(response)
+
+    params = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+    action = params.get('Action', '')
+    calls.append(action)
+
+    try:
+        if action not in query_responses:
+            raise StubError('InvalidAction', action)
+        return 200, 'text/xml', query_responses[action](params)
+    except StubError as e:
+        return e.status, 'text/xml', '<Response><Errors><Error><Code>{}</Code><Message>{}</Message></Error></Errors></Response>'.format(escape(e.code), escape(e.message))
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status, content_type, response = dispatch(
+            self.headers.get('X-Amz-Target'), body, self.server.json_responses, self.server.query_responses, self.server.calls)
+        self.respond(status, content_type, response)
+
+    def respond(self, status, content_type, body):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class StubEndpoint(object):
+
+    def __init__(self, host='127.0.0.1', port=0, json_overrides=None, query_overrides=None):
+        self.server = ThreadingHTTPServer((host, port), StubRequestHandler)
+        self.server.daemon_threads = True
+        self.server.calls = []
+        self.server.json_responses = dict(json_responses, **(json_overrides or {}))
+        self.server.query_responses = dict(query_responses, **(query_overrides or {}))
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server.server_address)
+
+    @property
+    def calls(self):
+        return self.server.calls
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StubRawResponse(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def stream(self, **kwargs):
+        yield self.data
+
+class StubTransport(object):
+
+    # The same responses without the HTTP round trip: answers each request from the SDK's
+    # before-send event, so clients created from the session afterwards never open a socket
+    #
+    #   transport = StubTransport().install(boto3._get_default_session()._session)
+
+    def __init__(self, json_overrides=None, query_overrides=None):
+        self.calls = []
+        self.json_responses = dict(json_responses, **(json_overrides or {}))
+        self.query_responses = dict(query_responses, **(query_overrides or {}))
+
+    def install(self, session):
+        session.register('before-send', self.send)
+        return self
+
+    def send(self, request, **kwargs):
+
+        from botocore.awsrequest import AWSResponse
+
+        target = request.headers.get('X-Amz-Target')
+        if isinstance(target, bytes):
+            target = target.decode('utf-8')
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif not isinstance(body, bytes):
+            body = body.read()
+
+        status, content_type, response = dispatch(target, body, self.json_responses, self.query_responses, self.calls)
+        data = response.encode('utf-8')
+        return AWSResponse(request.url, status, {'Content-Type': content_type, 'Content-Length': str(len(data))}, StubRawResponse(data))
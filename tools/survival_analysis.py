@@ -0,0 +1,400 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Survival of Spot Instances per capacity pool, from the archived instance records. Each
+# instance is observed from LaunchedTime until its interruption (the event), or until it
+# terminated normally (censored). The archive only holds terminated instances, so on its own
+# the estimate is conditioned on termination: instances still running, the longest lived
+# ones, are missing and the curve and hazard lean towards short lifetimes. With
+# --instance-table the instances of the InstanceMetadataTable that have not terminated are
+# added, censored at --as-of unless they got an interruption warning. Reports the
+# Kaplan-Meier survival curve of instance lifetime and the interruption hazard by instance
+# age, per pool or any grouping of Region, AvailabilityZone and InstanceType.
+#
+#   python -m tools.survival_analysis s3://BUCKET/instances/ --instance-table INSTANCE_METADATA_TABLE --group-by AvailabilityZone InstanceType
+#   python -m tools.survival_analysis ./archive/parquet/instances --ages 1 6 24 --output survival.json
+#
+# Objects are parsed into columns by Arrow (JSON lines, gzip or the compacted Parquet), and
+# the estimates are computed over NumPy arrays sorted once by group and lifetime, so the
+# work per row is vectorized and the Python loops only run per object and per group.
+
+import io
+import sys
+import gzip
+import json
+import argparse
+import datetime
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from tools.archive import open_store, is_instance_object
+from tools.compact_instances import instance_columns
+
+group_columns = ['Region', 'AvailabilityZone', 'InstanceType']
+time_columns = ['LaunchedTime', 'InterruptionTime', 'TerminatedTime', 'LastEventTime']
+
+timestamp = pa.timestamp('s', tz='UTC')
+
+# Only the attributes the analysis reads are parsed
+observation_schema = pa.schema(
+    [(column, timestamp) for column in time_columns] +
+    [('Interrupted', pa.bool_()), ('InstanceLifecycle', pa.string())] +
+    [(column, pa.string()) for column in group_columns]
+)
+
+parquet_columns = {attribute: column for attribute, column, column_type, parse in instance_columns}
+
+def is_archive_object(item):
+    # The JSON lines archive, or its compacted Parquet copy
+    return is_instance_object(item) or (item['Size'] > 0 and item['Key'].endswith('.parquet'))
+
+def read_object(store, key):
+
+    if key.endswith('.parquet'):
+        # Parquet needs a seekable file, S3 bodies are read into memory
+        table = pq.read_table(io.BytesIO(store.read(key)), columns=[parquet_columns[name] for name in observation_schema.names])
+        return table.rename_columns(observation_schema.names).cast(observation_schema)
+
+    stream = store.open(key)
+    try:
+        if key.endswith('.gz'):
+            stream = gzip.GzipFile(fileobj=stream)
+        return pa_json.read_json(stream, parse_options=pa_json.ParseOptions(explicit_schema=observation_schema, unexpected_field_behavior='ignore'))
+    finally:
+        stream.close()
+
+def seconds(column, fill):
+    return pc.fill_null(column.cast(pa.int64()), fill).to_numpy()
+
+def table_observations(table, group_by, as_of, all_lifecycles=False):
+
+    # Returns the group keys, lifetimes in seconds and interruption flags of a table
+    if not all_lifecycles:
+        table = table.filter(pc.equal(table['InstanceLifecycle'], 'spot'))
+
+    launched = seconds(table['LaunchedTime'], -1)
+    interruption = seconds(table['InterruptionTime'], -1)
+    terminated = seconds(table['TerminatedTime'], -1)
+    last_event = seconds(table['LastEventTime'], -1)
+    interrupted = pc.fill_null(table['Interrupted'], False).to_numpy(zero_copy_only=False) | (interruption >= 0)
+
+    # Interrupted instances end at the interruption warning, the others are censored when they
+    # terminated, at their last event, or at the end of the data
+    censored_end = np.where(terminated >= 0, terminated, np.where(last_event >= 0, last_event, as_of))
+    end = np.where(interrupted & (interruption >= 0), interruption, censored_end)
+    lifetime = end - launched
+
+    valid = (launched >= 0) & (lifetime >= 0)
+    if group_by:
+        keys = pc.binary_join_element_wise(*[pc.fill_null(table[column], 'unknown') for column in group_by], '#')
+    else:
+        keys = pa.array(['All'] * table.num_rows, pa.string())
+
+    return pc.filter(keys, pa.array(valid)), lifetime[valid], interrupted[valid]
+
+class Observations(object):
+
+    # Lifetimes and interruption flags of all instances, with integer group codes
+
+    def __init__(self):
+        self.groups = {}
+        self.codes = []
+        self.lifetimes = []
+        self.events = []
+
+    def add(self, keys, lifetimes, events):
+
+        # Local dictionary codes are mapped to global ones, one lookup per distinct group
+        encoded = pc.dictionary_encode(keys).combine_chunks() if isinstance(keys, pa.ChunkedArray) else pc.dictionary_encode(keys)
+        mapping = np.array([self.groups.setdefault(key, len(self.groups)) for key in encoded.dictionary.to_pylist()], dtype=np.int32)
+        indices = encoded.indices.to_numpy(zero_copy_only=False)
+        self.codes.append(mapping[indices] if len(mapping) else np.zeros(0, dtype=np.int32))
+        self.lifetimes.append(lifetimes.astype(np.int64))
+        self.events.append(events.astype(bool))
+
+    def arrays(self):
+        names = [None] * len(self.groups)
+        for key, code in self.groups.items():
+            names[code] = key
+        if not self.codes:
+            return names, np.zeros(0, np.int32), np.zeros(0, np.int64), np.zeros(0, bool)
+        return names, np.concatenate(self.codes), np.concatenate(self.lifetimes), np.concatenate(self.events)
+
+def parse_time(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
+
+def read_instance_table(table_name, workers=4, client=None):
+
+    # The items of the InstanceMetadataTable that launched and have not terminated, as a table
+    # of the observation schema. LastEventTime is left out, so they are censored at the end of
+    # the data. Items expire after INSTANCE_METADATA_ITEM_RETENTION_DAYS, instances running
+    # for longer are not found.
+    import boto3
+    from boto3.dynamodb.types import TypeDeserializer
+
+    client = client or boto3.client('dynamodb')
+    deserializer = TypeDeserializer()
+    attributes = [name for name in observation_schema.names if name != 'LastEventTime'] + ['State']
+
+    def scan(segment):
+        rows = []
+        paginator = client.get_paginator('scan')
+        for page in paginator.paginate(
+                TableName=table_name,
+                Segment=segment,
+                TotalSegments=workers,
+                ProjectionExpression=', '.join('#{}'.format(name) for name in attributes),
+                FilterExpression='attribute_exists(#LaunchedTime) AND #State <> :terminated',
+                ExpressionAttributeNames=dict(('#{}'.format(name), name) for name in attributes),
+                ExpressionAttributeValues={':terminated': {'S': 'terminated'}}):
+            for item in page['Items']:
+                row = dict((name, deserializer.deserialize(value)) for name, value in item.items() if name in observation_schema.names)
+                for column in time_columns:
+                    if isinstance(row.get(column), str):
+                        row[column] = parse_time(row[column])
+                rows.append(row)
+        return rows
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rows = [row for segment in executor.map(scan, range(workers)) for row in segment]
+
+    return pa.Table.from_pylist(rows, schema=observation_schema)
+
+def load_observations(store, group_by, as_of, all_lifecycles=False, workers=4, instance_table=None):
+
+    keys = [item['Key'] for item in store.list() if is_archive_object(item)]
+    observations = Observations()
+
+    def load(key):
+        return table_observations(read_object(store, key), group_by, as_of, all_lifecycles)
+
+    # Arrow parses outside the GIL, objects are read and parsed concurrently
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for keys_array, lifetimes, events in executor.map(load, keys):
+            observations.add(keys_array, lifetimes, events)
+
+    # Instances still running, right-censored
+    if instance_table:
+        observations.add(*table_observations(read_instance_table(instance_table, workers), group_by, as_of, all_lifecycles))
+
+    return observations.arrays()
+
+def sort_observations(codes, lifetimes, events, resolution):
+
+    # One sort by group then lifetime serves the Kaplan-Meier and the hazard estimates
+    lifetimes = (lifetimes // resolution) * resolution
+    order = np.lexsort((lifetimes, codes))
+    return codes[order], lifetimes[order], events[order]
+
+def group_bounds(codes, group_count):
+    # Start and end offset of each group in the sorted arrays
+    starts = np.searchsorted(codes, np.arange(group_count), side='left')
+    ends = np.searchsorted(codes, np.arange(group_count), side='right')
+    return starts, ends
+
+def kaplan_meier(codes, lifetimes, events, group_count):
+
+    # Distinct (group, lifetime) steps: deaths d and the number at risk n at each step, then
+    # S(t) = prod(1 - d/n) as a cumulative sum of logs within each group. Steps where every
+    # instance at risk is interrupted take S to zero, they are counted separately.
+    if len(codes) == 0:
+        return {'Group': codes, 'Time': lifetimes, 'AtRisk': lifetimes, 'Events': lifetimes, 'Survival': np.zeros(0), 'StandardError': np.zeros(0)}
+
+    step_start = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (lifetimes[1:] != lifetimes[:-1])])
+    step_codes = codes[step_start]
+    step_times = lifetimes[step_start]
+    step_counts = np.diff(np.r_[step_start, len(codes)])
+    step_events = np.add.reduceat(events.astype(np.int64), step_start)
+
+    starts, ends = group_bounds(codes, group_count)
+    at_risk = ends[step_codes] - step_start
+
+    survived = at_risk - step_events
+    zero = survived == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_factor = np.where(zero, 0.0, np.log(np.where(zero, 1, survived) / at_risk.astype(float)))
+        greenwood_term = np.where(zero, 0.0, step_events / (at_risk * np.where(zero, 1, survived).astype(float)))
+
+    # Grouped cumulative sums, the running total minus the total before the group's first step
+    first_step = np.searchsorted(step_codes, step_codes, side='left')
+
+    def grouped_cumsum(values):
+        total = np.cumsum(values)
+        before = np.r_[0, total][first_step]
+        return total - before
+
+    survival = np.exp(grouped_cumsum(log_factor)) * (grouped_cumsum(zero.astype(np.int64)) == 0)
+    standard_error = survival * np.sqrt(grouped_cumsum(greenwood_term))
+
+    return {
+        'Group': step_codes,
+        'Time': step_times,
+        'AtRisk': at_risk,
+        'Events': step_events,
+        'Censored': step_counts - step_events,
+        'Survival': survival,
+        'StandardError': standard_error
+    }
+
+def survival_at(curve, group_count, ages):
+
+    # S(age) per group: the survival of the last step at or before the age, 1 before any step
+    result = np.ones((group_count, len(ages)))
+    if len(curve['Group']) == 0:
+        return result
+
+    maximum = int(curve['Time'].max()) + 1
+    keys = curve['Group'].astype(np.int64) * (maximum + 1) + curve['Time']
+    for index, age in enumerate(ages):
+        query = np.arange(group_count, dtype=np.int64) * (maximum + 1) + min(int(age), maximum)
+        position = np.searchsorted(keys, query, side='right') - 1
+        in_group = (position >= 0) & (curve['Group'][np.maximum(position, 0)] == np.arange(group_count))
+        result[:, index] = np.where(in_group, curve['Survival'][np.maximum(position, 0)], 1.0)
+
+    return result
+
+def median_survival(curve, group_count):
+
+    # First lifetime at which the survival drops to 0.5 or below, NaN when it never does
+    median = np.full(group_count, np.nan)
+    below = np.flatnonzero(curve['Survival'] <= 0.5)
+    if len(below):
+        groups, first = np.unique(curve['Group'][below], return_index=True)
+        median[groups] = curve['Time'][below[first]]
+    return median
+
+def hazard(codes, lifetimes, events, group_count, edges):
+
+    # Interruptions per instance-second in each age bin [a, b). Exposure in the bin is
+    # sum(min(t, b) - min(t, a)), and sum(min(t, x)) over a sorted group is the sum of the
+    # lifetimes below x plus x times the number of lifetimes at or above x.
+    edges = np.asarray(edges, dtype=np.int64)
+    starts, ends = group_bounds(codes, group_count)
+    maximum = int(max(lifetimes.max() if len(lifetimes) else 0, edges.max())) + 1
+    keys = codes.astype(np.int64) * (maximum + 1) + lifetimes
+    lifetime_sums = np.r_[0, np.cumsum(lifetimes, dtype=np.float64)]
+    event_counts = np.r_[0, np.cumsum(events, dtype=np.int64)]
+
+    groups = np.arange(group_count, dtype=np.int64)[:, None]
+    positions = np.searchsorted(keys, groups * (maximum + 1) + edges[None, :], side='left')
+
+    below = lifetime_sums[positions] - lifetime_sums[starts][:, None]
+    at_or_above = ends[:, None] - positions
+    truncated_sums = below + edges[None, :] * at_or_above
+
+    exposure = np.diff(truncated_sums, axis=1)
+    interruptions = np.diff(event_counts[positions], axis=1)
+    at_risk = at_or_above[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(exposure > 0, interruptions / exposure, np.nan)
+
+    return {'Interruptions': interruptions, 'ExposureSeconds': exposure, 'AtRisk': at_risk, 'Rate': rate}
+
+def analyze(names, codes, lifetimes, events, ages_hours, hazard_edges_hours, resolution=60):
+
+    group_count = len(names)
+    codes, lifetimes, events = sort_observations(codes, lifetimes, events, resolution)
+
+    curve = kaplan_meier(codes, lifetimes, events, group_count)
+    ages = [hours * 3600 for hours in ages_hours]
+    survival = survival_at(curve, group_count, ages)
+    median = median_survival(curve, group_count)
+    edges = [hours * 3600 for hours in hazard_edges_hours]
+    hazards = hazard(codes, lifetimes, events, group_count, edges)
+
+    instances = np.bincount(codes, minlength=group_count)
+    interruptions = np.bincount(codes, weights=events, minlength=group_count).astype(np.int64)
+
+    results = []
+    for group in range(group_count):
+        results.append({
+            'Group': names[group],
+            'Instances': int(instances[group]),
+            'Interruptions': int(interruptions[group]),
+            'Censored': int(instances[group] - interruptions[group]),
+            'MedianLifetimeHours': None if np.isnan(median[group]) else round(median[group] / 3600.0, 3),
+            'Survival': {str(hours): round(float(value), 4) for hours, value in zip(ages_hours, survival[group])},
+            'Hazard': [
+                {
+                    'AgeHours': [hazard_edges_hours[index], hazard_edges_hours[index + 1]],
+                    'AtRisk': int(hazards['AtRisk'][group, index]),
+                    'Interruptions': int(hazards['Interruptions'][group, index]),
+                    'InterruptionsPerInstanceHour': None if np.isnan(hazards['Rate'][group, index]) else round(float(hazards['Rate'][group, index]) * 3600, 6)
+                }
+                for index in range(len(hazard_edges_hours) - 1)
+            ]
+        })
+
+    return sorted(results, key=lambda result: -result['Instances'])
+
+def print_results(results, ages_hours, min_instances):
+
+    print('{:<40} {:>10} {:>8} {:>10} {}'.format('Group', 'Instances', 'Interr.', 'Median h', ' '.join('{:>8}'.format('S({}h)'.format(hours)) for hours in ages_hours)))
+    for result in results:
+        if result['Instances'] < min_instances:
+            continue
+        median = '-' if result['MedianLifetimeHours'] is None else '{:.2f}'.format(result['MedianLifetimeHours'])
+        print('{:<40} {:>10} {:>8} {:>10} {}'.format(
+            result['Group'], result['Instances'], result['Interruptions'], median,
+            ' '.join('{:>8.4f}'.format(result['Survival'][str(hours)]) for hours in ages_hours)))
+
+    print('')
+    print('Interruptions per instance-hour by age')
+    for result in results:
+        if result['Instances'] < min_instances:
+            continue
+        print('{:<40} {}'.format(result['Group'], ' '.join(
+            '{}-{}h: {}'.format(age_bin['AgeHours'][0], age_bin['AgeHours'][1], '-' if age_bin['InterruptionsPerInstanceHour'] is None else '{:.4f}'.format(age_bin['InterruptionsPerInstanceHour']))
+            for age_bin in result['Hazard'])))
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Kaplan-Meier survival and interruption hazard of Spot Instances from the instance archive.')
+    parser.add_argument('source', help='s3://bucket/instances/, s3://bucket/parquet/instances/ or a local directory')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, for example a local S3 stand-in')
+    parser.add_argument('--instance-table', help='InstanceMetadataTable to add the instances that have not terminated from, censored at --as-of')
+    parser.add_argument('--group-by', nargs='*', default=group_columns, choices=group_columns, help='Columns identifying a group, none for the whole fleet (default: the capacity pool)')
+    parser.add_argument('--ages', type=float, nargs='+', default=[1, 6, 24, 72, 168], help='Instance ages in hours to report the survival at')
+    parser.add_argument('--hazard-bins', type=float, nargs='+', default=[0, 1, 2, 6, 12, 24, 72, 168, 720], help='Edges of the instance age bins of the hazard, in hours')
+    parser.add_argument('--resolution', type=int, default=60, help='Lifetimes are rounded down to this many seconds')
+    parser.add_argument('--as-of', help='End of the data for instances without a termination (ISO 8601, default now, keep the default with --instance-table)')
+    parser.add_argument('--all-lifecycles', action='store_true', help='Include On-Demand Instances')
+    parser.add_argument('--min-instances', type=int, default=1, help='Only print groups with at least this many instances')
+    parser.add_argument('--workers', type=int, default=4, help='Objects read and parsed concurrently')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    as_of = datetime.datetime.fromisoformat(args.as_of.replace('Z', '+00:00')) if args.as_of else datetime.datetime.now(datetime.timezone.utc)
+    store = open_store(args.source, args.endpoint_url)
+
+    names, codes, lifetimes, events = load_observations(store, args.group_by, int(as_of.timestamp()), args.all_lifecycles, args.workers, args.instance_table)
+    results = analyze(names, codes, lifetimes, events, args.ages, args.hazard_bins, args.resolution)
+
+    print_results(results, args.ages, args.min_instances)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Synthetic instances shaped like the records the pipeline archives, for local runs and
+# benchmarks. Generation is seeded so runs are comparable.
+
+import json
+import random
+import datetime
+
+regions = ['us-east-1']
+availability_zones = ['us-east-1a', 'us-east-1b', 'us-east-1c', 'us-east-1d', 'us-east-1f']
+instance_types = ['m5.large', 'm5.xlarge', 'm5.2xlarge', 'c5.large', 'c5.xlarge', 'c5.2xlarge', 'r5.large', 'r5.xlarge', 'm6g.large', 'c6g.xlarge', 'g4dn.xlarge', 'p3.2xlarge']
+
+def isoformat(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def synthetic_tags(rng, count):
+
+    tags = [
+        {'Key': 'aws:autoscaling:groupName', 'Value': 'asg-{}'.format(rng.randint(1, 20))},
+        {'Key': 'Name', 'Value': 'worker-{}'.format(rng.randint(1, 1000))}
+    ]
+    for index in range(len(tags), count):
+        tags.append({'Key': 'team:tag-{:02d}'.format(index), 'Value': 'value-{}'.format(rng.randint(1, 10**6))})
+
+    return tags[:count]
+
+def synthetic_instance(rng, index, launched_time, tag_count=5, interruption_rate=0.3):
+
+    instance_type = rng.choice(instance_types)
+    lifetime = datetime.timedelta(minutes=rng.expovariate(1.0 / 600) + 1)
+    interrupted = rng.random() < interruption_rate
+    terminated_time = launched_time + lifetime
+
+    instance = {
+        'InstanceId': 'i-{:017x}'.format(index),
+        'Region': rng.choice(regions),
+        'AvailabilityZone': rng.choice(availability_zones),
+        'InstanceType': instance_type,
+        'InstanceLifecycle': 'spot' if rng.random() < 0.9 else 'on-demand',
+        'InstanceMetadataEnriched': True,
+        'SpotInstanceRequestId': 'sir-{:08x}'.format(index),
+        'LaunchedTime': isoformat(launched_time),
+        'TerminatedTime': isoformat(terminated_time),
+        'LastEventTime': isoformat(terminated_time),
+        'LastEventType': 'state-change',
+        'State': 'terminated',
+        'ExpirationTime': int(launched_time.timestamp()) + 30*24*60*60,
+        'Tags': synthetic_tags(rng, tag_count),
+        'EventHistory': [
+            {'Name': 'spot-launch', 'Time': isoformat(launched_time), 'State': 'none'},
+            {'Name': 'state-change', 'Time': isoformat(launched_time), 'State': 'running'}
+        ]
+    }
+
+    if interrupted:
+        interruption_time = terminated_time - datetime.timedelta(minutes=2)
+        instance.update({
+            'Interrupted': True,
+            'InterruptedInstanceAction': 'terminate',
+            'InterruptionTime': isoformat(interruption_time)
+        })
+        instance['EventHistory'].append({'Name': 'spot-interruption', 'Time': isoformat(interruption_time), 'State': 'none'})
+
+    instance['EventHistory'].append({'Name': 'state-change', 'Time': isoformat(terminated_time), 'State': 'terminated'})
+
+    return instance
+
+def synthetic_instances(count, start=None, days=1, tag_count=5, seed=7):
+
+    rng = random.Random(seed)
+    if start is None:
+        start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+    for index in range(count):
+        launched_time = start + datetime.timedelta(seconds=rng.uniform(0, days*24*60*60))
+        yield synthetic_instance(rng, index, launched_time, tag_count)
+
+def write_archive(store, count, start=None, days=1, tag_count=5, records_per_object=1000, seed=7):
+
+    # Lay the instances out the way Firehose does, by termination (arrival) hour
+    objects = {}
+    for instance in synthetic_instances(count, start, days, tag_count, seed):
+        terminated_time = datetime.datetime.strptime(instance['TerminatedTime'], '%Y-%m-%dT%H:%M:%SZ')
+        prefix = terminated_time.strftime('instances/dt=%Y-%m-%d/hour=%H/')
+        objects.setdefault(prefix, []).append(json.dumps(instance)+"\n")
+
+    for prefix, lines in objects.items():
+        for part, start_index in enumerate(range(0, len(lines), records_per_object)):
+            store.write('{}instance-metadata-{:05d}'.format(prefix, part), ''.join(lines[start_index:start_index + records_per_object]).encode('utf-8'))
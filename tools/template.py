@@ -0,0 +1,84 @@
+ # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ #
+ # Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ # software and associated documentation files (the "Software"), to deal in the Software
+ # without restriction, including without limitation the rights to use, copy, modify,
+ # merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ # permit persons to whom the Software is furnished to do so.
+ #
+ # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ # INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ # PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Reads template.yaml for the local tools: the EnvironmentSizeMap tiers, the DynamoDB
+# tables and the Data Sink State Machine definition. CloudFormation tags (!Ref, !Sub,
+# !GetAtt, ...) are loaded as their long form, e.g. {'Fn::Sub': ...}.
+
+import os
+import re
+import json
+
+import yaml
+
+from tools import handlers
+
+template_path = os.path.join(handlers.root, 'template.yaml')
+
+class CloudFormationLoader(yaml.SafeLoader):
+    pass
+
+def construct_tag(loader, tag_suffix, node):
+
+    name = 'Ref' if tag_suffix == 'Ref' else 'Fn::{}'.format(tag_suffix)
+
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+        if tag_suffix == 'GetAtt':
+            value = value.split('.', 1)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+
+    return {name: value}
+
+CloudFormationLoader.add_multi_constructor('!', construct_tag)
+
+def load_template(path=None):
+    with open(path or template_path) as f:
+        return yaml.load(f, Loader=CloudFormationLoader)
+
+def environment_size_map(template=None):
+    template = template or load_template()
+    return template['Mappings']['EnvironmentSizeMap']
+
+def resources(template, resource_type):
+    return {
+        name: resource for name, resource in template['Resources'].items()
+        if resource['Type'] == resource_type
+    }
+
+def function_arn(function_name):
+    return 'arn:aws:lambda:us-east-1:123456789012:function:{}'.format(function_name)
+
+def state_machine_definition(template=None, name='DataSinkStateMachine', environment_size='medium'):
+
+    # Resolves the Fn::Sub variables of the definition: function ARNs become local ARNs
+    # named after the function resource, FindInMap values come from the size tier
+    template = template or load_template()
+    definition, variables = template['Resources'][name]['Properties']['DefinitionString']['Fn::Sub']
+    size_map = environment_size_map(template)[environment_size]
+
+    values = {}
+    for variable, value in variables.items():
+        if 'Fn::GetAtt' in value:
+            values[variable] = function_arn(value['Fn::GetAtt'][0])
+        elif 'Fn::FindInMap' in value:
+            values[variable] = str(size_map[value['Fn::FindInMap'][2]])
+        else:
+            raise ValueError('Unsupported substitution for {}: {}'.format(variable, value))
+
+    return json.loads(re.sub(r'\$\{(\w+)\}', lambda match: values[match.group(1)], definition))